@@ -1,21 +1,41 @@
 from __future__ import annotations
 
+import json
 import uuid
+import zipfile
+from collections import Counter
 from datetime import datetime
-from io import BytesIO
+from email.utils import format_datetime
 from pathlib import Path
-from typing import Optional
-from urllib.parse import urlparse
+from typing import AsyncIterator, Optional
+from urllib.parse import quote
 
-from fastapi import APIRouter, Depends, File, Form, HTTPException, UploadFile
-from fastapi.responses import FileResponse, StreamingResponse
+from celery import group
+from fastapi import APIRouter, Depends, File, Form, HTTPException, Request, Response, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
+from redis.exceptions import RedisError
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 
+from app.core import metrics
 from app.core.config import settings
-from app.core.database import get_db
-from app.models import CompressionTask, TaskStatus
-from app.services.storage import get_storage
+from app.core.database import SessionLocal, get_db
+from app.models import CompressionBatch, CompressionTask, TaskStatus
+from app.services import events, result_cache
+from app.services.batch import (
+    BatchTooLargeError,
+    aggregate_status,
+    is_zip_upload,
+    iter_zip_pdfs,
+    stream_zip,
+    unique_name,
+)
+from app.services.cost import DocumentCost, measure_cost
+from app.services.result_cache import CacheAttachment
+from app.services.storage import HashingReader, UploadTooLargeError, get_storage, object_key
+from app.worker.routing import dispatch_options
 from app.worker.tasks import compress_pdf_task
 
 router = APIRouter(prefix="/api/v1")
@@ -26,6 +46,12 @@ class CompressResponse(BaseModel):
     status: str
 
 
+class CompressBatchResponse(BaseModel):
+    batch_id: str
+    task_ids: list[str]
+    status: str
+
+
 class TaskResponse(BaseModel):
     task_id: str
     status: str
@@ -51,80 +77,182 @@ async def create_compression_task(
     if file.content_type != "application/pdf":
         raise HTTPException(status_code=400, detail="Only PDF files are allowed")
 
-    content = await file.read()
-    if len(content) > settings.MAX_UPLOAD_SIZE:
+    if file.size is not None and file.size > settings.MAX_UPLOAD_SIZE:
         raise HTTPException(status_code=413, detail="File too large")
 
     task_id = str(uuid.uuid4())
     original_file_key = f"original/{task_id}.pdf"
 
     storage = get_storage()
-    storage.save(original_file_key, BytesIO(content))
+    upload = HashingReader(file.file, settings.MAX_UPLOAD_SIZE)
+    try:
+        await run_in_threadpool(storage.save, original_file_key, upload)
+    except UploadTooLargeError:
+        await run_in_threadpool(storage.delete, original_file_key)
+        raise HTTPException(status_code=413, detail="File too large")
+
     stored_path = storage.get_path(original_file_key)
     if not stored_path:
         raise HTTPException(status_code=500, detail="Failed to store uploaded file")
 
-    original_size_bytes = len(content)
-    if settings.STORAGE_BACKEND == "local":
-        try:
-            path_obj = Path(stored_path)
-            if path_obj.exists():
-                original_size_bytes = path_obj.stat().st_size
-        except OSError:
-            pass
+    cost = await run_in_threadpool(measure_cost, file.file, upload.size_bytes)
 
     task = CompressionTask(
         id=task_id,
         status=TaskStatus.QUEUED,
         original_filename=file.filename or "unknown.pdf",
         original_file_path=original_file_key,
-        original_size_bytes=original_size_bytes,
+        original_size_bytes=upload.size_bytes,
+        original_sha256=upload.sha256.hexdigest(),
         target_size_mb=target_size_mb,
         min_quality=min_quality,
         max_iterations=max_iterations,
         preserve_metadata=preserve_metadata,
+        cost_class=cost.cost_class,
         created_at=datetime.utcnow(),
         updated_at=datetime.utcnow(),
     )
 
-    db.add(task)
-    db.commit()
+    (attachment,) = result_cache.add_tasks(db, [task])
+    events.cache_task_state(task)
+
+    metrics.UPLOADS.labels("compress").inc()
+    metrics.UPLOAD_BYTES.inc(upload.size_bytes)
+    metrics.RESULT_CACHE_ATTACHMENTS.labels(attachment.value).inc()
 
-    compress_pdf_task.delay(task_id)
+    if attachment == CacheAttachment.LEADER:
+        compress_pdf_task.apply_async((task_id,), **dispatch_options(task.cost_class))
 
     return CompressResponse(task_id=task_id, status=task.status.value)
 
 
 @router.get("/tasks/{task_id}", response_model=TaskResponse)
-def get_task_status(task_id: str, db: Session = Depends(get_db)) -> TaskResponse:
-    task: CompressionTask | None = db.get(CompressionTask, task_id)
-    if task is None:
+def get_task_status(task_id: str) -> TaskResponse:
+    state = _load_task_state(task_id)
+    if state is None:
         raise HTTPException(status_code=404, detail="Task not found")
+    return TaskResponse(**state)
 
-    result_download_url = None
-    if task.status == TaskStatus.COMPLETED and task.compressed_file_path:
-        result_download_url = f"/api/v1/download/{task_id}"
-
-    compressed_size_mb = None
-    if task.compressed_size_bytes is not None:
-        compressed_size_mb = task.compressed_size_bytes / (1024 * 1024)
-
-    return TaskResponse(
-        task_id=task.id,
-        status=task.status.value,
-        original_filename=task.original_filename,
-        original_size_mb=task.original_size_bytes / (1024 * 1024),
-        compressed_size_mb=compressed_size_mb,
-        target_size_mb=task.target_size_mb,
-        created_at=task.created_at.isoformat(),
-        completed_at=task.completed_at.isoformat() if task.completed_at else None,
-        result_download_url=result_download_url,
-        error_message=task.error_message,
+
+def _load_task_state(task_id: str) -> Optional[dict]:
+    # Served from the Redis status cache; the database is only read on a miss.
+    state = events.cached_task_state(task_id)
+    if state is not None:
+        return state
+
+    with SessionLocal() as db:
+        task = db.get(CompressionTask, task_id)
+        if task is None:
+            return None
+        events.cache_task_state(task, overwrite=False)
+        return events.task_state(task)
+
+
+def _sse_message(event_type: str, data: dict) -> str:
+    return f"event: {event_type}\ndata: {json.dumps(data)}\n\n"
+
+
+async def _stream_task_events(
+    request: Request, subscription: events.Subscription, state: dict
+) -> AsyncIterator[str]:
+    try:
+        yield _sse_message("status", {"type": "status", **state})
+        if state["status"] in events.TERMINAL_STATUSES:
+            return
+
+        last_progress = await subscription.last_progress()
+        if last_progress is not None:
+            yield _sse_message("progress", last_progress)
+
+        while not await request.is_disconnected():
+            event = await subscription.next_event(settings.TASK_EVENTS_KEEPALIVE_SECONDS)
+            if event is None:
+                yield ": keepalive\n\n"
+                continue
+            yield _sse_message(event["type"], event)
+            if event["type"] == "status" and event["status"] in events.TERMINAL_STATUSES:
+                return
+    finally:
+        await subscription.close()
+
+
+@router.get("/tasks/{task_id}/events")
+async def stream_task_events(task_id: str, request: Request) -> StreamingResponse:
+    """Server-Sent Events feed of a task: its current state, then live progress until it ends."""
+    # Subscribe before reading the row so a status change in between is not missed.
+    subscription = events.Subscription(task_id)
+    try:
+        await subscription.open()
+    except RedisError:
+        await subscription.close()
+        raise HTTPException(status_code=503, detail="Task events unavailable")
+
+    state = await run_in_threadpool(_load_task_state, task_id)
+    if state is None:
+        await subscription.close()
+        raise HTTPException(status_code=404, detail="Task not found")
+
+    return StreamingResponse(
+        _stream_task_events(request, subscription, state),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
 
 
+def _content_disposition(filename: str) -> str:
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"attachment; filename*=utf-8''{quoted}"
+    return f'attachment; filename="{filename}"'
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    candidates = [value.strip() for value in header.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+
+def _parse_range(header: str, size: int) -> Optional[tuple[int, int]]:
+    """Resolve a single ``bytes=`` range to inclusive offsets; None serves the whole file."""
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+
+    first, _, last = spec.strip().partition("-")
+    try:
+        if not first:
+            suffix = int(last)
+            if suffix <= 0:
+                raise ValueError
+            start, end = max(size - suffix, 0), size - 1
+        else:
+            start = int(first)
+            end = int(last) if last else size - 1
+            if last and end < start:
+                return None
+    except ValueError:
+        return None
+
+    if start >= size:
+        raise HTTPException(
+            status_code=416,
+            detail="Requested range not satisfiable",
+            headers={"Content-Range": f"bytes */{size}"},
+        )
+    return start, min(end, size - 1)
+
+
+def _accel_redirect_path(compressed_path: Path) -> Optional[str]:
+    if not settings.DOWNLOAD_ACCEL_REDIRECT_PREFIX:
+        return None
+    try:
+        relative = compressed_path.resolve().relative_to(Path(settings.STORAGE_PATH).resolve())
+    except ValueError:
+        return None
+    return settings.DOWNLOAD_ACCEL_REDIRECT_PREFIX.rstrip("/") + "/" + quote(relative.as_posix())
+
+
 @router.get("/download/{task_id}")
-def download_compressed_file(task_id: str, db: Session = Depends(get_db)):
+def download_compressed_file(task_id: str, request: Request, db: Session = Depends(get_db)):
     task: CompressionTask | None = db.get(CompressionTask, task_id)
     if task is None or task.status != TaskStatus.COMPLETED:
         raise HTTPException(status_code=404, detail="File not found")
@@ -133,6 +261,7 @@ def download_compressed_file(task_id: str, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Compressed file not available")
 
     filename = f"compressed_{task.original_filename}"
+    storage = get_storage()
 
     if settings.STORAGE_BACKEND == "local":
         compressed_path = Path(task.compressed_file_path)
@@ -141,31 +270,240 @@ def download_compressed_file(task_id: str, db: Session = Depends(get_db)):
         if not compressed_path.exists():
             raise HTTPException(status_code=404, detail="File does not exist")
 
-        return FileResponse(
-            path=compressed_path,
-            media_type="application/pdf",
-            filename=filename,
-        )
+        # Let the reverse proxy send the file itself (sendfile, ranges, conditionals).
+        accel_path = _accel_redirect_path(compressed_path)
+        if accel_path:
+            return Response(
+                media_type="application/pdf",
+                headers={
+                    "X-Accel-Redirect": accel_path,
+                    "Content-Disposition": _content_disposition(filename),
+                },
+            )
+        key = str(compressed_path)
     else:
-        storage = get_storage()
-        reference = task.compressed_file_path
-        key = reference
-        if reference.startswith("http"):
-            parsed = urlparse(reference)
-            path = parsed.path.lstrip("/")
-            if path:
-                parts = path.split("/", 1)
-                if len(parts) == 2:
-                    key = parts[1]
-                else:
-                    key = parts[0]
+        key = object_key(task.compressed_file_path)
+
+    try:
+        info = storage.stat(key)
+    except Exception:
+        raise HTTPException(status_code=404, detail="File does not exist in storage")
+
+    headers = {
+        "Accept-Ranges": "bytes",
+        "ETag": info.etag,
+        "Content-Disposition": _content_disposition(filename),
+    }
+    if info.last_modified is not None:
+        headers["Last-Modified"] = format_datetime(info.last_modified, usegmt=True)
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and _etag_matches(if_none_match, info.etag):
+        return Response(status_code=304, headers=headers)
+
+    byte_range = None
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (not if_range or if_range.strip() == info.etag):
+        byte_range = _parse_range(range_header, info.size_bytes)
+
+    status_code = 200
+    start, end = 0, info.size_bytes - 1
+    if byte_range is not None:
+        start, end = byte_range
+        status_code = 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{info.size_bytes}"
+    headers["Content-Length"] = str(max(end - start + 1, 0))
+
+    body = storage.iter_range(key, start, end) if end >= start else iter(())
+    return StreamingResponse(
+        body,
+        status_code=status_code,
+        media_type="application/pdf",
+        headers=headers,
+    )
+
+
+class BatchResponse(BaseModel):
+    batch_id: str
+    status: str
+    task_count: int
+    status_counts: dict[str, int]
+    tasks: list[TaskResponse]
+    result_download_url: Optional[str] = None
+
 
+class _StoredUpload:
+    def __init__(
+        self, task_id: str, filename: str, file_key: str, upload: HashingReader, cost: DocumentCost
+    ):
+        self.task_id = task_id
+        self.filename = filename
+        self.file_key = file_key
+        self.size_bytes = upload.size_bytes
+        self.sha256 = upload.sha256.hexdigest()
+        self.cost = cost
+
+
+def _store_batch_files(files: list[UploadFile]) -> list[_StoredUpload]:
+    """Store every PDF of a batch upload (loose files and ZIP members) under its own key.
+
+    Runs in the threadpool. On any error the files stored so far are deleted again.
+    """
+    storage = get_storage()
+    stored: list[_StoredUpload] = []
+
+    def store(filename: str, fileobj, *, seekable: bool) -> None:
+        if len(stored) >= settings.BATCH_MAX_FILES:
+            raise BatchTooLargeError(f"A batch holds at most {settings.BATCH_MAX_FILES} files")
+        task_id = str(uuid.uuid4())
+        file_key = f"original/{task_id}.pdf"
+        upload = HashingReader(fileobj, settings.MAX_UPLOAD_SIZE)
         try:
-            file_data = storage.get(key)
-            return StreamingResponse(
-                BytesIO(file_data),
-                media_type="application/pdf",
-                headers={"Content-Disposition": f'attachment; filename="{filename}"'},
-            )
+            storage.save(file_key, upload)
         except Exception:
-            raise HTTPException(status_code=404, detail="File does not exist in storage")
+            storage.delete(file_key)
+            raise
+        # Seeking back in a ZIP member re-inflates it from the start, so archived files
+        # are routed on their size alone.
+        if seekable:
+            cost = measure_cost(fileobj, upload.size_bytes)
+        else:
+            cost = DocumentCost(upload.size_bytes)
+        stored.append(_StoredUpload(task_id, filename, file_key, upload, cost))
+
+    try:
+        for file in files:
+            if is_zip_upload(file.content_type, file.filename):
+                for filename, entry in iter_zip_pdfs(file.file):
+                    store(filename, entry, seekable=False)
+            else:
+                store(file.filename or "unknown.pdf", file.file, seekable=True)
+    except Exception:
+        for upload in stored:
+            storage.delete(upload.file_key)
+        raise
+    return stored
+
+
+@router.post("/batches", response_model=CompressBatchResponse, status_code=201)
+async def create_compression_batch(
+    files: list[UploadFile] = File(..., description="PDF files and/or ZIP archives of PDFs"),
+    target_size_mb: float = Form(..., description="Target output size in MB, per file", gt=0),
+    min_quality: int = Form(20, ge=1, le=100),
+    max_iterations: int = Form(6, ge=1, le=20),
+    preserve_metadata: bool = Form(False),
+    db: Session = Depends(get_db),
+) -> CompressBatchResponse:
+    for file in files:
+        if file.content_type != "application/pdf" and not is_zip_upload(file.content_type, file.filename):
+            raise HTTPException(status_code=400, detail="Only PDF files and ZIP archives are allowed")
+
+    try:
+        stored = await run_in_threadpool(_store_batch_files, files)
+    except UploadTooLargeError:
+        raise HTTPException(status_code=413, detail="File too large")
+    except BatchTooLargeError as exc:
+        raise HTTPException(status_code=413, detail=str(exc))
+    except zipfile.BadZipFile:
+        raise HTTPException(status_code=400, detail="Invalid ZIP archive")
+
+    if not stored:
+        raise HTTPException(status_code=400, detail="No PDF files found")
+
+    batch_id = str(uuid.uuid4())
+    now = datetime.utcnow()
+    tasks = [
+        CompressionTask(
+            id=upload.task_id,
+            batch_id=batch_id,
+            status=TaskStatus.QUEUED,
+            original_filename=upload.filename,
+            original_file_path=upload.file_key,
+            original_size_bytes=upload.size_bytes,
+            original_sha256=upload.sha256,
+            target_size_mb=target_size_mb,
+            min_quality=min_quality,
+            max_iterations=max_iterations,
+            preserve_metadata=preserve_metadata,
+            cost_class=upload.cost.cost_class,
+            created_at=now,
+            updated_at=now,
+        )
+        for upload in stored
+    ]
+    batch = CompressionBatch(id=batch_id, task_count=len(stored), created_at=now)
+    attachments = result_cache.add_tasks(db, tasks, batch)
+    leaders = [task for task, attachment in zip(tasks, attachments) if attachment == CacheAttachment.LEADER]
+    for attachment in attachments:
+        metrics.RESULT_CACHE_ATTACHMENTS.labels(attachment.value).inc()
+
+    metrics.UPLOADS.labels("batch").inc(len(stored))
+    metrics.UPLOAD_BYTES.inc(sum(upload.size_bytes for upload in stored))
+
+    if leaders:
+        group(
+            compress_pdf_task.s(task.id).set(**dispatch_options(task.cost_class)) for task in leaders
+        ).apply_async(task_id=batch_id)
+
+    return CompressBatchResponse(
+        batch_id=batch_id,
+        task_ids=[task.id for task in tasks],
+        status=aggregate_status(task.status for task in tasks),
+    )
+
+
+def _batch_tasks(db: Session, batch_id: str) -> list[CompressionTask]:
+    tasks = db.scalars(
+        select(CompressionTask).where(CompressionTask.batch_id == batch_id).order_by(CompressionTask.created_at)
+    ).all()
+    if not tasks:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return list(tasks)
+
+
+@router.get("/batches/{batch_id}", response_model=BatchResponse)
+def get_batch_status(batch_id: str, db: Session = Depends(get_db)) -> BatchResponse:
+    tasks = _batch_tasks(db, batch_id)
+    status_counts = Counter(task.status.value for task in tasks)
+
+    result_download_url = None
+    if any(task.status == TaskStatus.COMPLETED and task.compressed_file_path for task in tasks):
+        result_download_url = f"/api/v1/batches/{batch_id}/download"
+
+    return BatchResponse(
+        batch_id=batch_id,
+        status=aggregate_status(task.status for task in tasks),
+        task_count=len(tasks),
+        status_counts=dict(status_counts),
+        tasks=[TaskResponse(**events.task_state(task)) for task in tasks],
+        result_download_url=result_download_url,
+    )
+
+
+@router.get("/batches/{batch_id}/download")
+def download_batch(batch_id: str, db: Session = Depends(get_db)) -> StreamingResponse:
+    """Stream every completed result of a batch as one ZIP archive."""
+    completed = [
+        task
+        for task in _batch_tasks(db, batch_id)
+        if task.status == TaskStatus.COMPLETED and task.compressed_file_path
+    ]
+    if not completed:
+        raise HTTPException(status_code=404, detail="No compressed files available")
+
+    storage = get_storage()
+    used_names: set[str] = set()
+    entries = [
+        (
+            unique_name(f"compressed_{task.original_filename}", used_names),
+            object_key(task.compressed_file_path),
+        )
+        for task in completed
+    ]
+
+    return StreamingResponse(
+        stream_zip((name, storage.iter_range(key)) for name, key in entries),
+        media_type="application/zip",
+        headers={"Content-Disposition": _content_disposition(f"batch_{batch_id}.zip")},
+    )
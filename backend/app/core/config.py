@@ -1,7 +1,8 @@
 from functools import lru_cache
 from pathlib import Path
-from typing import Literal
+from typing import Literal, Optional
 
+from pydantic import AliasChoices, Field
 from pydantic_settings import BaseSettings
 
 
@@ -18,12 +19,16 @@ class Settings(BaseSettings):
     # Storage configuration
     STORAGE_BACKEND: Literal["local", "minio"] = "local"
     STORAGE_PATH: Path = Path("/app-data/files")
+    # Internal nginx location aliased to STORAGE_PATH; local downloads are handed off to it.
+    DOWNLOAD_ACCEL_REDIRECT_PREFIX: Optional[str] = None
 
     # MinIO configuration
     MINIO_ENDPOINT: str = "http://minio:9000"
     MINIO_ACCESS_KEY: str = "admin"
     MINIO_SECRET_KEY: str = "password"
     MINIO_BUCKET: str = "pdf-files"
+    MINIO_POOL_MAXSIZE: int = 32  # pooled connections per process
+    MINIO_READ_TIMEOUT: int = 300
 
     # Database
     DATABASE_URL: str = "sqlite:///./data/db.sqlite3"
@@ -31,10 +36,70 @@ class Settings(BaseSettings):
     # Redis / Celery
     REDIS_URL: str = "redis://redis:6379/0"
 
+    # Cost-class routing: each class has its own queue and worker pool
+    # A job is heavy past any heavy threshold, small within every small one, else standard
+    COST_SMALL_MAX_BYTES: int = 2 * 1024 * 1024
+    COST_SMALL_MAX_PAGES: int = 20
+    COST_SMALL_MAX_MEGAPIXELS: float = 40.0  # summed over the document's unique images
+    COST_HEAVY_MIN_BYTES: int = 20 * 1024 * 1024
+    COST_HEAVY_MIN_PAGES: int = 300
+    COST_HEAVY_MIN_MEGAPIXELS: float = 600.0
+    COST_SMALL_SOFT_TIME_LIMIT: int = 120  # seconds; the hard limit adds TASK_TIME_LIMIT_GRACE
+    COST_STANDARD_SOFT_TIME_LIMIT: int = 600
+    COST_HEAVY_SOFT_TIME_LIMIT: int = 1800
+    TASK_TIME_LIMIT_GRACE: int = 60
+    # Set per worker deployment: consume only this class's queue with its prefetch/ack profile
+    WORKER_COST_CLASS: Optional[Literal["small", "standard", "heavy"]] = None
+    WORKER_MAX_MEMORY_PER_CHILD_KB: int = 0  # recycle pool children above this RSS; 0 disables
+
+    # Task progress events (Redis pub/sub, streamed to clients over SSE)
+    TASK_EVENTS_TTL_SECONDS: int = 3600  # how long the latest progress event is kept
+    TASK_EVENTS_KEEPALIVE_SECONDS: float = 15.0
+    TASK_STATE_CACHE_TTL_SECONDS: int = 86400  # queued/running status responses
+    TASK_STATE_CACHE_FINISHED_TTL_SECONDS: int = 3600  # completed/failed status responses
+
+    # Metrics (Prometheus); the API serves /metrics itself, workers run an exporter
+    WORKER_METRICS_PORT: int = 9101  # 0 disables the worker exporter
+
     # Upload constraints
     MAX_UPLOAD_SIZE: int = 50 * 1024 * 1024  # 50MB
+    MAX_BATCH_UPLOAD_SIZE: int = 500 * 1024 * 1024  # whole request body of a batch upload
+    BATCH_MAX_FILES: int = 500
     ALLOWED_EXTENSIONS: tuple[str, ...] = (".pdf",)
 
+    # Compression engine
+    IMAGE_CACHE_MAX_BYTES: int = 256 * 1024 * 1024  # decoded pixels kept in memory per job
+    IMAGE_CACHE_SPILL_MAX_BYTES: int = 1024 * 1024 * 1024  # memory-mapped scratch file per job
+    IMAGE_CACHE_SCRATCH_DIR: Optional[Path] = None
+    COMPRESS_IMAGE_WORKERS: int = 1  # threads per job for decode/resize/encode; 1 disables the pool
+    COMPRESS_SPOOL_MAX_BYTES: int = 64 * 1024 * 1024  # candidate saves above this spill to a temp file
+    # "fast" checks search points with non-linearized saves; "final" linearizes every check
+    COMPRESS_SEARCH_SAVE_PROFILE: Literal["fast", "final"] = "fast"
+    # Small (below COMPRESS_SMALL_IMAGE_BYTES), bilevel or already low-quality JPEG images keep
+    # their bytes without being decoded, up to this share of the image bytes or of the target
+    COMPRESS_SMALL_IMAGE_BYTES: int = 16 * 1024
+    COMPRESS_SKIP_BYTES_SHARE: float = 0.05
+    # Resolutions images are downsampled to, by where they are drawn; detail above the
+    # highest is dropped first since the page never shows it
+    COMPRESS_TARGET_DPI: tuple[int, ...] = (300, 200, 150, 100)
+
+    # Result cache keyed by input content hash + compression parameters
+    RESULT_CACHE_ENABLED: bool = True
+    # Result bytes the cache keeps shareable with new uploads. Results stay on disk with
+    # the tasks that own them, so this bounds the index, not disk use. The earlier name
+    # RESULT_CACHE_MAX_BYTES is still read.
+    RESULT_CACHE_INDEX_MAX_BYTES: int = Field(
+        10 * 1024 * 1024 * 1024,
+        validation_alias=AliasChoices("RESULT_CACHE_INDEX_MAX_BYTES", "RESULT_CACHE_MAX_BYTES"),
+    )
+    RESULT_CACHE_TTL_SECONDS: int = 7 * 24 * 3600  # since last use
+
+    # Sharded execution of large documents across workers (0 disables a threshold)
+    SHARD_PAGE_THRESHOLD: int = 500
+    SHARD_SIZE_THRESHOLD: int = 0
+    SHARD_PAGES_PER_CHUNK: int = 100
+    SHARD_PLAN_SAMPLE_IMAGES: int = 48  # images encoded to plan quality/scale before fan-out
+
     class Config:
         env_file = ".env"
         env_file_encoding = "utf-8"
@@ -1,8 +1,9 @@
 from pathlib import Path
 
-from sqlalchemy import create_engine
+from sqlalchemy import Column, Connection, Engine, create_engine, inspect, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.types import SchemaType
 
 from app.core.config import settings
 
@@ -22,6 +23,10 @@ SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
 
+# Columns earlier versions created that the models no longer map. They are required, so
+# inserts that omit them would fail until they are dropped.
+_DROPPED_COLUMNS = {"result_cache": ("ref_count",)}
+
 
 def get_db():
     db = SessionLocal()
@@ -29,3 +34,46 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+def upgrade_schema(bind: Engine = engine) -> None:
+    """Create missing tables, and add the columns models gained since a table was created.
+
+    ``create_all`` never alters an existing table, so a database created by an earlier
+    version would fail every query that names a newer column. New columns are nullable
+    (or have a scalar default), so ``ALTER TABLE ... ADD COLUMN`` fills existing rows.
+    Their indexes are created with them, and columns listed in ``_DROPPED_COLUMNS`` are
+    dropped.
+    """
+    Base.metadata.create_all(bind=bind)
+    inspector = inspect(bind)
+    with bind.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            added = [column for column in table.columns if column.name not in existing]
+            for column in added:
+                ddl = _column_ddl(column, connection)
+                connection.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {ddl}"))
+            for index in table.indexes:
+                if any(column in added for column in index.columns):
+                    index.create(connection)
+            for name in _DROPPED_COLUMNS.get(table.name, ()):
+                if name in existing:
+                    connection.execute(text(f"ALTER TABLE {table.name} DROP COLUMN {name}"))
+
+
+def _column_ddl(column: Column, connection: Connection) -> str:
+    if isinstance(column.type, SchemaType):
+        column.type.create(connection, checkfirst=True)  # named types, e.g. PostgreSQL enums
+    ddl = f"{column.name} {column.type.compile(dialect=connection.dialect)}"
+    for foreign_key in column.foreign_keys:
+        ddl += f" REFERENCES {foreign_key.column.table.name} ({foreign_key.column.name})"
+    default = column.default.arg if column.default is not None and column.default.is_scalar else None
+    if default is not None:
+        literal = column.type.literal_processor(connection.dialect)
+        ddl += f" DEFAULT {literal(default) if literal else default}"
+    if not column.nullable:
+        if default is None:
+            raise RuntimeError(f"Cannot add required column {column.table.name}.{column.name} without a default")
+        ddl += " NOT NULL"
+    return ddl
@@ -0,0 +1,114 @@
+from __future__ import annotations
+
+import os
+from pathlib import Path
+from typing import Optional
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+    start_http_server,
+)
+
+from app.services.trace import CompressionTrace
+
+_SECONDS_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "smartpdf_http_request_seconds",
+    "API request latency by route.",
+    ["method", "route", "status"],
+)
+UPLOADS = Counter("smartpdf_uploads_total", "PDF files accepted for compression.", ["endpoint"])
+UPLOAD_BYTES = Counter("smartpdf_upload_bytes_total", "Bytes of PDF accepted for compression.")
+RESULT_CACHE_ATTACHMENTS = Counter(
+    "smartpdf_result_cache_attachments_total",
+    "New tasks by how they attached to the result cache.",
+    ["attachment"],
+)
+
+TASKS = Counter("smartpdf_tasks_total", "Compression tasks finished, by outcome.", ["status"])
+COMPRESSION_SECONDS = Histogram(
+    "smartpdf_compression_seconds", "Wall time of compress_pdf per job.", buckets=_SECONDS_BUCKETS
+)
+PHASE_SECONDS = Histogram(
+    "smartpdf_compression_phase_seconds",
+    "Time per job in each compression phase (summed across image threads).",
+    ["phase"],
+    buckets=_SECONDS_BUCKETS,
+)
+ITERATIONS = Histogram(
+    "smartpdf_compression_iterations",
+    "Trial saves per job.",
+    buckets=(0, 1, 2, 3, 4, 5, 6, 8, 10),
+)
+SAVES = Counter("smartpdf_compression_saves_total", "Document saves, by save profile.", ["profile"])
+IMAGES = Counter("smartpdf_compression_images_total", "Images considered for recompression.")
+IMAGES_SKIPPED = Counter(
+    "smartpdf_compression_images_skipped_total",
+    "Images kept as they are without decoding, by reason.",
+    ["reason"],
+)
+IMAGE_BYTES = Counter(
+    "smartpdf_compression_image_bytes_total",
+    "Image payload bytes before (in) and after (out) compression.",
+    ["direction"],
+)
+SIZE_TO_TARGET = Histogram(
+    "smartpdf_compression_size_to_target_ratio",
+    "Output size divided by the requested target size.",
+    buckets=(0.5, 0.8, 0.9, 0.95, 1.0, 1.05, 1.1, 1.25, 1.5, 2, 5),
+)
+
+
+def observe_compression(trace: CompressionTrace, *, size_bytes: int, target_bytes: int) -> None:
+    if trace.wall_seconds is not None:
+        COMPRESSION_SECONDS.observe(trace.wall_seconds)
+    for phase, seconds in trace.phase_seconds.items():
+        PHASE_SECONDS.labels(phase).observe(seconds)
+    for profile, count in trace.saves.items():
+        SAVES.labels(profile).inc(count)
+    ITERATIONS.observe(len(trace.iterations))
+    IMAGES.inc(trace.image_count)
+    for reason, count in trace.images_skipped.items():
+        IMAGES_SKIPPED.labels(reason).inc(count)
+    IMAGE_BYTES.labels("in").inc(trace.image_bytes_in)
+    IMAGE_BYTES.labels("out").inc(trace.image_bytes_out)
+    if target_bytes > 0:
+        SIZE_TO_TARGET.observe(size_bytes / target_bytes)
+
+
+def _registry() -> CollectorRegistry:
+    # Under PROMETHEUS_MULTIPROC_DIR every process (uvicorn workers, Celery pool children)
+    # writes its samples to that directory and the exposing process aggregates them.
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+
+def render_latest() -> tuple[bytes, str]:
+    return generate_latest(_registry()), CONTENT_TYPE_LATEST
+
+
+def start_exporter(port: int) -> Optional[int]:
+    """Serve /metrics on ``port`` from a background thread; returns None if it cannot bind."""
+    multiproc_dir = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if multiproc_dir:
+        Path(multiproc_dir).mkdir(parents=True, exist_ok=True)
+    try:
+        start_http_server(port, registry=_registry())
+    except OSError:
+        return None
+    return port
+
+
+def mark_process_dead(pid: int) -> None:
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(pid)
@@ -1,13 +1,19 @@
 from __future__ import annotations
 
-from fastapi import FastAPI
+import time
+from typing import Optional
+
+from fastapi import FastAPI, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 
 from app.api.routes import router
+from app.core import metrics
 from app.core.config import settings
-from app.core.database import Base, engine
+from app.core.database import upgrade_schema
+from app.services.storage import get_storage
 
-Base.metadata.create_all(bind=engine)
+upgrade_schema()
 
 app = FastAPI(title=settings.APP_NAME)
 
@@ -22,6 +28,55 @@ if settings.ALLOWED_ORIGINS:
 
 app.include_router(router)
 
+# Multipart framing and form fields around an uploaded file
+_MULTIPART_OVERHEAD = 1024 * 1024
+
+
+def _body_limit(path: str) -> Optional[int]:
+    if path == f"{router.prefix}/compress":
+        return settings.MAX_UPLOAD_SIZE + _MULTIPART_OVERHEAD
+    if path == f"{router.prefix}/batches":
+        return settings.MAX_BATCH_UPLOAD_SIZE
+    return None
+
+
+@app.middleware("http")
+async def limit_upload_size(request: Request, call_next):
+    # Starlette spools a whole multipart body to disk before the route runs, so uploads
+    # are refused here, from their declared length, before any of it is read.
+    limit = _body_limit(request.url.path) if request.method == "POST" else None
+    if limit is not None:
+        length = request.headers.get("content-length")
+        if length is None or not length.isdigit():
+            return JSONResponse({"detail": "Content-Length required"}, status_code=411)
+        if int(length) > limit:
+            return JSONResponse({"detail": "File too large"}, status_code=413)
+    return await call_next(request)
+
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    started = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    metrics.HTTP_REQUEST_SECONDS.labels(
+        request.method,
+        getattr(route, "path", "unmatched"),
+        str(response.status_code),
+    ).observe(time.perf_counter() - started)
+    return response
+
+
+@app.on_event("startup")
+def init_storage() -> None:
+    get_storage()
+
+
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics() -> Response:
+    content, content_type = metrics.render_latest()
+    return Response(content=content, headers={"Content-Type": content_type})
+
 
 @app.get("/health")
 def health_check() -> dict[str, str]:
@@ -4,7 +4,7 @@ import enum
 from datetime import datetime
 from typing import Optional
 
-from sqlalchemy import Boolean, Column, DateTime, Enum, Float, Integer, String, Text
+from sqlalchemy import Boolean, Column, DateTime, Enum, Float, ForeignKey, Integer, String, Text
 
 from app.core.database import Base
 
@@ -16,21 +16,57 @@ class TaskStatus(str, enum.Enum):
     FAILED = "failed"
 
 
+class CostClass(str, enum.Enum):
+    SMALL = "small"
+    STANDARD = "standard"
+    HEAVY = "heavy"
+
+
+class CompressionBatch(Base):
+    __tablename__ = "batches"
+
+    id: str = Column(String(64), primary_key=True, index=True)
+    task_count: int = Column(Integer, nullable=False, default=0)
+    created_at: datetime = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+
 class CompressionTask(Base):
     __tablename__ = "tasks"
 
     id: str = Column(String(64), primary_key=True, index=True)
+    batch_id: Optional[str] = Column(String(64), ForeignKey("batches.id"), nullable=True, index=True)
     status: TaskStatus = Column(Enum(TaskStatus), nullable=False, default=TaskStatus.QUEUED)
     original_filename: str = Column(String(255), nullable=False)
     original_file_path: str = Column(String(500), nullable=False)
     compressed_file_path: Optional[str] = Column(String(500), nullable=True)
     original_size_bytes: int = Column(Integer, nullable=False)
+    original_sha256: Optional[str] = Column(String(64), nullable=True, index=True)
+    cache_key: Optional[str] = Column(String(64), nullable=True, index=True)
     compressed_size_bytes: Optional[int] = Column(Integer, nullable=True)
     target_size_mb: float = Column(Float, nullable=False)
     min_quality: int = Column(Integer, nullable=False, default=20)
     max_iterations: int = Column(Integer, nullable=False, default=6)
     preserve_metadata: bool = Column(Boolean, nullable=False, default=False)
+    cost_class: Optional[CostClass] = Column(Enum(CostClass), nullable=True)
     error_message: Optional[str] = Column(Text, nullable=True)
+    trace_summary: Optional[str] = Column(Text, nullable=True)  # JSON CompressionTrace
     created_at: datetime = Column(DateTime, nullable=False, default=datetime.utcnow)
     updated_at: datetime = Column(DateTime, nullable=False, default=datetime.utcnow)
     completed_at: Optional[datetime] = Column(DateTime, nullable=True)
+
+
+class CacheStatus(str, enum.Enum):
+    PENDING = "pending"
+    READY = "ready"
+
+
+class ResultCacheEntry(Base):
+    __tablename__ = "result_cache"
+
+    cache_key: str = Column(String(64), primary_key=True)
+    status: CacheStatus = Column(Enum(CacheStatus), nullable=False, default=CacheStatus.PENDING)
+    leader_task_id: str = Column(String(64), nullable=False)
+    compressed_file_path: Optional[str] = Column(String(500), nullable=True)
+    compressed_size_bytes: Optional[int] = Column(Integer, nullable=True)
+    created_at: datetime = Column(DateTime, nullable=False, default=datetime.utcnow)
+    last_used_at: datetime = Column(DateTime, nullable=False, default=datetime.utcnow, index=True)
@@ -0,0 +1,287 @@
+from __future__ import annotations
+
+import bisect
+import heapq
+import io
+import math
+from functools import lru_cache
+from typing import Optional
+
+from PIL import Image, ImageChops, ImageStat
+
+from app.services.colorspace import BILEVEL, RGB, classify, encode_bilevel
+from app.services.image_cache import ImageKey
+from app.services.trace import timed
+
+DOWNSCALE_LADDER = (1.0, 0.8, 0.6, 0.45, 0.3)
+_QUALITY_STEPS = 5
+_TILE = 64
+_TILES_PER_SIDE = 2
+_MAX_UPGRADES = 16
+
+
+class OperatingPoint:
+    """One way to store an image: re-encoded in ``mode`` at (quality, downscale_factor), or
+    kept as it is when ``mode`` is None.
+
+    ``mode`` is a colorspace class: RGB or L for JPEG, 1 for bilevel data (which has no
+    quality). ``size_bytes`` is the predicted encoded size. ``distortion`` is the mean
+    squared error against the decoded original, summed over the image's pixels.
+    """
+
+    def __init__(
+        self,
+        quality: Optional[int],
+        downscale_factor: float,
+        size_bytes: int,
+        distortion: float,
+        mode: Optional[str] = RGB,
+    ):
+        self.quality = quality
+        self.downscale_factor = downscale_factor
+        self.size_bytes = size_bytes
+        self.distortion = distortion
+        self.mode = mode
+
+    @property
+    def keeps_original(self) -> bool:
+        return self.mode is None
+
+
+class RateCurve:
+    """An image's operating points on the lower convex hull of (size, distortion).
+
+    ``points`` run from the largest (least distorted) to the smallest, so each step down
+    the curve saves bytes at a growing cost in distortion per byte. ``frontier`` keeps
+    every point not beaten on both size and distortion, smallest first.
+    """
+
+    def __init__(self, points: list[OperatingPoint]):
+        self.frontier: list[OperatingPoint] = []
+        hull: list[OperatingPoint] = []
+        for point in sorted(points, key=lambda point: (point.size_bytes, point.distortion)):
+            if self.frontier and point.distortion >= self.frontier[-1].distortion:
+                continue
+            self.frontier.append(point)
+            while len(hull) >= 2 and _cross(hull[-2], hull[-1], point) <= 0:
+                hull.pop()
+            hull.append(point)
+        self.points = hull[::-1]
+        self._frontier_sizes = [point.size_bytes for point in self.frontier]
+
+    def best_within(self, size_bytes: int) -> Optional[OperatingPoint]:
+        """The least distorted point of at most ``size_bytes``."""
+        index = bisect.bisect_right(self._frontier_sizes, size_bytes)
+        return self.frontier[index - 1] if index else None
+
+    def slope(self, index: int) -> float:
+        """Distortion added per byte saved by stepping from point ``index`` to the next."""
+        larger, smaller = self.points[index], self.points[index + 1]
+        return (smaller.distortion - larger.distortion) / max(1, larger.size_bytes - smaller.size_bytes)
+
+    def at_slope(self, slope: float) -> OperatingPoint:
+        index = 0
+        while index + 1 < len(self.points) and self.slope(index) <= slope:
+            index += 1
+        return self.points[index]
+
+
+def _cross(origin: OperatingPoint, a: OperatingPoint, b: OperatingPoint) -> float:
+    return (a.size_bytes - origin.size_bytes) * (b.distortion - origin.distortion) - (
+        a.distortion - origin.distortion
+    ) * (b.size_bytes - origin.size_bytes)
+
+
+def quality_ladder(min_quality: int, max_quality: int) -> list[int]:
+    if max_quality <= min_quality:
+        return [max_quality]
+    step = (max_quality - min_quality) / (_QUALITY_STEPS - 1)
+    return sorted({round(min_quality + step * index) for index in range(_QUALITY_STEPS)}, reverse=True)
+
+
+def allocate(
+    curves: dict[ImageKey, RateCurve], budget: int
+) -> tuple[dict[ImageKey, OperatingPoint], float]:
+    """Pick a point per image minimizing total distortion within ``budget`` predicted bytes.
+
+    Greedy on the convex hulls: the image whose next step costs the least distortion per
+    byte saved steps first. The bytes the last step overshot by are then spent on the
+    off-hull points that cut the most distortion. Returns the points and the slope of the
+    last step taken (0.0 when nothing had to give), which ``RateCurve.at_slope`` turns
+    back into about the same choice for images outside ``curves``. When even the smallest
+    points exceed the budget, those are returned.
+    """
+    indexes = dict.fromkeys(curves, 0)
+    total = sum(curve.points[0].size_bytes for curve in curves.values())
+    steps = [(curve.slope(0), key) for key, curve in curves.items() if len(curve.points) > 1]
+    heapq.heapify(steps)
+
+    slope = 0.0
+    while total > budget and steps:
+        slope, key = heapq.heappop(steps)
+        curve, index = curves[key], indexes[key]
+        total -= curve.points[index].size_bytes - curve.points[index + 1].size_bytes
+        indexes[key] = index + 1
+        if index + 2 < len(curve.points):
+            heapq.heappush(steps, (curve.slope(index + 1), key))
+
+    points = {key: curves[key].points[index] for key, index in indexes.items()}
+    if slope > 0 and total < budget:
+        _spend_slack(curves, points, budget - total)
+    return points, slope
+
+
+def _spend_slack(
+    curves: dict[ImageKey, RateCurve], points: dict[ImageKey, OperatingPoint], slack: int
+) -> None:
+    for _ in range(_MAX_UPGRADES):
+        best: Optional[tuple[float, ImageKey, OperatingPoint]] = None
+        for key, curve in curves.items():
+            current = points[key]
+            upgrade = curve.best_within(current.size_bytes + slack)
+            if upgrade is not None and upgrade.distortion < current.distortion:
+                gain = current.distortion - upgrade.distortion
+                if best is None or gain > best[0]:
+                    best = (gain, key, upgrade)
+        if best is None:
+            return
+        _, key, upgrade = best
+        slack -= upgrade.size_bytes - points[key].size_bytes
+        points[key] = upgrade
+
+
+def measure_curve(
+    pil_image: Image.Image,
+    raw_size: int,
+    qualities: list[int],
+    downscale_ladder=DOWNSCALE_LADDER,
+    display_scale: float = 1.0,
+) -> RateCurve:
+    """Encode a small sample of ``pil_image`` at every ladder point and scale the results up.
+
+    The sample is a mosaic of full-resolution tiles, so its bits per pixel reflect the
+    image's own detail rather than a thumbnail's. Qualities between the measured ones are
+    interpolated (log-linearly in size), so the allocation is not limited to the ladder.
+
+    Distortion is measured at ``display_scale`` of the image's resolution (the most the
+    page can show), so detail above it costs nothing to drop.
+
+    Grayscale images are measured as single-channel JPEG. Black and white ones are also
+    measured as bilevel data, which the allocation takes once the budget is tight.
+    """
+    sample = _sample(pil_image)
+    width, height = pil_image.size
+    pixels = width * height
+    points = [OperatingPoint(None, 1.0, raw_size, 0.0, mode=None)]
+    with timed("sample"):
+        image_class = classify(pil_image)
+    encoded = sample if image_class == RGB else sample.convert("L")
+    reference = sample
+    if display_scale < 0.999:
+        reference_size = (
+            max(1, round(sample.width * display_scale)),
+            max(1, round(sample.height * display_scale)),
+        )
+        with timed("sample"):
+            reference = sample.resize(reference_size, Image.LANCZOS)
+
+    for downscale_factor in downscale_ladder:
+        scaled_size = (max(1, int(width * downscale_factor)), max(1, int(height * downscale_factor)))
+        if downscale_factor < 0.999:
+            if min(scaled_size) < 8:
+                continue
+            reduced_size = (
+                max(1, int(sample.width * downscale_factor)),
+                max(1, int(sample.height * downscale_factor)),
+            )
+            with timed("sample"):
+                reduced = encoded.resize(reduced_size, Image.LANCZOS)
+        else:
+            reduced = encoded
+        scale = scaled_size[0] * scaled_size[1] / (reduced.width * reduced.height)
+
+        measured: list[OperatingPoint] = []
+        for quality in qualities:
+            with timed("sample"):
+                buffer = io.BytesIO()
+                reduced.save(buffer, format="JPEG", optimize=True, quality=quality)
+                header = _header_bytes(quality, reduced.mode)
+                size_bytes = header + int(max(0, buffer.tell() - header) * scale)
+                buffer.seek(0)
+                with Image.open(buffer) as decoded:
+                    distortion = _distortion(reference, decoded, pixels)
+            measured.append(
+                OperatingPoint(quality, downscale_factor, size_bytes, distortion, mode=reduced.mode)
+            )
+        points.extend(_interpolate(measured))
+
+        if image_class == BILEVEL:
+            with timed("sample"):
+                image_bytes, _ = encode_bilevel(reduced)
+                restored = reduced.convert("1", dither=Image.Dither.NONE)
+                distortion = _distortion(reference, restored, pixels)
+            points.append(
+                OperatingPoint(
+                    None, downscale_factor, int(len(image_bytes) * scale), distortion, mode=BILEVEL
+                )
+            )
+
+    return RateCurve(points)
+
+
+def _distortion(reference: Image.Image, restored: Image.Image, pixels: int) -> float:
+    restored = restored.convert("RGB")
+    if restored.size != reference.size:
+        resample = Image.LANCZOS if restored.width > reference.width else Image.BICUBIC
+        restored = restored.resize(reference.size, resample)
+    return _mean_squared_error(reference, restored) * pixels
+
+
+def _interpolate(measured: list[OperatingPoint]) -> list[OperatingPoint]:
+    points = measured[-1:]
+    for upper, lower in zip(measured, measured[1:]):
+        span = upper.quality - lower.quality
+        for quality in range(upper.quality, lower.quality, -1):
+            weight = (upper.quality - quality) / span
+            log_size = (1 - weight) * math.log(max(1, upper.size_bytes)) + weight * math.log(
+                max(1, lower.size_bytes)
+            )
+            distortion = (1 - weight) * upper.distortion + weight * lower.distortion
+            points.append(
+                OperatingPoint(
+                    quality, upper.downscale_factor, int(math.exp(log_size)), distortion, mode=upper.mode
+                )
+            )
+    return points
+
+
+def _sample(pil_image: Image.Image) -> Image.Image:
+    width, height = pil_image.size
+    side = _TILE * _TILES_PER_SIDE
+    if width <= side and height <= side:
+        return pil_image
+
+    tile_width, tile_height = min(_TILE, width), min(_TILE, height)
+    mosaic = Image.new(pil_image.mode, (tile_width * _TILES_PER_SIDE, tile_height * _TILES_PER_SIDE))
+    for row in range(_TILES_PER_SIDE):
+        for column in range(_TILES_PER_SIDE):
+            # Tiles sit in the middle of each grid cell, aligned to the 16px JPEG MCU grid.
+            left = (width - tile_width) * (2 * column + 1) // (2 * _TILES_PER_SIDE)
+            top = (height - tile_height) * (2 * row + 1) // (2 * _TILES_PER_SIDE)
+            left, top = left - left % 16, top - top % 16
+            tile = pil_image.crop((left, top, left + tile_width, top + tile_height))
+            mosaic.paste(tile, (column * tile_width, row * tile_height))
+    return mosaic
+
+
+@lru_cache(maxsize=None)
+def _header_bytes(quality: int, mode: str = RGB) -> int:
+    buffer = io.BytesIO()
+    color = (128, 128, 128) if mode == RGB else 128
+    Image.new(mode, (16, 16), color).save(buffer, format="JPEG", optimize=True, quality=quality)
+    return buffer.tell()
+
+
+def _mean_squared_error(original: Image.Image, restored: Image.Image) -> float:
+    rms = ImageStat.Stat(ImageChops.difference(original, restored)).rms
+    return sum(value * value for value in rms) / len(rms)
@@ -0,0 +1,94 @@
+from __future__ import annotations
+
+import zipfile
+from collections import deque
+from pathlib import PurePosixPath
+from typing import IO, Iterable, Iterator, Optional
+
+from app.models import TaskStatus
+
+ZIP_CONTENT_TYPES = ("application/zip", "application/x-zip-compressed")
+
+
+class BatchTooLargeError(Exception):
+    pass
+
+
+def is_zip_upload(content_type: Optional[str], filename: Optional[str]) -> bool:
+    return content_type in ZIP_CONTENT_TYPES or (filename or "").lower().endswith(".zip")
+
+
+def iter_zip_pdfs(fileobj: IO[bytes]) -> Iterator[tuple[str, IO[bytes]]]:
+    """Yield (filename, stream) for every PDF in an uploaded archive, without extracting it."""
+    with zipfile.ZipFile(fileobj) as archive:
+        for info in archive.infolist():
+            path = PurePosixPath(info.filename)
+            if info.is_dir() or "__MACOSX" in path.parts or path.suffix.lower() != ".pdf":
+                continue
+            with archive.open(info) as entry:
+                yield path.name, entry
+
+
+def aggregate_status(statuses: Iterable[TaskStatus]) -> str:
+    statuses = list(statuses)
+    if any(status in (TaskStatus.QUEUED, TaskStatus.RUNNING) for status in statuses):
+        if all(status == TaskStatus.QUEUED for status in statuses):
+            return TaskStatus.QUEUED.value
+        return TaskStatus.RUNNING.value
+    if statuses and all(status == TaskStatus.FAILED for status in statuses):
+        return TaskStatus.FAILED.value
+    if any(status == TaskStatus.FAILED for status in statuses):
+        return "partial"
+    return TaskStatus.COMPLETED.value
+
+
+def unique_name(filename: str, used: set[str]) -> str:
+    candidate = filename
+    stem, suffix = PurePosixPath(filename).stem, PurePosixPath(filename).suffix
+    counter = 1
+    while candidate in used:
+        candidate = f"{stem} ({counter}){suffix}"
+        counter += 1
+    used.add(candidate)
+    return candidate
+
+
+class _ZipSink:
+    """Write-only, unseekable file object that hands written bytes back to a generator."""
+
+    def __init__(self):
+        self._chunks: deque[bytes] = deque()
+        self._position = 0
+
+    def write(self, data: bytes) -> int:
+        if data:
+            self._chunks.append(bytes(data))
+            self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> Iterator[bytes]:
+        while self._chunks:
+            yield self._chunks.popleft()
+
+
+def stream_zip(entries: Iterable[tuple[str, Iterable[bytes]]]) -> Iterator[bytes]:
+    """Build a ZIP archive on the fly from (name, chunks) pairs.
+
+    Members are stored uncompressed (the PDFs are already compressed) and the archive is
+    yielded as it is written, so memory use stays at one chunk whatever the batch size.
+    """
+    sink = _ZipSink()
+    with zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_STORED) as archive:
+        for name, chunks in entries:
+            with archive.open(name, mode="w", force_zip64=True) as member:
+                for chunk in chunks:
+                    member.write(chunk)
+                    yield from sink.drain()
+            yield from sink.drain()
+    yield from sink.drain()
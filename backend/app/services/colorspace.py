@@ -0,0 +1,68 @@
+from __future__ import annotations
+
+import io
+import zlib
+
+import numpy as np
+from PIL import Image, ImageOps, features
+
+# Image classes, named after the Pillow modes they are encoded in
+RGB = "RGB"
+GRAY = "L"
+BILEVEL = "1"
+
+# Stored formats of re-encoded images
+FORMAT_JPEG = "jpeg"
+FORMAT_JPEG_GRAY = "jpeg-gray"
+FORMAT_CCITT = "ccitt-g4"
+FORMAT_FLATE_BILEVEL = "flate-1bit"
+
+_CLASSIFY_SIDE = 1024  # images are classified on a nearest-neighbour sample of this side
+_GRAY_SPREAD = 8  # largest difference between channels of a pixel that still counts as gray
+_COLOR_SHARE = 0.002  # share of colored pixels a gray image may have (stray scan noise)
+_MIDTONES = (64, 192)
+_BILEVEL_MIDTONE_SHARE = 0.04  # share of midtone pixels a bilevel image may have (edges)
+
+_HAS_GROUP4 = features.check("libtiff")
+
+
+def classify(pil_image: Image.Image) -> str:
+    """Whether an image is effectively color (RGB), grayscale (L) or black and white (1).
+
+    Sampled pixels (not averaged, which would invent midtones at every edge) are checked
+    for channel spread, and gray images for how many pixels sit between black and white.
+    """
+    sample = pil_image
+    if max(sample.size) > _CLASSIFY_SIDE:
+        scale = _CLASSIFY_SIDE / max(sample.size)
+        sample = sample.resize(
+            (max(1, int(sample.width * scale)), max(1, int(sample.height * scale))), Image.NEAREST
+        )
+    red, green, blue = np.asarray(sample.convert("RGB")).transpose(2, 0, 1)
+    spread = np.maximum(np.maximum(red, green), blue) - np.minimum(np.minimum(red, green), blue)
+    if np.count_nonzero(spread > _GRAY_SPREAD) > _COLOR_SHARE * spread.size:
+        return RGB
+
+    luma = np.asarray(sample.convert("L"))
+    midtones = np.count_nonzero((luma > _MIDTONES[0]) & (luma < _MIDTONES[1]))
+    return BILEVEL if midtones <= _BILEVEL_MIDTONE_SHARE * luma.size else GRAY
+
+
+def encode_bilevel(gray_image: Image.Image) -> tuple[bytes, str]:
+    """Threshold a grayscale image at mid-gray and encode it as 1-bit image data.
+
+    Uses CCITT Group 4 when Pillow has libtiff, else Flate over the packed rows.
+    """
+    if not _HAS_GROUP4:
+        bilevel = gray_image.convert("1", dither=Image.Dither.NONE)
+        return zlib.compress(bilevel.tobytes(), 9), FORMAT_FLATE_BILEVEL
+
+    # Ink is coded as 1 (black runs), so the PDF's default BlackIs1=false reads it back.
+    ink = ImageOps.invert(gray_image).convert("1", dither=Image.Dither.NONE)
+    buffer = io.BytesIO()
+    # One strip, so the TIFF's image data is a single Group 4 stream.
+    ink.save(buffer, format="TIFF", compression="group4", strip_size=(ink.width + 7) // 8 * ink.height)
+    buffer.seek(0)
+    with Image.open(buffer) as tiff:
+        offset, length = tiff.tag_v2[273][0], tiff.tag_v2[279][0]
+    return buffer.getvalue()[offset : offset + length], FORMAT_CCITT
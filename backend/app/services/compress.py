@@ -1,93 +1,884 @@
 from __future__ import annotations
 
+import contextvars
 import io
 import math
+import os
 import shutil
+import tempfile
+import zipfile
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
-from typing import Optional
+from typing import IO, Any, Callable, Iterator, Optional, Union
 
 import pikepdf
 from PIL import Image
 
+from app.core.config import settings
+from app.services.allocation import (
+    OperatingPoint,
+    RateCurve,
+    allocate,
+    measure_curve,
+    quality_ladder,
+)
+from app.services.colorspace import (
+    BILEVEL,
+    FORMAT_CCITT,
+    FORMAT_FLATE_BILEVEL,
+    FORMAT_JPEG,
+    FORMAT_JPEG_GRAY,
+    RGB,
+    classify,
+    encode_bilevel,
+)
+from app.services.image_cache import ImageCache, ImageKey, finish_decode, open_image
+from app.services.image_probe import select_recompressible
+from app.services.placement import downscale_ladder, effective_dpi
+from app.services.structure import optimize_structure, stream_digest
+from app.services.trace import CompressionTrace, current_trace, timed, tracing
+
 
 class CompressionResult:
-    def __init__(self, output_path: Path, size_bytes: int):
+    def __init__(self, output_path: Path, size_bytes: int, trace: Optional[CompressionTrace] = None):
         self.output_path = output_path
         self.size_bytes = size_bytes
+        self.trace = trace
 
 
-def _calculate_base_downscale(original_size: int, target_bytes: int) -> float:
-    if original_size <= 0 or target_bytes <= 0:
-        return 1.0
+class ProgressEvent:
+    """One step of compress_pdf(), passed to its ``progress`` callback.
 
-    ratio = min(1.0, target_bytes / original_size)
-    if ratio >= 0.98:
-        return 1.0
+    ``phase`` is "analyzing", "probing" (a fast search save), "saving" (a final save) or
+    "finished". ``iteration`` counts the saves made so far.
+    """
 
-    return max(0.3, math.sqrt(ratio))
+    def __init__(
+        self,
+        phase: str,
+        *,
+        iteration: int = 0,
+        quality: Optional[int] = None,
+        downscale_factor: Optional[float] = None,
+        size_bytes: Optional[int] = None,
+        target_bytes: Optional[int] = None,
+    ):
+        self.phase = phase
+        self.iteration = iteration
+        self.quality = quality
+        self.downscale_factor = downscale_factor
+        self.size_bytes = size_bytes
+        self.target_bytes = target_bytes
 
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "phase": self.phase,
+            "iteration": self.iteration,
+            "quality": self.quality,
+            "downscale_factor": self.downscale_factor,
+            "size_bytes": self.size_bytes,
+            "target_bytes": self.target_bytes,
+        }
 
-def _calculate_iteration_downscale(
-    quality: int,
-    min_quality: int,
-    max_quality: int,
-    base_downscale: float,
-) -> float:
-    if base_downscale >= 0.999:
-        return 1.0
 
-    if max_quality <= min_quality:
-        return base_downscale
+ProgressCallback = Callable[[ProgressEvent], None]
+
+
+# Filter, color space and bits per component of each format images are re-encoded in
+_STREAM_FORMATS = {
+    FORMAT_JPEG: (pikepdf.Name.DCTDecode, pikepdf.Name.DeviceRGB, 8),
+    FORMAT_JPEG_GRAY: (pikepdf.Name.DCTDecode, pikepdf.Name.DeviceGray, 8),
+    FORMAT_CCITT: (pikepdf.Name.CCITTFaxDecode, pikepdf.Name.DeviceGray, 1),
+    FORMAT_FLATE_BILEVEL: (pikepdf.Name.FlateDecode, pikepdf.Name.DeviceGray, 1),
+}
+
 
-    span = max_quality - min_quality
-    quality_ratio = (quality - min_quality) / span
-    quality_ratio = max(0.0, min(1.0, quality_ratio))
+def _replace_image(
+    raw_image: pikepdf.Object,
+    image_bytes: bytes,
+    size: tuple[int, int],
+    image_format: str = FORMAT_JPEG,
+) -> None:
+    stream_filter, color_space, bits_per_component = _STREAM_FORMATS[image_format]
+    for key in ("/DecodeParms", "/Decode"):
+        if key in raw_image:
+            del raw_image[key]
+    decode_parms = None
+    if image_format == FORMAT_CCITT:
+        decode_parms = pikepdf.Dictionary(K=-1, Columns=size[0], Rows=size[1])
+    raw_image.write(image_bytes, filter=stream_filter, decode_parms=decode_parms)
+    raw_image.Width, raw_image.Height = size
+    raw_image.ColorSpace = color_space
+    raw_image.BitsPerComponent = bits_per_component
 
-    downscale = base_downscale + (1.0 - base_downscale) * quality_ratio
-    return max(0.3, min(1.0, downscale))
 
+def _page_images(page: pikepdf.Page) -> Iterator[tuple[pikepdf.Dictionary, str, pikepdf.Stream]]:
+    resources = page.obj.get("/Resources")
+    xobjects = resources.get("/XObject") if isinstance(resources, pikepdf.Dictionary) else None
+    if not isinstance(xobjects, pikepdf.Dictionary):
+        return
+
+    for name, raw_image in list(xobjects.items()):
+        if isinstance(raw_image, pikepdf.Stream) and raw_image.get("/Subtype") == pikepdf.Name.Image:
+            yield xobjects, name, raw_image
+
+
+def _index_images(pdf: pikepdf.Pdf) -> list[pikepdf.Stream]:
+    # Each image XObject is returned once, however many pages use it. Byte-identical
+    # copies stored as separate objects are repointed at the first one, so the copies
+    # are dropped from the output as unreferenced objects.
+    unique: dict[ImageKey, pikepdf.Stream] = {}
+    by_digest: dict[bytes, pikepdf.Stream] = {}
 
-def _recompress_images(pdf: pikepdf.Pdf, quality: int, *, downscale_factor: float = 1.0) -> None:
     for page in pdf.pages:
-        images = page.images
-        for name, raw_image in images.items():
-            pdf_image = pikepdf.PdfImage(raw_image)
-            try:
-                pil_image = pdf_image.as_pil_image()
-            except (NotImplementedError, ValueError):
+        for xobjects, name, raw_image in _page_images(page):
+            if raw_image.objgen in unique:
                 continue
 
-            if pil_image.mode in ("RGBA", "LA"):
-                background = Image.new("RGB", pil_image.size, (255, 255, 255))
-                background.paste(pil_image, mask=pil_image.split()[-1])
-                pil_image = background
-            elif pil_image.mode != "RGB":
-                pil_image = pil_image.convert("RGB")
+            digest = stream_digest(raw_image)
+            canonical = by_digest.get(digest)
+            if canonical is not None:
+                xobjects[name] = canonical
+                continue
 
-            if downscale_factor < 0.999:
-                new_width = max(1, int(pil_image.width * downscale_factor))
-                new_height = max(1, int(pil_image.height * downscale_factor))
-                if (new_width, new_height) != pil_image.size:
-                    pil_image = pil_image.resize((new_width, new_height), Image.LANCZOS)
+            unique[raw_image.objgen] = raw_image
+            by_digest[digest] = raw_image
 
-            buffer = io.BytesIO()
-            try:
+    return list(unique.values())
+
+
+# Box-reduce by whole factors down to this multiple of the target size before LANCZOS
+_REDUCING_GAP = 3.0
+
+
+def _scaled_size(raw_image: pikepdf.Stream, downscale_factor: float) -> tuple[int, int]:
+    width, height = int(raw_image.Width), int(raw_image.Height)
+    if downscale_factor >= 0.999:
+        return width, height
+    return max(1, int(width * downscale_factor)), max(1, int(height * downscale_factor))
+
+
+# Encoded bytes, pixel size and stored format of a re-encoded image
+EncodedImage = tuple[bytes, tuple[int, int], str]
+
+
+def _encode_image(
+    pil_image: Image.Image, quality: Optional[int], size: tuple[int, int], mode: Optional[str] = RGB
+) -> Optional[EncodedImage]:
+    # Without a mode (no measured curve), the image's own colorspace class decides.
+    if mode is None:
+        mode = classify(pil_image)
+    if mode != RGB:
+        pil_image = pil_image.convert("L")
+    if size != pil_image.size:
+        with timed("resize"):
+            pil_image = pil_image.resize(size, Image.LANCZOS, reducing_gap=_REDUCING_GAP)
+
+    try:
+        with timed("encode"):
+            if mode == BILEVEL:
+                image_bytes, image_format = encode_bilevel(pil_image)
+            else:
+                buffer = io.BytesIO()
                 pil_image.save(buffer, format="JPEG", optimize=True, quality=quality)
-            except OSError:
+                image_bytes = buffer.getvalue()
+                image_format = FORMAT_JPEG if mode == RGB else FORMAT_JPEG_GRAY
+    except OSError:
+        return None
+    return image_bytes, pil_image.size, image_format
+
+
+EncodedImages = dict[ImageKey, EncodedImage]
+# (quality, downscale_factor, mode) to re-encode each image at; images left out are kept as
+# they are. Bilevel images have no quality; a mode of None classifies the image first.
+Assignments = dict[ImageKey, tuple[Optional[int], float, Optional[str]]]
+
+
+def _has_decode_mapping(raw_image: pikepdf.Stream) -> bool:
+    # A /Decode other than the default maps samples to colors; the decoded pixels are
+    # the raw samples, so re-encoding them without it would change the image.
+    decode = raw_image.get("/Decode")
+    if not isinstance(decode, pikepdf.Array):
+        return False
+    values = [float(value) for value in decode]
+    color_space = raw_image.get("/ColorSpace")
+    if isinstance(color_space, pikepdf.Array) and len(color_space) > 0 and color_space[0] == pikepdf.Name.Indexed:
+        return values != [0, 2 ** int(raw_image.get("/BitsPerComponent", 8)) - 1]
+    return any(values[index : index + 2] != [0, 1] for index in range(0, len(values), 2))
+
+
+def _reencodable(raw_image: pikepdf.Stream) -> bool:
+    # Stencil masks, color-keyed images (an array /Mask, which lossy JPEG cannot key on)
+    # and images with a decode mapping are kept as they are.
+    return (
+        not raw_image.get("/ImageMask", False)
+        and not isinstance(raw_image.get("/Mask"), pikepdf.Array)
+        and not _has_decode_mapping(raw_image)
+    )
+
+
+def _select_images(
+    pdf: pikepdf.Pdf, min_quality: int = 0, target_bytes: int = 0
+) -> tuple[list[pikepdf.Stream], list[tuple[pikepdf.Stream, str]]]:
+    # Images not worth re-encoding are classified from their dictionaries and JPEG headers
+    # and keep their original bytes, without ever being decoded.
+    candidates = [raw_image for raw_image in _index_images(pdf) if _reencodable(raw_image)]
+    return select_recompressible(candidates, min_quality, target_bytes)
+
+
+def _recompressible_images(
+    pdf: pikepdf.Pdf, *, min_quality: int = 0, target_bytes: int = 0
+) -> list[pikepdf.Stream]:
+    return _select_images(pdf, min_quality, target_bytes)[0]
+
+
+def _decode_and_apply(
+    pil_image: Optional[Image.Image],
+    key: ImageKey,
+    work: Callable[[ImageKey, Image.Image], Any],
+    *,
+    decode: bool = False,
+    image_cache: Optional[ImageCache] = None,
+) -> Any:
+    if decode:
+        with timed("decode"):
+            pil_image = finish_decode(pil_image)
+        if image_cache is not None:
+            image_cache.put(key, pil_image)
+    if pil_image is None:
+        return None
+    return work(key, pil_image)
+
+
+def _map_images(
+    images: list[pikepdf.Stream],
+    work: Callable[[ImageKey, Image.Image], Any],
+    *,
+    image_cache: Optional[ImageCache] = None,
+    workers: Optional[int] = None,
+    draft_sizes: Optional[dict[ImageKey, tuple[int, int]]] = None,
+) -> dict[ImageKey, Any]:
+    """Run ``work`` on the decoded pixels of every image; undecodable images and None
+    results are left out.
+
+    An image with a size in ``draft_sizes`` that is not already cached may be decoded at
+    reduced resolution (no smaller than that size); only an image that was actually
+    reduced is kept out of the cache.
+    """
+    # Only stream reads touch the Pdf; they stay on this thread, while pixel decoding,
+    # resizing and JPEG encoding (which release the GIL) run on the pool.
+    workers = max(1, settings.COMPRESS_IMAGE_WORKERS if workers is None else workers)
+    executor = ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+    pending: deque[tuple[ImageKey, Future]] = deque()
+    results: dict[ImageKey, Any] = {}
+
+    def collect_next() -> None:
+        key, future = pending.popleft()
+        result = future.result()
+        if result is not None:
+            results[key] = result
+
+    try:
+        for raw_image in images:
+            key: ImageKey = raw_image.objgen
+            found, pil_image = image_cache.lookup(key) if image_cache is not None else (False, None)
+            draft_size = (draft_sizes or {}).get(key)
+            reduced = False
+            if not found:
+                with timed("decode"):
+                    if draft_size is not None:
+                        pil_image = open_image(raw_image, draft_size=draft_size)
+                        reduced = pil_image is not None and pil_image.size != _scaled_size(raw_image, 1.0)
+                    else:
+                        pil_image = open_image(raw_image)
+
+            args = (pil_image, key, work)
+            kwargs = {
+                "decode": not found,
+                "image_cache": None if reduced else image_cache,
+            }
+            if executor is None:
+                future: Future = Future()
+                future.set_result(_decode_and_apply(*args, **kwargs))
+            else:
+                # Run in a copy of this context so the pool threads time into the same trace.
+                context = contextvars.copy_context()
+                future = executor.submit(context.run, _decode_and_apply, *args, **kwargs)
+            pending.append((key, future))
+
+            if len(pending) > workers * 2:
+                collect_next()
+
+        while pending:
+            collect_next()
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    return results
+
+
+def _encode_images(
+    images: list[pikepdf.Stream],
+    assignments: Assignments,
+    *,
+    image_cache: Optional[ImageCache] = None,
+    workers: Optional[int] = None,
+) -> EncodedImages:
+    images = [raw_image for raw_image in images if raw_image.objgen in assignments]
+    sizes = {
+        raw_image.objgen: _scaled_size(raw_image, assignments[raw_image.objgen][1])
+        for raw_image in images
+    }
+
+    def encode(key: ImageKey, pil_image: Image.Image) -> Optional[EncodedImage]:
+        quality, _, mode = assignments[key]
+        return _encode_image(pil_image, quality, sizes[key], mode)
+
+    # Images shrinking to half size or less can skip their full-resolution decode.
+    return _map_images(
+        images,
+        encode,
+        image_cache=image_cache,
+        workers=workers,
+        draft_sizes={
+            raw_image.objgen: sizes[raw_image.objgen]
+            for raw_image in images
+            if assignments[raw_image.objgen][1] <= 0.5
+        },
+    )
+
+
+def _uniform_assignments(
+    images: list[pikepdf.Stream], quality: int, downscale_factor: float
+) -> Assignments:
+    return {raw_image.objgen: (quality, downscale_factor, None) for raw_image in images}
+
+
+def _measure_curves(
+    images: list[pikepdf.Stream],
+    *,
+    min_quality: int,
+    max_quality: int,
+    resolutions: Optional[dict[ImageKey, float]] = None,
+    image_cache: Optional[ImageCache] = None,
+) -> dict[ImageKey, RateCurve]:
+    # Each image's downscale ladder follows from the resolution it is drawn at.
+    qualities = quality_ladder(min_quality, max_quality)
+    raw_sizes = {raw_image.objgen: _raw_size(raw_image) for raw_image in images}
+    resolutions = resolutions or {}
+
+    def measure(key: ImageKey, pil_image: Image.Image) -> RateCurve:
+        ladder, display_scale = downscale_ladder(resolutions.get(key))
+        return measure_curve(pil_image, raw_sizes[key], qualities, ladder, display_scale)
+
+    return _map_images(images, measure, image_cache=image_cache)
+
+
+def _apply_encoded_images(images: list[pikepdf.Stream], encoded_images: EncodedImages) -> None:
+    with timed("replace"):
+        for raw_image in images:
+            encoded = encoded_images.get(raw_image.objgen)
+            if encoded is not None:
+                _replace_image(raw_image, *encoded)
+
+
+def _prepare_document(pdf: pikepdf.Pdf, preserve_metadata: bool) -> None:
+    if not preserve_metadata:
+        try:
+            pdf.docinfo.clear()
+        except (AttributeError, ValueError):
+            pass
+
+
+_SAVE_PROFILES: dict[str, dict[str, Any]] = {
+    "final": {
+        "linearize": True,
+        "compress_streams": True,
+        "object_stream_mode": pikepdf.ObjectStreamMode.generate,
+    },
+    "fast": {
+        "linearize": False,
+        "compress_streams": False,
+        "object_stream_mode": pikepdf.ObjectStreamMode.preserve,
+    },
+}
+
+
+def _save_document(pdf: pikepdf.Pdf, destination, *, profile: str = "final") -> None:
+    trace = current_trace()
+    if trace is not None:
+        trace.record_save(profile)
+    with timed("save"):
+        pdf.save(destination, **_SAVE_PROFILES[profile])
+
+
+def _open_document(source: _Source) -> pikepdf.Pdf:
+    with timed("open"):
+        if isinstance(source, _OptimizedSource):
+            return source.open()
+        return pikepdf.open(source)
+
+
+class _Trial:
+    """One allocation of the image budget, with the encoded size it actually produced.
+
+    ``quality`` and ``downscale_factor`` summarize the allocation for progress reports and
+    traces: their averages over the re-encoded images, weighted by predicted size.
+    """
+
+    def __init__(
+        self,
+        points: dict[ImageKey, OperatingPoint],
+        image_bytes: int,
+        model_bytes: int,
+        slope: float,
+    ):
+        self.points = points
+        self.image_bytes = image_bytes
+        self.model_bytes = model_bytes
+        self.slope = slope
+
+        reencoded = [point for point in points.values() if not point.keeps_original]
+        jpeg = [point for point in reencoded if point.quality is not None]
+        self.quality: Optional[int] = None
+        self.downscale_factor = 1.0
+        if sum(point.size_bytes for point in jpeg) > 0:
+            self.quality = round(
+                sum(point.quality * point.size_bytes for point in jpeg)
+                / sum(point.size_bytes for point in jpeg)
+            )
+        if sum(point.size_bytes for point in reencoded) > 0:
+            self.downscale_factor = sum(
+                point.downscale_factor * point.size_bytes for point in reencoded
+            ) / sum(point.size_bytes for point in reencoded)
+
+    @property
+    def key(self) -> tuple:
+        return _trial_key(self.points)
+
+    @property
+    def assignments(self) -> Assignments:
+        return {
+            image_key: (point.quality, point.downscale_factor, point.mode)
+            for image_key, point in self.points.items()
+            if not point.keeps_original
+        }
+
+
+def _trial_key(points: dict[ImageKey, OperatingPoint]) -> tuple:
+    return tuple(
+        sorted(
+            (image_key, point.mode, point.quality, round(point.downscale_factor, 4))
+            for image_key, point in points.items()
+            if not point.keeps_original
+        )
+    )
+
+
+class _SizeEstimator:
+    """Predicts the saved size of the document for an allocation of the image budget.
+
+    The non-image overhead is measured once, by saving the document with every
+    recompressible image stubbed out. A prediction is that overhead plus the encoded size
+    of each image, plus a correction learned from the last confirming save.
+
+    Each image's rate-distortion curve is measured on a small sample before the first
+    trial. A trial allocates an image byte budget across the curves and encodes every
+    image at its own point; the curves only predict sizes, so ``image_bytes`` is what the
+    encoder actually produced.
+
+    Predictions are always for the final (linearized) save. When the search confirms with
+    a cheaper profile, ``search_delta`` converts its sizes to final-save sizes; it is the
+    difference between the stub document saved with both profiles, since image payloads
+    are written identically by either.
+    """
+
+    _RETAINED_ENCODINGS = 2
+
+    def __init__(
+        self,
+        source: _Source,
+        images: list[pikepdf.Stream],
+        *,
+        preserve_metadata: bool,
+        image_cache: ImageCache,
+        min_quality: int = 20,
+        max_quality: int = 95,
+        resolutions: Optional[dict[ImageKey, float]] = None,
+        search_profile: str = "final",
+        sample_size: Optional[int] = None,
+    ):
+        self.image_cache = image_cache
+        self.overhead, search_overhead = _measure_overhead(
+            source,
+            preserve_metadata,
+            {raw_image.objgen for raw_image in images},
+            profiles=("final", search_profile),
+        )
+        self.search_delta = self.overhead - search_overhead
+        self.correction = 0
+
+        # With a sample, only evenly spaced images are encoded and their sizes are
+        # extrapolated to the whole document by raw byte share.
+        self.images = images
+        self.extrapolation = 1.0
+        if sample_size is not None and 0 < sample_size < len(images):
+            step = len(images) / sample_size
+            self.images = [images[int(index * step)] for index in range(sample_size)]
+            sample_raw = sum(_raw_size(raw_image) for raw_image in self.images)
+            if sample_raw > 0:
+                self.extrapolation = sum(_raw_size(raw_image) for raw_image in images) / sample_raw
+        self._raw_sizes = {raw_image.objgen: _raw_size(raw_image) for raw_image in self.images}
+        self.curves = _measure_curves(
+            self.images,
+            min_quality=min_quality,
+            max_quality=max_quality,
+            resolutions=resolutions,
+            image_cache=image_cache,
+        )
+        # Undecodable images are never re-encoded; their bytes are fixed.
+        self._fixed_bytes = sum(
+            raw_size for image_key, raw_size in self._raw_sizes.items() if image_key not in self.curves
+        )
+        self._trials: dict[tuple, _Trial] = {}
+        self._encodings: OrderedDict[tuple, EncodedImages] = OrderedDict()
+        self.budgets: dict[int, _Trial] = {}  # every budget tried, for the search's model
+
+    def image_budget(self, target_bytes: int) -> int:
+        """Bytes the estimator's images may take for a final save of ``target_bytes``."""
+        return int((target_bytes - self.overhead - self.correction) / self.extrapolation)
+
+    def trial(self, budget: int) -> _Trial:
+        points, slope = allocate(self.curves, budget - self._fixed_bytes)
+        key = _trial_key(points)
+        trial = self._trials.get(key)
+        if trial is None:
+            encoded_images = self._encode(key, points)
+            image_bytes = sum(
+                len(encoded_images[image_key][0]) if image_key in encoded_images else raw_size
+                for image_key, raw_size in self._raw_sizes.items()
+            )
+            model_bytes = self._fixed_bytes + sum(point.size_bytes for point in points.values())
+            trial = _Trial(points, int(image_bytes * self.extrapolation), model_bytes, slope)
+            self._trials[key] = trial
+        self.budgets[budget] = trial
+        return trial
+
+    def predict(self, trial: _Trial) -> int:
+        return self.overhead + trial.image_bytes + self.correction
+
+    def correct(self, trial: _Trial, actual_size: int) -> None:
+        self.correction = actual_size - (self.overhead + trial.image_bytes)
+
+    def encoded_images(self, trial: _Trial) -> EncodedImages:
+        encoded_images = self._encodings.get(trial.key)
+        if encoded_images is None:
+            encoded_images = self._encode(trial.key, trial.points)
+        return encoded_images
+
+    def _encode(self, key: tuple, points: dict[ImageKey, OperatingPoint]) -> EncodedImages:
+        # An image whose point is unchanged since a retained trial reuses that encoding.
+        retained: dict[tuple, EncodedImage] = {}
+        for retained_key, encoded_images in self._encodings.items():
+            trial = self._trials.get(retained_key)
+            if trial is not None:
+                assignments = trial.assignments
+                for image_key, encoded in encoded_images.items():
+                    retained[image_key, *assignments[image_key]] = encoded
+
+        encoded_images: EncodedImages = {}
+        assignments: Assignments = {}
+        for image_key, point in points.items():
+            if point.keeps_original:
                 continue
+            assignment = (point.quality, point.downscale_factor, point.mode)
+            encoded = retained.get((image_key, *assignment))
+            if encoded is not None:
+                encoded_images[image_key] = encoded
+            else:
+                assignments[image_key] = assignment
+        encoded_images.update(
+            _encode_images(self.images, assignments, image_cache=self.image_cache)
+        )
+
+        self._encodings[key] = encoded_images
+        while len(self._encodings) > self._RETAINED_ENCODINGS:
+            self._encodings.popitem(last=False)
+        return encoded_images
+
+
+def _raw_size(raw_image: pikepdf.Stream) -> int:
+    return int(raw_image.get("/Length", 0))
+
+
+def _measure_overhead(
+    source: _Source,
+    preserve_metadata: bool,
+    image_keys: set[ImageKey],
+    *,
+    profiles: tuple[str, ...] = ("final",),
+) -> tuple[int, ...]:
+    with _open_document(source) as pdf:
+        with timed("replace"):
+            for raw_image in _index_images(pdf):
+                if raw_image.objgen in image_keys:
+                    _replace_image(raw_image, b"", (int(raw_image.Width), int(raw_image.Height)))
+        _prepare_document(pdf, preserve_metadata)
+
+        sizes: dict[str, int] = {}
+        for profile in profiles:
+            if profile not in sizes:
+                buffer = io.BytesIO()
+                _save_document(pdf, buffer, profile=profile)
+                sizes[profile] = buffer.tell()
+        return tuple(sizes[profile] for profile in profiles)
+
+
+class _Candidate:
+    """A saved candidate document, held in memory until it outgrows the spool limit."""
 
-            image_bytes = buffer.getvalue()
-            replace_stream = getattr(pdf_image, "replace_stream", None)
-            if callable(replace_stream):
-                replace_stream(image_bytes, pikepdf.Name("/DCTDecode"))
+    def __init__(self):
+        self.buffer = tempfile.SpooledTemporaryFile(max_size=settings.COMPRESS_SPOOL_MAX_BYTES)
+        self.size_bytes = 0
+        self.image_bytes = 0
+
+    def write_to(self, target_path: Path) -> None:
+        self.buffer.seek(0)
+        with open(target_path, "wb") as f:
+            shutil.copyfileobj(self.buffer, f, length=1024 * 1024)
+
+    def close(self) -> None:
+        self.buffer.close()
+
+
+def _replace_candidate(
+    previous: Optional[_Candidate], candidate: _Candidate, other: Optional[_Candidate]
+) -> _Candidate:
+    if previous is not None and previous is not candidate and previous is not other:
+        previous.close()
+    return candidate
+
+
+def _save_candidate(
+    source: _Source,
+    encoded_images: EncodedImages,
+    *,
+    preserve_metadata: bool,
+    profile: str = "final",
+    optimize: bool = False,
+) -> _Candidate:
+    # The search keeps its own copy of the source pristine for decoding, so each
+    # confirming save applies the chosen encodings to a fresh copy.
+    candidate = _Candidate()
+    with _open_document(source) as pdf:
+        _apply_encoded_images(_index_images(pdf), encoded_images)
+        if optimize:
+            optimize_structure(pdf, preserve_metadata=preserve_metadata)
+        _prepare_document(pdf, preserve_metadata)
+        _save_document(pdf, candidate.buffer, profile=profile)
+    candidate.size_bytes = candidate.buffer.tell()
+    return candidate
+
+
+class _OptimizedSource:
+    """The document after the lossless pass, which every search candidate is built from.
+
+    It is held in memory up to the spool limit and in a temporary file beside the target
+    above it, so the target is written once whichever document wins. A pass that saves
+    nothing leaves the original file as the source.
+    """
+
+    def __init__(self, original_path: Path):
+        self.original_path = original_path
+        self.size_bytes = original_path.stat().st_size
+        self._data: Optional[bytes] = None
+        self._temp_path: Optional[Path] = None
+
+    def save(self, pdf: pikepdf.Pdf, target_path: Path) -> None:
+        if self.size_bytes <= settings.COMPRESS_SPOOL_MAX_BYTES:
+            buffer = io.BytesIO()
+            _save_document(pdf, buffer)
+            if buffer.tell() < self.size_bytes:
+                self._data = buffer.getvalue()
+                self.size_bytes = len(self._data)
+            return
+
+        fd, name = tempfile.mkstemp(suffix=".pdf", dir=target_path.parent)
+        os.close(fd)
+        temp_path = Path(name)
+        try:
+            _save_document(pdf, temp_path)
+        except BaseException:
+            temp_path.unlink(missing_ok=True)
+            raise
+        size_bytes = temp_path.stat().st_size
+        if size_bytes < self.size_bytes:
+            self._temp_path = temp_path
+            self.size_bytes = size_bytes
+        else:
+            temp_path.unlink()
+
+    def open(self) -> pikepdf.Pdf:
+        # Every open reads through its own handle, so several can be open at once.
+        if self._data is not None:
+            return pikepdf.open(io.BytesIO(self._data))
+        return pikepdf.open(self._temp_path or self.original_path)
+
+    def write_to(self, target_path: Path) -> None:
+        if self._data is not None:
+            target_path.write_bytes(self._data)
+        elif self._temp_path is not None:
+            os.replace(self._temp_path, target_path)
+            self._temp_path = None
+        else:
+            shutil.copyfile(self.original_path, target_path)
+
+    def close(self) -> None:
+        self._data = None
+        if self._temp_path is not None:
+            self._temp_path.unlink(missing_ok=True)
+            self._temp_path = None
+
+
+# A document candidates are built from: a file, or the optimized copy of one
+_Source = Union[Path, _OptimizedSource]
+
+
+def _save_optimized(source_path: Path, target_path: Path, *, preserve_metadata: bool) -> _OptimizedSource:
+    """Run ``source_path`` through the lossless structural pass, without writing the target."""
+    optimized = _OptimizedSource(source_path)
+    with _open_document(source_path) as pdf:
+        optimize_structure(pdf, preserve_metadata=preserve_metadata)
+        _prepare_document(pdf, preserve_metadata)
+        optimized.save(pdf, target_path)
+    return optimized
+
+
+# Share of the target a result may fall below it
+_TOLERANCE = 0.10
+# Budgets closer than this ratio are not worth another encode
+_MIN_BRACKET = 1.02
+
+
+def _search_trials(
+    estimator: _SizeEstimator,
+    target_bytes: int,
+    *,
+    max_iterations: int,
+) -> list[_Trial]:
+    """Trials around ``target_bytes``, stopping at the first predicted within tolerance.
+
+    A budget is a joint choice of quality and scale for every image, so the search is
+    over that one number, aiming a quarter of the way into the tolerance band (the upper
+    half of the band, with room for the search's estimates to run high). Every budget tried
+    is kept by the estimator, so a search after a save's correction starts from the
+    encodings it already has. Until the target is bracketed, the budget is rescaled by
+    how far the nearest trial's encoded bytes are from the aim; after that, the next
+    budget interpolates log(image bytes) against log(budget) between the bracketing
+    trials, halving the bracket instead whenever two steps land on the same side. The
+    search ends when a trial lands in the band, or the bracket is too narrow for a
+    different allocation.
+    """
+    if target_bytes == 0:
+        return [estimator.trial(0)]
+
+    tolerance = int(target_bytes * _TOLERANCE)
+    aim = target_bytes - tolerance // 4
+    needed = max(1, aim - estimator.overhead - estimator.correction)
+    sides: list[bool] = []
+    for _ in range(max_iterations):
+        below: Optional[int] = None
+        above: Optional[int] = None
+        for budget, trial in estimator.budgets.items():
+            predicted_size = estimator.predict(trial)
+            if target_bytes - tolerance <= predicted_size <= target_bytes:
+                return list(estimator.budgets.values())
+            if predicted_size > target_bytes:
+                if trial.model_bytes > budget:
+                    return list(estimator.budgets.values())  # every image is at its smallest point
+                above = budget if above is None or budget < above else above
             else:
-                try:
-                    pdf_image.replace(image_bytes, pikepdf.Name("/DCTDecode"))
-                except AttributeError:
-                    continue
+                if trial.slope == 0:
+                    return list(estimator.budgets.values())  # nothing was given up
+                below = budget if below is None or budget > below else below
+        if below is not None and above is not None and max(below, 1) * _MIN_BRACKET >= above:
+            break
 
+        if not estimator.budgets:
+            budget = max(estimator.image_budget(aim), 0)
+        elif below is not None and above is not None:
+            bisect = len(sides) >= 2 and sides[-1] == sides[-2]
+            budget = _interpolate_budget(estimator.budgets, needed, below, above, bisect=bisect)
+        else:
+            budget = _rescale_budget(estimator.budgets, needed)
+        if budget in estimator.budgets:
+            break
+        trial = estimator.trial(budget)
+        sides.append(estimator.predict(trial) > target_bytes)
 
-def compress_pdf(
+    return list(estimator.budgets.values())
+
+
+def _rescale_budget(budgets: dict[int, _Trial], needed: int) -> int:
+    def miss(entry: tuple[int, _Trial]) -> float:
+        return abs(math.log(max(entry[1].image_bytes, 1) / needed))
+
+    budget, trial = min(budgets.items(), key=miss)
+    return round(max(budget, 1) * needed / max(trial.image_bytes, 1))
+
+
+def _interpolate_budget(
+    budgets: dict[int, _Trial], needed: int, below: int, above: int, *, bisect: bool
+) -> int:
+    low, high = math.log(max(below, 1)), math.log(above)
+    low_bytes = math.log(max(budgets[below].image_bytes, 1))
+    high_bytes = math.log(max(budgets[above].image_bytes, 1))
+    position = 0.5
+    if not bisect and high_bytes > low_bytes:
+        position = (math.log(needed) - low_bytes) / (high_bytes - low_bytes)
+    # Points too close to either end would barely move the bracket.
+    margin = math.log(_MIN_BRACKET) / (high - low)
+    if not margin < position < 1 - margin:
+        position = 0.5
+    return round(math.exp(low + position * (high - low)))
+
+
+def _choose_trial(
+    trials: list[_Trial],
+    estimator: _SizeEstimator,
+    target_bytes: int,
+    confirmed: set[tuple],
+) -> Optional[_Trial]:
+    candidates = [trial for trial in trials if trial.key not in confirmed]
+    if not candidates:
+        return None
+
+    if target_bytes == 0:
+        return min(candidates, key=estimator.predict)
+
+    under_target = [trial for trial in candidates if estimator.predict(trial) <= target_bytes]
+    if under_target:
+        return max(under_target, key=estimator.predict)
+    return min(candidates, key=lambda trial: abs(target_bytes - estimator.predict(trial)))
+
+
+def _next_trial(
+    estimator: _SizeEstimator,
+    target_bytes: int,
+    confirmed: set[tuple],
+    *,
+    max_iterations: int,
+) -> Optional[_Trial]:
+    trials = _search_trials(estimator, target_bytes, max_iterations=max_iterations)
+    return _choose_trial(trials, estimator, target_bytes, confirmed)
+
+
+_MAX_CONFIRMING_SAVES = 3
+
+
+def _compress_pdf(
     source_path: Path,
     target_path: Path,
     target_size_mb: float,
@@ -96,175 +887,339 @@ def compress_pdf(
     max_quality: int = 95,
     max_iterations: int = 6,
     preserve_metadata: bool = False,
+    progress: Optional[ProgressCallback] = None,
 ) -> CompressionResult:
+    trace = current_trace()
     target_bytes = max(int(target_size_mb * 1024 * 1024), 0)
     original_size = source_path.stat().st_size
 
+    def report(phase: str, trial: Optional[_Trial] = None, size_bytes: Optional[int] = None) -> None:
+        if trace is not None and trial is not None and size_bytes is not None:
+            trace.record_iteration(phase, trial.quality, trial.downscale_factor, size_bytes)
+        if progress is not None:
+            progress(
+                ProgressEvent(
+                    phase,
+                    iteration=len(checked) + len(confirmed),
+                    quality=trial.quality if trial else None,
+                    downscale_factor=trial.downscale_factor if trial else None,
+                    size_bytes=size_bytes,
+                    target_bytes=target_bytes,
+                )
+            )
+
+    checked: set[tuple] = set()
+    confirmed: set[tuple] = set()
+
     if target_bytes > 0 and original_size <= target_bytes:
         shutil.copyfile(source_path, target_path)
+        report("finished", size_bytes=original_size)
         return CompressionResult(target_path, original_size)
 
-    best_output: Optional[Path] = None
+    best_candidate: Optional[_Candidate] = None
     best_diff = float("inf")
-    best_size = original_size
-
-    best_under_target_bytes: Optional[bytes] = None
-    best_under_target_size: Optional[int] = None
-    best_under_target_diff: Optional[int] = None
-
-    low, high = min_quality, max_quality
-    base_downscale = _calculate_base_downscale(original_size, target_bytes)
-
-    for iteration in range(1, max_iterations + 1):
-        quality = max(min_quality, min(max_quality, (low + high) // 2))
-        iteration_path = target_path.with_name(f"{target_path.stem}.tmp.{iteration}{target_path.suffix}")
-
-        downscale_factor = _calculate_iteration_downscale(quality, min_quality, max_quality, base_downscale)
-
-        with pikepdf.open(source_path) as pdf:
-            try:
-                _recompress_images(pdf, quality, downscale_factor=downscale_factor)
-            except Exception:
-                pass
-
-            if not preserve_metadata:
-                try:
-                    pdf.docinfo.clear()
-                except (AttributeError, ValueError):
-                    pass
-
-            pdf.save(
-                iteration_path,
-                linearize=True,
-                compress_streams=True,
-                object_stream_mode=pikepdf.ObjectStreamMode.generate,
+    best_under_target: Optional[_Candidate] = None
+    optimized: Optional[_OptimizedSource] = None
+
+    search_profile = settings.COMPRESS_SEARCH_SAVE_PROFILE
+
+    try:
+        report("analyzing", size_bytes=original_size)
+        # Lossless savings come before any image is degraded, and a document they bring
+        # under the target never reaches the search. The optimized copy is the source
+        # every candidate is built from; it becomes the result unless a candidate beats it.
+        optimized = _save_optimized(source_path, target_path, preserve_metadata=preserve_metadata)
+        optimized_size = optimized.size_bytes
+        if target_bytes > 0 and optimized_size <= target_bytes:
+            optimized.write_to(target_path)
+            report("finished", size_bytes=optimized_size)
+            return CompressionResult(target_path, optimized_size)
+
+        with ImageCache() as image_cache, _open_document(optimized) as pdf:
+            images, skipped = _select_images(pdf, min_quality, target_bytes)
+            if trace is not None:
+                trace.image_count = len(images)
+                trace.images_skipped.update(reason for _, reason in skipped)
+                trace.image_bytes_in = sum(_raw_size(raw_image) for raw_image in images)
+            if not images:
+                optimized.write_to(target_path)
+                report("finished", size_bytes=optimized_size)
+                return CompressionResult(target_path, optimized_size)
+            estimator = _SizeEstimator(
+                optimized,
+                images,
+                preserve_metadata=preserve_metadata,
+                image_cache=image_cache,
+                min_quality=min_quality,
+                max_quality=max_quality,
+                resolutions=effective_dpi(pdf),
+                search_profile=search_profile,
             )
+            search_saves_left = _MAX_CONFIRMING_SAVES if search_profile != "final" else 0
 
-        compressed_size = iteration_path.stat().st_size
-        diff = abs(target_bytes - compressed_size) if target_bytes > 0 else compressed_size
+            # The search runs on predicted sizes; real saves only confirm the chosen point.
+            # With a cheaper search profile the point is checked with a fast save first,
+            # and only a point predicted to fit gets the final linearized save. Any save
+            # that misses the prediction corrects the estimator and the search runs again.
+            for _ in range(_MAX_CONFIRMING_SAVES):
+                trial = _next_trial(estimator, target_bytes, confirmed, max_iterations=max_iterations)
+                while trial is not None and search_saves_left > 0 and trial.key not in checked:
+                    search_saves_left -= 1
+                    checked.add(trial.key)
+                    probe = _save_candidate(
+                        optimized,
+                        estimator.encoded_images(trial),
+                        preserve_metadata=preserve_metadata,
+                        profile=search_profile,
+                    )
+                    probe.close()
+                    estimator.correct(trial, probe.size_bytes + estimator.search_delta)
+                    report("probing", trial, probe.size_bytes + estimator.search_delta)
+                    trial = _next_trial(
+                        estimator, target_bytes, confirmed, max_iterations=max_iterations
+                    )
+                if trial is None:
+                    break
+                confirmed.add(trial.key)
 
-        if diff < best_diff:
-            shutil.copyfile(iteration_path, target_path)
-            best_output = target_path
-            best_diff = diff
-            best_size = compressed_size
+                candidate = _save_candidate(
+                    optimized,
+                    estimator.encoded_images(trial),
+                    preserve_metadata=preserve_metadata,
+                )
+                candidate.image_bytes = trial.image_bytes
+                estimator.correct(trial, candidate.size_bytes)
+                report("saving", trial, candidate.size_bytes)
 
-        if target_bytes > 0 and compressed_size <= target_bytes:
-            under_diff = target_bytes - compressed_size
-            if best_under_target_diff is None or under_diff < best_under_target_diff:
-                best_under_target_bytes = iteration_path.read_bytes()
-                best_under_target_size = compressed_size
-                best_under_target_diff = under_diff
+                diff = abs(target_bytes - candidate.size_bytes) if target_bytes > 0 else candidate.size_bytes
+                if diff < best_diff:
+                    best_candidate = _replace_candidate(best_candidate, candidate, best_under_target)
+                    best_diff = diff
 
-        if target_bytes == 0:
-            iteration_path.unlink(missing_ok=True)
-            continue
+                if target_bytes > 0 and candidate.size_bytes <= target_bytes:
+                    if best_under_target is None or candidate.size_bytes > best_under_target.size_bytes:
+                        best_under_target = _replace_candidate(best_under_target, candidate, best_candidate)
 
-        if compressed_size > target_bytes:
-            high = quality - 1
-        else:
-            low = quality + 1
+                if candidate is not best_candidate and candidate is not best_under_target:
+                    candidate.close()
 
-        tolerance = int(target_bytes * 0.10)
-        should_break = False
-        if best_under_target_diff is not None:
-            if best_under_target_diff <= tolerance or iteration == max_iterations:
-                should_break = True
+                if target_bytes == 0 or candidate.size_bytes <= target_bytes:
+                    break
 
-        iteration_path.unlink(missing_ok=True)
+        winner = best_under_target or best_candidate
+        if winner is None or winner.size_bytes > optimized_size:
+            if trace is not None:
+                trace.image_bytes_out = trace.image_bytes_in
+            optimized.write_to(target_path)
+            report("finished", size_bytes=optimized_size)
+            return CompressionResult(target_path, optimized_size)
 
-        if low > high or should_break:
-            break
+        winner.write_to(target_path)
+        if trace is not None:
+            trace.image_bytes_out = winner.image_bytes
+        report("finished", size_bytes=winner.size_bytes)
+        return CompressionResult(target_path, winner.size_bytes)
+    finally:
+        for candidate in (best_candidate, best_under_target):
+            if candidate is not None:
+                candidate.close()
+        if optimized is not None:
+            optimized.close()
 
-    final_size = original_size
 
-    if best_under_target_bytes is not None and best_under_target_size is not None:
-        with open(target_path, "wb") as f:
-            f.write(best_under_target_bytes)
-        best_output = target_path
-        final_size = best_under_target_size
-    elif best_output is not None and target_path.exists():
-        final_size = best_size
-    else:
-        shutil.copyfile(source_path, target_path)
-        best_output = target_path
-        final_size = original_size
-
-    if target_bytes > 0 and final_size > target_bytes:
-        fallback_scale = base_downscale
-        previous_scale = None
-        attempt = 0
-
-        while final_size > target_bytes:
-            attempt += 1
-            if previous_scale is None:
-                fallback_scale = max(0.3, min(0.95, fallback_scale * 0.85 if fallback_scale > 0 else 0.85))
-            else:
-                fallback_scale = max(0.3, fallback_scale * 0.85)
+def compress_pdf(
+    source_path: Path,
+    target_path: Path,
+    target_size_mb: float,
+    *,
+    min_quality: int = 20,
+    max_quality: int = 95,
+    max_iterations: int = 6,
+    preserve_metadata: bool = False,
+    progress: Optional[ProgressCallback] = None,
+) -> CompressionResult:
+    """Compress ``source_path`` to at most ``target_size_mb`` where possible.
 
-            if previous_scale is not None and math.isclose(previous_scale, fallback_scale, rel_tol=1e-3):
-                break
+    The result carries a CompressionTrace of the job: time per phase, the saves made,
+    every confirmed trial and the image bytes before and after.
+    """
+    with tracing(CompressionTrace()) as trace:
+        result = _compress_pdf(
+            source_path,
+            target_path,
+            target_size_mb,
+            min_quality=min_quality,
+            max_quality=max_quality,
+            max_iterations=max_iterations,
+            preserve_metadata=preserve_metadata,
+            progress=progress,
+        )
+    trace.finish()
+    result.trace = trace
+    return result
 
-            previous_scale = fallback_scale
 
-            if fallback_scale >= 0.999:
-                break
+class CompressionPlan:
+    """Where sharded execution encodes its images.
 
-            fallback_path = target_path.with_name(
-                f"{target_path.stem}.fallback.{attempt}{target_path.suffix}"
+    With a ``slope`` (distortion per byte, from the planner's allocation) every shard
+    measures its own images' curves and takes the point each curve reaches at that slope,
+    which is what allocating the whole document at once would pick. Without one, every
+    image is encoded at ``quality`` and ``downscale_factor``. ``predicted_size_bytes`` is
+    the planner's estimate of the merged document, checked before any shard is dispatched.
+    """
+
+    def __init__(
+        self,
+        quality: Optional[int],
+        downscale_factor: float,
+        predicted_size_bytes: int,
+        slope: Optional[float] = None,
+        min_quality: int = 20,
+        max_quality: int = 95,
+        target_bytes: int = 0,
+    ):
+        self.quality = quality
+        self.downscale_factor = downscale_factor
+        self.predicted_size_bytes = predicted_size_bytes
+        self.slope = slope
+        self.min_quality = min_quality
+        self.max_quality = max_quality
+        self.target_bytes = target_bytes
+
+
+def plan_compression(
+    source_path: Path,
+    target_size_mb: float,
+    *,
+    min_quality: int = 20,
+    max_quality: int = 95,
+    max_iterations: int = 6,
+    preserve_metadata: bool = False,
+    sample_size: Optional[int] = None,
+) -> Optional[CompressionPlan]:
+    """Allocate a document's image budget without saving any candidate.
+
+    Used by sharded execution, where every shard encodes its pages at the planned slope
+    and only the merge saves. Returns None when the search finds no usable point.
+    """
+    target_bytes = max(int(target_size_mb * 1024 * 1024), 0)
+
+    with ImageCache() as image_cache, pikepdf.open(source_path) as pdf:
+        estimator = _SizeEstimator(
+            source_path,
+            _recompressible_images(pdf, min_quality=min_quality, target_bytes=target_bytes),
+            preserve_metadata=preserve_metadata,
+            image_cache=image_cache,
+            min_quality=min_quality,
+            max_quality=max_quality,
+            resolutions=effective_dpi(pdf),
+            sample_size=sample_size,
+        )
+        trial = _next_trial(estimator, target_bytes, set(), max_iterations=max_iterations)
+        if trial is None:
+            return None
+        return CompressionPlan(
+            trial.quality,
+            trial.downscale_factor,
+            estimator.predict(trial),
+            slope=trial.slope,
+            min_quality=min_quality,
+            max_quality=max_quality,
+            target_bytes=target_bytes,
+        )
+
+
+def count_pages(source_path: Path) -> int:
+    with pikepdf.open(source_path) as pdf:
+        return len(pdf.pages)
+
+
+def encode_page_images(
+    source_path: Path, first_page: int, last_page: int, plan: CompressionPlan
+) -> EncodedImages:
+    """Encode the images first used on pages [first_page, last_page) as the plan says.
+
+    An image shared across shards belongs to the shard of the first page using it, so
+    every image is encoded by exactly one shard.
+    """
+    with ImageCache() as image_cache, pikepdf.open(source_path) as pdf:
+        images = _recompressible_images(
+            pdf, min_quality=plan.min_quality, target_bytes=plan.target_bytes
+        )
+
+        earlier: set[ImageKey] = set()
+        in_range: set[ImageKey] = set()
+        for page_index, page in enumerate(pdf.pages[:last_page]):
+            keys = earlier if page_index < first_page else in_range
+            keys.update(raw_image.objgen for _, _, raw_image in _page_images(page))
+
+        shard_images = [
+            raw_image
+            for raw_image in images
+            if raw_image.objgen in in_range and raw_image.objgen not in earlier
+        ]
+        if plan.slope is None:
+            if plan.quality is None:
+                return {}
+            assignments = _uniform_assignments(shard_images, plan.quality, plan.downscale_factor)
+        else:
+            curves = _measure_curves(
+                shard_images,
+                min_quality=plan.min_quality,
+                max_quality=plan.max_quality,
+                resolutions=effective_dpi(pdf),
+                image_cache=image_cache,
             )
+            assignments = {}
+            for image_key, curve in curves.items():
+                point = curve.at_slope(plan.slope)
+                if not point.keeps_original:
+                    assignments[image_key] = (point.quality, point.downscale_factor, point.mode)
+        return _encode_images(shard_images, assignments, image_cache=image_cache)
 
-            with pikepdf.open(source_path) as pdf:
-                try:
-                    _recompress_images(pdf, min_quality, downscale_factor=fallback_scale)
-                except Exception:
-                    pass
-
-                if not preserve_metadata:
-                    try:
-                        pdf.docinfo.clear()
-                    except (AttributeError, ValueError):
-                        pass
-
-                pdf.save(
-                    fallback_path,
-                    linearize=True,
-                    compress_streams=True,
-                    object_stream_mode=pikepdf.ObjectStreamMode.generate,
-                )
 
-            fallback_size = fallback_path.stat().st_size
-            fallback_diff = abs(target_bytes - fallback_size)
-
-            if fallback_diff < best_diff:
-                shutil.copyfile(fallback_path, target_path)
-                best_output = target_path
-                best_diff = fallback_diff
-                best_size = fallback_size
-                final_size = fallback_size
-
-            if fallback_size <= target_bytes:
-                under_diff = target_bytes - fallback_size
-                if best_under_target_diff is None or under_diff < best_under_target_diff:
-                    best_under_target_bytes = fallback_path.read_bytes()
-                    best_under_target_size = fallback_size
-                    best_under_target_diff = under_diff
-
-            fallback_path.unlink(missing_ok=True)
-
-            if fallback_size <= target_bytes or math.isclose(fallback_scale, 0.3, abs_tol=1e-3):
-                break
-
-        if best_under_target_bytes is not None and best_under_target_size is not None:
-            with open(target_path, "wb") as f:
-                f.write(best_under_target_bytes)
-            best_output = target_path
-            final_size = best_under_target_size
-        elif best_output is not None and target_path.exists():
-            final_size = best_size
-
-    if final_size > original_size:
-        shutil.copyfile(source_path, target_path)
-        final_size = original_size
+def save_encoded_images(
+    source_path: Path,
+    target_path: Path,
+    encoded_images: EncodedImages,
+    *,
+    preserve_metadata: bool = False,
+) -> CompressionResult:
+    with tracing(CompressionTrace()) as trace:
+        candidate = _save_candidate(
+            source_path, encoded_images, preserve_metadata=preserve_metadata, optimize=True
+        )
+    trace.finish()
+    trace.image_count = len(encoded_images)
+    trace.image_bytes_out = sum(len(encoded[0]) for encoded in encoded_images.values())
+    try:
+        if candidate.size_bytes > source_path.stat().st_size:
+            shutil.copyfile(source_path, target_path)
+            return CompressionResult(target_path, source_path.stat().st_size, trace)
+        candidate.write_to(target_path)
+        return CompressionResult(target_path, candidate.size_bytes, trace)
+    finally:
+        candidate.close()
+
 
-    return CompressionResult(best_output, final_size)
+def dump_encoded_images(encoded_images: EncodedImages, fileobj: IO[bytes]) -> None:
+    with zipfile.ZipFile(fileobj, "w", compression=zipfile.ZIP_STORED) as archive:
+        for (objnum, generation), (image_bytes, size, image_format) in encoded_images.items():
+            name = f"{objnum}-{generation}-{size[0]}x{size[1]}.{image_format}"
+            archive.writestr(name, image_bytes)
+
+
+def load_encoded_images(fileobj: IO[bytes]) -> EncodedImages:
+    encoded_images: EncodedImages = {}
+    with zipfile.ZipFile(fileobj) as archive:
+        for name in archive.namelist():
+            stem, image_format = name.split(".", 1)
+            objnum, generation, size = stem.split("-")
+            width, height = size.split("x")
+            encoded_images[(int(objnum), int(generation))] = (
+                archive.read(name),
+                (int(width), int(height)),
+                image_format,
+            )
+    return encoded_images
@@ -0,0 +1,59 @@
+from __future__ import annotations
+
+from typing import IO, Optional
+
+import pikepdf
+
+from app.core.config import settings
+from app.models import CostClass
+
+
+class DocumentCost:
+    """What a document will cost to compress, as far as it can be told at upload time."""
+
+    def __init__(
+        self, size_bytes: int, page_count: Optional[int] = None, image_pixels: Optional[int] = None
+    ):
+        self.size_bytes = size_bytes
+        self.page_count = page_count
+        self.image_pixels = image_pixels
+
+    @property
+    def cost_class(self) -> CostClass:
+        megapixels = (self.image_pixels or 0) / 1_000_000
+        pages = self.page_count or 0
+        if (
+            self.size_bytes > settings.COST_HEAVY_MIN_BYTES
+            or pages > settings.COST_HEAVY_MIN_PAGES
+            or megapixels > settings.COST_HEAVY_MIN_MEGAPIXELS
+        ):
+            return CostClass.HEAVY
+        if (
+            self.size_bytes <= settings.COST_SMALL_MAX_BYTES
+            and pages <= settings.COST_SMALL_MAX_PAGES
+            and megapixels <= settings.COST_SMALL_MAX_MEGAPIXELS
+        ):
+            return CostClass.SMALL
+        return CostClass.STANDARD
+
+
+def measure_cost(fileobj: IO[bytes], size_bytes: int) -> DocumentCost:
+    """Count pages and image pixels from the object dictionaries; no stream is decoded.
+
+    Falls back to the size alone when the file cannot be parsed, leaving the worker to
+    report the error.
+    """
+    try:
+        fileobj.seek(0)
+        with pikepdf.open(fileobj) as pdf:
+            seen: set[tuple[int, int]] = set()
+            image_pixels = 0
+            for page in pdf.pages:
+                for raw_image in page.images.values():
+                    if raw_image.objgen in seen:
+                        continue
+                    seen.add(raw_image.objgen)
+                    image_pixels += int(raw_image.get("/Width", 0)) * int(raw_image.get("/Height", 0))
+            return DocumentCost(size_bytes, len(pdf.pages), image_pixels)
+    except (pikepdf.PdfError, OSError, ValueError, TypeError):
+        return DocumentCost(size_bytes)
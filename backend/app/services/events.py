@@ -0,0 +1,160 @@
+from __future__ import annotations
+
+import json
+import os
+import threading
+from typing import Any, Optional
+
+import redis
+import redis.asyncio as aioredis
+
+from app.core.config import settings
+from app.models import CompressionTask, TaskStatus
+
+CHANNEL_PREFIX = "task-events:"
+LAST_PROGRESS_PREFIX = "task-progress:"
+STATE_PREFIX = "task-state:"
+TERMINAL_STATUSES = (TaskStatus.COMPLETED.value, TaskStatus.FAILED.value)
+
+
+def channel(task_id: str) -> str:
+    return f"{CHANNEL_PREFIX}{task_id}"
+
+
+def task_state(task: CompressionTask) -> dict[str, Any]:
+    """The public view of a task, shared by GET /tasks/{id} and the status events."""
+    result_download_url = None
+    if task.status == TaskStatus.COMPLETED and task.compressed_file_path:
+        result_download_url = f"/api/v1/download/{task.id}"
+
+    compressed_size_mb = None
+    if task.compressed_size_bytes is not None:
+        compressed_size_mb = task.compressed_size_bytes / (1024 * 1024)
+
+    return {
+        "task_id": task.id,
+        "status": task.status.value,
+        "original_filename": task.original_filename,
+        "original_size_mb": task.original_size_bytes / (1024 * 1024),
+        "compressed_size_mb": compressed_size_mb,
+        "target_size_mb": task.target_size_mb,
+        "created_at": task.created_at.isoformat(),
+        "completed_at": task.completed_at.isoformat() if task.completed_at else None,
+        "result_download_url": result_download_url,
+        "error_message": task.error_message,
+    }
+
+
+_client: Optional[redis.Redis] = None
+_client_lock = threading.Lock()
+
+
+def _get_client() -> redis.Redis:
+    global _client
+    client = _client
+    if client is None:
+        with _client_lock:
+            client = _client
+            if client is None:
+                client = _client = redis.Redis.from_url(
+                    settings.REDIS_URL, socket_connect_timeout=2, socket_timeout=5
+                )
+    return client
+
+
+def _reset_client_after_fork() -> None:
+    global _client, _client_lock
+    _client = None
+    _client_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_client_after_fork)
+
+
+def _state_ttl(state: dict[str, Any]) -> int:
+    if state["status"] in TERMINAL_STATUSES:
+        return settings.TASK_STATE_CACHE_FINISHED_TTL_SECONDS
+    return settings.TASK_STATE_CACHE_TTL_SECONDS
+
+
+def _publish(task_id: str, event: dict[str, Any], *, remember_progress: bool) -> None:
+    # Events are best effort: a Redis outage must never fail the compression itself.
+    payload = json.dumps(event)
+    try:
+        pipe = _get_client().pipeline(transaction=False)
+        pipe.publish(channel(task_id), payload)
+        if remember_progress:
+            pipe.set(LAST_PROGRESS_PREFIX + task_id, payload, ex=settings.TASK_EVENTS_TTL_SECONDS)
+        else:
+            pipe.delete(LAST_PROGRESS_PREFIX + task_id)
+            pipe.set(STATE_PREFIX + task_id, payload, ex=_state_ttl(event))
+        pipe.execute()
+    except redis.RedisError:
+        pass
+
+
+def publish_status(task: CompressionTask) -> None:
+    """Announce a status transition and write it through to the status cache."""
+    _publish(task.id, {"type": "status", **task_state(task)}, remember_progress=False)
+
+
+def publish_progress(task_id: str, progress: dict[str, Any]) -> None:
+    _publish(task_id, {"type": "progress", "task_id": task_id, **progress}, remember_progress=True)
+
+
+def cached_task_state(task_id: str) -> Optional[dict[str, Any]]:
+    try:
+        payload = _get_client().get(STATE_PREFIX + task_id)
+    except redis.RedisError:
+        return None
+    if not payload:
+        return None
+    state = json.loads(payload)
+    state.pop("type", None)
+    return state
+
+
+def cache_task_state(task: CompressionTask, *, overwrite: bool = True) -> None:
+    """Store a task's state in the status cache.
+
+    Read-through fills pass ``overwrite=False`` so they never replace a newer state the
+    worker wrote in the meantime.
+    """
+    state = {"type": "status", **task_state(task)}
+    try:
+        _get_client().set(
+            STATE_PREFIX + task.id, json.dumps(state), ex=_state_ttl(state), nx=not overwrite
+        )
+    except redis.RedisError:
+        pass
+
+
+class Subscription:
+    """A live feed of one task's events, for the API's event stream."""
+
+    def __init__(self, task_id: str):
+        self.task_id = task_id
+        self._client = aioredis.Redis.from_url(settings.REDIS_URL)
+        self._pubsub = self._client.pubsub()
+
+    async def open(self) -> "Subscription":
+        await self._pubsub.subscribe(channel(self.task_id))
+        return self
+
+    async def last_progress(self) -> Optional[dict[str, Any]]:
+        payload = await self._client.get(LAST_PROGRESS_PREFIX + self.task_id)
+        return json.loads(payload) if payload else None
+
+    async def next_event(self, timeout: float) -> Optional[dict[str, Any]]:
+        message = await self._pubsub.get_message(ignore_subscribe_messages=True, timeout=timeout)
+        if message is None or message["type"] != "message":
+            return None
+        return json.loads(message["data"])
+
+    async def close(self) -> None:
+        try:
+            await self._pubsub.unsubscribe()
+            await self._pubsub.aclose()
+        finally:
+            await self._client.aclose()
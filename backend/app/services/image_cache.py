@@ -0,0 +1,211 @@
+from __future__ import annotations
+
+import io
+import mmap
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import IO, Optional
+
+import pikepdf
+from pikepdf.models.image import DependencyError, NotExtractableError, UnsupportedImageTypeError
+from PIL import Image
+
+from app.core.config import settings
+from app.services.image_probe import filters
+
+ImageKey = tuple[int, int]
+
+# What pikepdf raises for images it cannot hand to Pillow: 16-bit samples, Separation and
+# DeviceN color, or a filter whose decoder is not installed (JBIG2)
+_UNDECODABLE = (
+    NotImplementedError,
+    ValueError,
+    UnsupportedImageTypeError,
+    NotExtractableError,
+    DependencyError,
+)
+
+
+def normalize_image(pil_image: Image.Image) -> Image.Image:
+    if pil_image.mode in ("RGBA", "LA"):
+        background = Image.new("RGB", pil_image.size, (255, 255, 255))
+        background.paste(pil_image, mask=pil_image.split()[-1])
+        return background
+    if pil_image.mode != "RGB":
+        return pil_image.convert("RGB")
+    return pil_image
+
+
+def open_image(
+    raw_image: pikepdf.Object, *, draft_size: Optional[tuple[int, int]] = None
+) -> Optional[Image.Image]:
+    # Reads stream data through qpdf, so it must run on the thread that owns the Pdf.
+    # DCT images come back lazily; their pixels are decoded by finish_decode().
+    if draft_size is not None and _draftable(raw_image):
+        # libjpeg decodes straight to 1/2, 1/4 or 1/8 scale, no smaller than draft_size.
+        try:
+            pil_image = Image.open(io.BytesIO(raw_image.read_raw_bytes()))
+            pil_image.draft(pil_image.mode, draft_size)
+            return pil_image
+        except OSError:
+            pass
+    try:
+        return pikepdf.PdfImage(raw_image).as_pil_image()
+    except _UNDECODABLE:
+        return None  # the image keeps its original bytes
+
+
+def _draftable(raw_image: pikepdf.Object) -> bool:
+    # Plain JPEGs only: decode arrays, transforms and other color spaces need pikepdf.
+    return (
+        filters(raw_image) == ["/DCTDecode"]
+        and "/Decode" not in raw_image
+        and "/DecodeParms" not in raw_image
+        and raw_image.get("/ColorSpace") in (pikepdf.Name.DeviceRGB, pikepdf.Name.DeviceGray)
+    )
+
+
+def finish_decode(pil_image: Optional[Image.Image]) -> Optional[Image.Image]:
+    if pil_image is None:
+        return None
+    try:
+        return normalize_image(pil_image)
+    except OSError:
+        return None
+
+
+class ImageCache:
+    """Decoded RGB pixels of a document's image XObjects, shared by every trial of one job.
+
+    Images are kept in memory up to ``max_bytes``. Least recently used entries are then
+    spilled to a memory-mapped scratch file of at most ``spill_max_bytes``, and dropped
+    entirely (to be decoded again on demand) once that is full too.
+    """
+
+    def __init__(
+        self,
+        max_bytes: Optional[int] = None,
+        spill_max_bytes: Optional[int] = None,
+        scratch_dir: Optional[Path] = None,
+    ):
+        self.max_bytes = settings.IMAGE_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+        self.spill_max_bytes = (
+            settings.IMAGE_CACHE_SPILL_MAX_BYTES if spill_max_bytes is None else spill_max_bytes
+        )
+        self.scratch_dir = settings.IMAGE_CACHE_SCRATCH_DIR if scratch_dir is None else scratch_dir
+
+        self._lock = threading.Lock()
+        self._memory: OrderedDict[ImageKey, Image.Image] = OrderedDict()
+        self._memory_bytes = 0
+        self._spilled: OrderedDict[ImageKey, tuple[int, int, tuple[int, int]]] = OrderedDict()
+        self._undecodable: set[ImageKey] = set()
+
+        self._scratch_file: Optional[IO[bytes]] = None
+        self._scratch_map: Optional[mmap.mmap] = None
+        self._free_extents: list[tuple[int, int]] = []
+
+    def __enter__(self) -> "ImageCache":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def lookup(self, key: ImageKey) -> tuple[bool, Optional[Image.Image]]:
+        with self._lock:
+            return self._lookup(key)
+
+    def put(self, key: ImageKey, pil_image: Optional[Image.Image]) -> None:
+        with self._lock:
+            if pil_image is None:
+                self._undecodable.add(key)
+                return
+            if key in self._memory or key in self._spilled:
+                return
+
+            self._memory[key] = pil_image
+            self._memory_bytes += _image_nbytes(pil_image)
+            while self._memory_bytes > self.max_bytes and self._memory:
+                evicted_key, evicted_image = self._memory.popitem(last=False)
+                self._memory_bytes -= _image_nbytes(evicted_image)
+                self._spill(evicted_key, evicted_image)
+
+    def close(self) -> None:
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+            self._spilled.clear()
+            self._free_extents = []
+            if self._scratch_map is not None:
+                self._scratch_map.close()
+                self._scratch_map = None
+            if self._scratch_file is not None:
+                self._scratch_file.close()
+                self._scratch_file = None
+
+    def _lookup(self, key: ImageKey) -> tuple[bool, Optional[Image.Image]]:
+        if key in self._undecodable:
+            return True, None
+
+        pil_image = self._memory.get(key)
+        if pil_image is not None:
+            self._memory.move_to_end(key)
+            return True, pil_image
+
+        extent = self._spilled.get(key)
+        if extent is not None and self._scratch_map is not None:
+            offset, length, size = extent
+            self._spilled.move_to_end(key)
+            return True, Image.frombytes("RGB", size, self._scratch_map[offset : offset + length])
+
+        return False, None
+
+    def _spill(self, key: ImageKey, pil_image: Image.Image) -> None:
+        length = _image_nbytes(pil_image)
+        if length <= 0 or length > self.spill_max_bytes:
+            return
+
+        offset = self._allocate(length)
+        while offset is None and self._spilled:
+            _, (old_offset, old_length, _) = self._spilled.popitem(last=False)
+            self._release(old_offset, old_length)
+            offset = self._allocate(length)
+        if offset is None:
+            return
+
+        self._scratch_map[offset : offset + length] = pil_image.tobytes()
+        self._spilled[key] = (offset, length, pil_image.size)
+
+    def _allocate(self, length: int) -> Optional[int]:
+        if self._scratch_map is None:
+            self._scratch_file = tempfile.TemporaryFile(
+                prefix="image-cache-",
+                dir=str(self.scratch_dir) if self.scratch_dir else None,
+            )
+            self._scratch_file.truncate(self.spill_max_bytes)
+            self._scratch_map = mmap.mmap(self._scratch_file.fileno(), self.spill_max_bytes)
+            self._free_extents = [(0, self.spill_max_bytes)]
+
+        for index, (offset, free_length) in enumerate(self._free_extents):
+            if free_length >= length:
+                if free_length == length:
+                    del self._free_extents[index]
+                else:
+                    self._free_extents[index] = (offset + length, free_length - length)
+                return offset
+        return None
+
+    def _release(self, offset: int, length: int) -> None:
+        extents = sorted(self._free_extents + [(offset, length)])
+        merged: list[tuple[int, int]] = []
+        for extent_offset, extent_length in extents:
+            if merged and merged[-1][0] + merged[-1][1] == extent_offset:
+                merged[-1] = (merged[-1][0], merged[-1][1] + extent_length)
+            else:
+                merged.append((extent_offset, extent_length))
+        self._free_extents = merged
+
+
+def _image_nbytes(pil_image: Image.Image) -> int:
+    return pil_image.width * pil_image.height * len(pil_image.getbands())
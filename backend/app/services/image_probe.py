@@ -0,0 +1,140 @@
+from __future__ import annotations
+
+from typing import Optional
+
+import pikepdf
+
+from app.core.config import settings
+
+# Reasons an image keeps its original bytes
+SKIP_BILEVEL = "bilevel"
+SKIP_TINY = "tiny"
+SKIP_LOW_QUALITY = "low_quality"
+SKIP_SMALL = "small"
+
+_BILEVEL_FILTERS = ("/CCITTFaxDecode", "/JBIG2Decode")
+_MIN_SIDE = 16
+
+# Luminance quantization table from the JPEG standard (Annex K), i.e. IJG quality 50.
+_STANDARD_LUMINANCE_TOTAL = sum(
+    (
+        16, 11, 10, 16, 24, 40, 51, 61,
+        12, 12, 14, 19, 26, 58, 60, 55,
+        14, 13, 16, 24, 40, 57, 69, 56,
+        14, 17, 22, 29, 51, 87, 80, 62,
+        18, 22, 37, 56, 68, 109, 103, 77,
+        24, 35, 55, 64, 81, 104, 113, 92,
+        49, 64, 78, 87, 103, 121, 120, 101,
+        72, 92, 95, 98, 112, 100, 103, 99,
+    )
+)
+
+
+def filters(raw_image: pikepdf.Stream) -> list[str]:
+    value = raw_image.get("/Filter")
+    if value is None:
+        return []
+    if isinstance(value, pikepdf.Array):
+        return [str(name) for name in value]
+    return [str(value)]
+
+
+def jpeg_quality(data: bytes) -> Optional[int]:
+    """Estimate the IJG quality a JPEG was saved at from its luminance quantization table.
+
+    Only the markers before the first scan are read; returns None when no table is found.
+    """
+    position = 2 if data[:2] == b"\xff\xd8" else None
+    while position is not None and position + 4 <= len(data):
+        if data[position] != 0xFF:
+            return None
+        marker = data[position + 1]
+        if marker == 0xFF:
+            position += 1
+            continue
+        if marker == 0xDA:
+            return None
+        length = int.from_bytes(data[position + 2 : position + 4], "big")
+        if marker == 0xDB:
+            table = _luminance_table(data[position + 4 : position + 2 + length])
+            if table is not None:
+                scale = sum(table) * 100 / _STANDARD_LUMINANCE_TOTAL
+                quality = (200 - scale) / 2 if scale <= 100 else 5000 / scale
+                return max(1, min(100, round(quality)))
+        position += 2 + length
+    return None
+
+
+def _luminance_table(segment: bytes) -> Optional[list[int]]:
+    position = 0
+    while position < len(segment):
+        precision, table_id = segment[position] >> 4, segment[position] & 0x0F
+        width = 2 if precision else 1
+        values = segment[position + 1 : position + 1 + 64 * width]
+        if len(values) < 64 * width:
+            return None
+        if table_id == 0:
+            return [
+                int.from_bytes(values[index : index + width], "big")
+                for index in range(0, 64 * width, width)
+            ]
+        position += 1 + 64 * width
+    return None
+
+
+def skip_reason(raw_image: pikepdf.Stream, min_quality: int = 0) -> Optional[str]:
+    """Why re-encoding ``raw_image`` as JPEG is not worth it, judged without decoding it."""
+    image_filters = filters(raw_image)
+    if any(name in _BILEVEL_FILTERS for name in image_filters) or raw_image.get("/BitsPerComponent") == 1:
+        return SKIP_BILEVEL
+    if int(raw_image.get("/Width", 0)) < _MIN_SIDE or int(raw_image.get("/Height", 0)) < _MIN_SIDE:
+        return SKIP_TINY
+    if image_filters == ["/DCTDecode"] and min_quality > 0:
+        quality = jpeg_quality(raw_image.read_raw_bytes())
+        if quality is not None and quality <= min_quality:
+            return SKIP_LOW_QUALITY
+    if _length(raw_image) < settings.COMPRESS_SMALL_IMAGE_BYTES:
+        return SKIP_SMALL
+    return None
+
+
+def select_recompressible(
+    images: list[pikepdf.Stream], min_quality: int = 0, target_bytes: int = 0
+) -> tuple[list[pikepdf.Stream], list[tuple[pikepdf.Stream, str]]]:
+    """Split images into those worth re-encoding and those kept as they are, with reasons.
+
+    Tiny images are always kept. The others could still be downscaled, so they are kept
+    only while together they stay within COMPRESS_SKIP_BYTES_SHARE of the image bytes (or
+    of ``target_bytes``, if smaller), smallest first; a tight target never has to fit
+    around them.
+    """
+    kept: list[pikepdf.Stream] = []
+    skipped: list[tuple[pikepdf.Stream, str]] = []
+    optional: list[tuple[pikepdf.Stream, str]] = []
+    for raw_image in images:
+        reason = skip_reason(raw_image, min_quality)
+        if reason is None:
+            kept.append(raw_image)
+        elif reason == SKIP_TINY:
+            skipped.append((raw_image, reason))
+        else:
+            optional.append((raw_image, reason))
+
+    image_bytes = sum(_length(raw_image) for raw_image in images)
+    allowance = settings.COMPRESS_SKIP_BYTES_SHARE * (
+        min(image_bytes, target_bytes) if target_bytes > 0 else image_bytes
+    )
+    optional.sort(key=lambda entry: _length(entry[0]))
+    for index, (raw_image, reason) in enumerate(optional):
+        if _length(raw_image) > allowance:
+            kept.extend(raw_image for raw_image, _ in optional[index:])
+            break
+        allowance -= _length(raw_image)
+        skipped.append((raw_image, reason))
+
+    kept_keys = {raw_image.objgen for raw_image in kept}
+    return [raw_image for raw_image in images if raw_image.objgen in kept_keys], skipped
+
+
+def _length(raw_image: pikepdf.Stream) -> int:
+    return int(raw_image.get("/Length", 0))
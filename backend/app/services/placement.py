@@ -0,0 +1,121 @@
+from __future__ import annotations
+
+import math
+from typing import Optional
+
+import pikepdf
+
+from app.core.config import settings
+from app.services.allocation import DOWNSCALE_LADDER
+from app.services.image_cache import ImageKey
+from app.services.trace import timed
+
+Matrix = tuple[float, float, float, float, float, float]
+
+_OPERATORS = "q Q cm Do"
+_MAX_FORM_DEPTH = 8
+# Fallback steps below the lowest target DPI start at least this far below it
+_FALLBACK_STEP = 0.8
+
+
+def effective_dpi(pdf: pikepdf.Pdf) -> dict[ImageKey, float]:
+    """The resolution each image XObject is drawn at, from the CTM at its ``Do`` operators.
+
+    An image placed several times gets the resolution of its largest placement, and a
+    placement's resolution is that of its less dense axis. Images never found in a page's
+    content (or its form XObjects) are left out.
+    """
+    resolutions: dict[ImageKey, float] = {}
+    with timed("layout"):
+        for page in pdf.pages:
+            user_unit = float(page.obj.get("/UserUnit", 1))
+            base = (user_unit, 0.0, 0.0, user_unit, 0.0, 0.0)
+            try:
+                _walk(page.obj, page.obj.get("/Resources"), base, resolutions, ())
+            except pikepdf.PdfError:
+                continue
+    return resolutions
+
+
+def _walk(
+    content: pikepdf.Object,
+    resources: Optional[pikepdf.Object],
+    ctm: Matrix,
+    resolutions: dict[ImageKey, float],
+    forms: tuple[tuple[int, int], ...],
+) -> None:
+    xobjects = resources.get("/XObject") if isinstance(resources, pikepdf.Dictionary) else None
+    stack: list[Matrix] = []
+    for operands, operator in pikepdf.parse_content_stream(content, _OPERATORS):
+        op = str(operator)
+        if op == "q":
+            stack.append(ctm)
+        elif op == "Q":
+            if stack:
+                ctm = stack.pop()
+        elif op == "cm" and len(operands) == 6:
+            ctm = _multiply(tuple(float(value) for value in operands), ctm)
+        elif op == "Do" and isinstance(xobjects, pikepdf.Dictionary):
+            xobject = xobjects.get(operands[0]) if operands else None
+            if not isinstance(xobject, pikepdf.Stream):
+                continue
+            if xobject.get("/Subtype") == pikepdf.Name.Image:
+                dpi = _placement_dpi(xobject, ctm)
+                if dpi is not None and dpi > resolutions.get(xobject.objgen, 0.0):
+                    resolutions[xobject.objgen] = dpi
+            elif (
+                xobject.get("/Subtype") == pikepdf.Name.Form
+                and xobject.objgen not in forms
+                and len(forms) < _MAX_FORM_DEPTH
+            ):
+                matrix = xobject.get("/Matrix")
+                form_ctm = _multiply(tuple(float(value) for value in matrix), ctm) if matrix else ctm
+                _walk(
+                    xobject,
+                    xobject.get("/Resources", resources),
+                    form_ctm,
+                    resolutions,
+                    forms + (xobject.objgen,),
+                )
+
+
+def _multiply(m: Matrix, n: Matrix) -> Matrix:
+    a, b, c, d, e, f = m
+    A, B, C, D, E, F = n
+    return (
+        a * A + b * C,
+        a * B + b * D,
+        c * A + d * C,
+        c * B + d * D,
+        e * A + f * C + E,
+        e * B + f * D + F,
+    )
+
+
+def _placement_dpi(raw_image: pikepdf.Stream, ctm: Matrix) -> Optional[float]:
+    # The image fills the unit square, so the CTM's rows are its drawn edges in points.
+    width_inches = math.hypot(ctm[0], ctm[1]) / 72
+    height_inches = math.hypot(ctm[2], ctm[3]) / 72
+    if width_inches <= 0 or height_inches <= 0:
+        return None
+    return min(
+        int(raw_image.get("/Width", 0)) / width_inches,
+        int(raw_image.get("/Height", 0)) / height_inches,
+    )
+
+
+def downscale_ladder(dpi: Optional[float]) -> tuple[tuple[float, ...], float]:
+    """Downscale factors to measure for an image drawn at ``dpi``, and its display scale.
+
+    After full resolution, the factors bring the image to each COMPRESS_TARGET_DPI below
+    its own, then continue down DOWNSCALE_LADDER for targets that need more. The display
+    scale is the factor reaching the highest target: resolution above it is never seen,
+    so distortion is measured there and that detail is the first to go when bytes are
+    short. Without a known placement the plain ladder is used.
+    """
+    targets = sorted(settings.COMPRESS_TARGET_DPI, reverse=True)
+    if dpi is None or dpi <= 0 or not targets:
+        return DOWNSCALE_LADDER, 1.0
+    factors = sorted({min(1.0, target / dpi) for target in targets} | {1.0}, reverse=True)
+    factors += [factor for factor in DOWNSCALE_LADDER if factor < factors[-1] * _FALLBACK_STEP]
+    return tuple(factors), min(1.0, targets[0] / dpi)
@@ -0,0 +1,230 @@
+from __future__ import annotations
+
+import enum
+import hashlib
+import json
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.models import CacheStatus, CompressionTask, ResultCacheEntry, TaskStatus
+from app.worker.routing import time_limit
+
+_EVICT_BATCH = 100
+
+
+class CacheAttachment(str, enum.Enum):
+    HIT = "hit"  # the task was completed from an existing artifact
+    FOLLOWER = "follower"  # an identical task is in flight; this one completes with it
+    LEADER = "leader"  # this task runs the compression for everyone else
+
+
+def cache_key(
+    content_sha256: str,
+    *,
+    target_size_mb: float,
+    min_quality: int,
+    max_iterations: int,
+    preserve_metadata: bool,
+) -> str:
+    parameters = {
+        "target_bytes": max(int(target_size_mb * 1024 * 1024), 0),
+        "min_quality": int(min_quality),
+        "max_iterations": int(max_iterations),
+        "preserve_metadata": bool(preserve_metadata),
+    }
+    payload = json.dumps([content_sha256, parameters], sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def attach(db: Session, task: CompressionTask) -> CacheAttachment:
+    """Attach a new task, added to the session but not yet committed, to the result cache.
+
+    A new entry is only flushed, so it becomes visible together with its task; use
+    ``add_tasks`` to commit both. The Celery task is dispatched only for LEADER.
+    """
+    if not settings.RESULT_CACHE_ENABLED or not task.original_sha256:
+        return CacheAttachment.LEADER
+
+    task.cache_key = cache_key(
+        task.original_sha256,
+        target_size_mb=task.target_size_mb,
+        min_quality=task.min_quality,
+        max_iterations=task.max_iterations,
+        preserve_metadata=task.preserve_metadata,
+    )
+    now = datetime.utcnow()
+
+    entry = db.get(ResultCacheEntry, task.cache_key)
+    if entry is None:
+        db.add(
+            ResultCacheEntry(
+                cache_key=task.cache_key,
+                status=CacheStatus.PENDING,
+                leader_task_id=task.id,
+                created_at=now,
+                last_used_at=now,
+            )
+        )
+        # Flushed with the task so a duplicate later in the same batch follows it.
+        db.flush()
+        return CacheAttachment.LEADER
+
+    entry.last_used_at = now
+
+    if entry.status == CacheStatus.PENDING:
+        if _leader_lost(db, entry, now):
+            entry.leader_task_id = task.id
+            return CacheAttachment.LEADER
+        return CacheAttachment.FOLLOWER
+
+    task.status = TaskStatus.COMPLETED
+    task.compressed_file_path = entry.compressed_file_path
+    task.compressed_size_bytes = entry.compressed_size_bytes
+    task.completed_at = now
+    return CacheAttachment.HIT
+
+
+def add_tasks(db: Session, tasks: list[CompressionTask], *related: object) -> list[CacheAttachment]:
+    """Attach new tasks to the result cache and commit them, with any *related* rows.
+
+    Tasks and the entries they create are committed in one transaction. If an identical
+    upload committed its entry first, the commit fails on the primary key and is replayed
+    once, attaching the tasks to that entry instead.
+    """
+    try:
+        return _commit_attached(db, tasks, related)
+    except IntegrityError:
+        db.rollback()
+        return _commit_attached(db, tasks, related)
+
+
+def _commit_attached(db: Session, tasks: list[CompressionTask], related: tuple) -> list[CacheAttachment]:
+    db.add_all(related)
+    db.add_all(tasks)
+    attachments = [attach(db, task) for task in tasks]
+    db.commit()
+    return attachments
+
+
+def _leader_lost(db: Session, entry: ResultCacheEntry, now: datetime) -> bool:
+    # A leader that has not been updated within its hard time limit was killed, lost with
+    # its queue message or never committed; the next identical upload takes over.
+    leader = db.get(CompressionTask, entry.leader_task_id)
+    if leader is None or leader.status not in (TaskStatus.QUEUED, TaskStatus.RUNNING):
+        return True
+    return leader.updated_at < now - timedelta(seconds=time_limit(leader.cost_class))
+
+
+def complete(session: Session, task: CompressionTask) -> list[str]:
+    """Publish a leader's result and complete every task that was waiting on it.
+
+    Returns the ids of the follower tasks that were completed.
+    """
+    if not task.cache_key:
+        return []
+
+    entry = session.get(ResultCacheEntry, task.cache_key)
+    if entry is None or entry.leader_task_id != task.id:
+        return []
+
+    now = datetime.utcnow()
+    entry.status = CacheStatus.READY
+    entry.compressed_file_path = task.compressed_file_path
+    entry.compressed_size_bytes = task.compressed_size_bytes
+    entry.last_used_at = now
+
+    follower_ids = _follower_ids(session, task)
+    if follower_ids:
+        session.execute(
+            update(CompressionTask)
+            .where(CompressionTask.id.in_(follower_ids))
+            .values(
+                status=TaskStatus.COMPLETED,
+                compressed_file_path=task.compressed_file_path,
+                compressed_size_bytes=task.compressed_size_bytes,
+                updated_at=now,
+                completed_at=now,
+            )
+        )
+    session.commit()
+
+    evict(session)
+    return follower_ids
+
+
+def fail(session: Session, task: CompressionTask) -> list[str]:
+    """Drop a failed leader's entry and fail the tasks that were waiting on it.
+
+    Returns the ids of the follower tasks that were failed.
+    """
+    if not task.cache_key:
+        return []
+
+    entry = session.get(ResultCacheEntry, task.cache_key)
+    if entry is None or entry.leader_task_id != task.id:
+        return []
+
+    follower_ids = _follower_ids(session, task)
+    if follower_ids:
+        session.execute(
+            update(CompressionTask)
+            .where(CompressionTask.id.in_(follower_ids))
+            .values(
+                status=TaskStatus.FAILED,
+                error_message=task.error_message,
+                updated_at=datetime.utcnow(),
+            )
+        )
+    session.delete(entry)
+    session.commit()
+    return follower_ids
+
+
+def _follower_ids(session: Session, task: CompressionTask) -> list[str]:
+    return list(
+        session.scalars(
+            select(CompressionTask.id).where(
+                CompressionTask.cache_key == task.cache_key,
+                CompressionTask.id != task.id,
+                CompressionTask.status.in_([TaskStatus.QUEUED, TaskStatus.RUNNING]),
+            )
+        )
+    )
+
+
+def evict(session: Session) -> None:
+    """Enforce the TTL and RESULT_CACHE_INDEX_MAX_BYTES over ready entries, least
+    recently used first.
+
+    Entries only index results their tasks already own, so eviction deletes no files and
+    leaves every task's download in place; evicted results are just no longer shared with
+    new uploads. The byte limit therefore bounds the index, not disk use.
+    """
+    expired_before = datetime.utcnow() - timedelta(seconds=settings.RESULT_CACHE_TTL_SECONDS)
+    ready = ResultCacheEntry.status == CacheStatus.READY
+    session.execute(delete(ResultCacheEntry).where(ready, ResultCacheEntry.last_used_at < expired_before))
+
+    excess_bytes = session.scalar(
+        select(func.coalesce(func.sum(ResultCacheEntry.compressed_size_bytes), 0)).where(ready)
+    ) - settings.RESULT_CACHE_INDEX_MAX_BYTES
+    evicted_keys: list[str] = []
+    if excess_bytes > 0:
+        rows = session.execute(
+            select(ResultCacheEntry.cache_key, ResultCacheEntry.compressed_size_bytes)
+            .where(ready)
+            .order_by(ResultCacheEntry.last_used_at)
+            .execution_options(yield_per=_EVICT_BATCH)
+        )
+        for key, size_bytes in rows:
+            if excess_bytes <= 0:
+                break
+            evicted_keys.append(key)
+            excess_bytes -= size_bytes or 0
+        rows.close()
+    if evicted_keys:
+        session.execute(delete(ResultCacheEntry).where(ResultCacheEntry.cache_key.in_(evicted_keys)))
+    session.commit()
@@ -1,21 +1,75 @@
+import hashlib
+import os
+import shutil
+import threading
 from abc import ABC, abstractmethod
-from io import BytesIO
+from datetime import datetime, timezone
 from pathlib import Path
-from typing import BinaryIO
+from typing import BinaryIO, Iterator, Optional
+from urllib.parse import urlparse
 
+import urllib3
 from minio import Minio
 
 from app.core.config import settings
 
+MULTIPART_CHUNK_SIZE = 10 * 1024 * 1024
+STREAM_CHUNK_SIZE = 256 * 1024
+PDF_CONTENT_TYPE = "application/pdf"
+
+
+class UploadTooLargeError(Exception):
+    pass
+
+
+class HashingReader:
+    """Read-only file wrapper that hashes and counts bytes as a storage backend reads them.
+
+    Raises UploadTooLargeError as soon as more than ``max_bytes`` have been read, so an
+    oversized file (a single upload, or a member of a batch's ZIP archive) is never
+    stored whole. The request body around it is bounded before it is parsed, by the
+    API's Content-Length check and the proxy.
+    """
+
+    def __init__(self, fileobj: BinaryIO, max_bytes: int, chunk_size: int = 1024 * 1024):
+        self._fileobj = fileobj
+        self._max_bytes = max_bytes
+        self._chunk_size = chunk_size
+        self.sha256 = hashlib.sha256()
+        self.size_bytes = 0
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            return b"".join(iter(lambda: self.read(self._chunk_size), b""))
+        chunk = self._fileobj.read(size)
+        self.size_bytes += len(chunk)
+        if self.size_bytes > self._max_bytes:
+            raise UploadTooLargeError(f"Upload exceeds {self._max_bytes} bytes")
+        self.sha256.update(chunk)
+        return chunk
+
+
+class ObjectInfo:
+    def __init__(self, size_bytes: int, etag: str, last_modified: Optional[datetime] = None):
+        self.size_bytes = size_bytes
+        self.etag = etag
+        self.last_modified = last_modified
+
 
 class StorageBackend(ABC):
     @abstractmethod
-    def save(self, file_path: str, content: BinaryIO) -> str:
+    def save(self, file_path: str, content: BinaryIO, content_type: str = PDF_CONTENT_TYPE) -> str:
         pass
 
     @abstractmethod
-    def get(self, file_path: str) -> bytes:
-        pass
+    def save_file(
+        self, file_path: str, source_path: Path, content_type: str = PDF_CONTENT_TYPE
+    ) -> str:
+        """Store a local file without reading it into memory."""
+
+    @abstractmethod
+    def get_file(self, file_path: str, destination_path: Path) -> Path:
+        """Write an object to a local file without holding it in memory."""
 
     @abstractmethod
     def get_path(self, file_path: str) -> str:
@@ -25,13 +79,23 @@ class StorageBackend(ABC):
     def delete(self, file_path: str) -> None:
         pass
 
+    @abstractmethod
+    def stat(self, file_path: str) -> ObjectInfo:
+        pass
+
+    @abstractmethod
+    def iter_range(
+        self, file_path: str, start: int = 0, end: Optional[int] = None
+    ) -> Iterator[bytes]:
+        """Yield bytes ``start`` through ``end`` (inclusive; None = end of object) in chunks."""
+
 
 class LocalStorage(StorageBackend):
     def __init__(self, base_path: Path = settings.STORAGE_PATH):
         self.base_path = Path(base_path)
         self.base_path.mkdir(parents=True, exist_ok=True)
 
-    def save(self, file_path: str, content: BinaryIO) -> str:
+    def save(self, file_path: str, content: BinaryIO, content_type: str = PDF_CONTENT_TYPE) -> str:
         full_path = self.base_path / file_path
         full_path.parent.mkdir(parents=True, exist_ok=True)
 
@@ -41,10 +105,22 @@ class LocalStorage(StorageBackend):
 
         return str(full_path)
 
-    def get(self, file_path: str) -> bytes:
+    def save_file(
+        self, file_path: str, source_path: Path, content_type: str = PDF_CONTENT_TYPE
+    ) -> str:
+        full_path = self.base_path / file_path
+        full_path.parent.mkdir(parents=True, exist_ok=True)
+        if Path(source_path).resolve() != full_path.resolve():
+            shutil.copyfile(source_path, full_path)
+        return str(full_path)
+
+    def get_file(self, file_path: str, destination_path: Path) -> Path:
         full_path = self.base_path / file_path
-        with open(full_path, "rb") as f:
-            return f.read()
+        destination_path = Path(destination_path)
+        destination_path.parent.mkdir(parents=True, exist_ok=True)
+        if full_path.resolve() != destination_path.resolve():
+            shutil.copyfile(full_path, destination_path)
+        return destination_path
 
     def get_path(self, file_path: str) -> str:
         return str(self.base_path / file_path)
@@ -54,40 +130,87 @@ class LocalStorage(StorageBackend):
         if full_path.exists():
             full_path.unlink()
 
+    def stat(self, file_path: str) -> ObjectInfo:
+        stat_result = (self.base_path / file_path).stat()
+        return ObjectInfo(
+            size_bytes=stat_result.st_size,
+            etag=f'"{stat_result.st_size:x}-{stat_result.st_mtime_ns:x}"',
+            last_modified=datetime.fromtimestamp(stat_result.st_mtime, tz=timezone.utc),
+        )
+
+    def iter_range(
+        self, file_path: str, start: int = 0, end: Optional[int] = None
+    ) -> Iterator[bytes]:
+        with open(self.base_path / file_path, "rb") as f:
+            f.seek(start)
+            remaining = None if end is None else end - start + 1
+            while remaining is None or remaining > 0:
+                size = STREAM_CHUNK_SIZE if remaining is None else min(STREAM_CHUNK_SIZE, remaining)
+                chunk = f.read(size)
+                if not chunk:
+                    break
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+
 
 class MinIOStorage(StorageBackend):
+    _bucket_checked = False
+
     def __init__(self):
         endpoint = settings.MINIO_ENDPOINT.replace("http://", "").replace("https://", "")
+        http_client = urllib3.PoolManager(
+            num_pools=4,
+            maxsize=settings.MINIO_POOL_MAXSIZE,
+            block=False,
+            timeout=urllib3.Timeout(connect=10, read=settings.MINIO_READ_TIMEOUT),
+            retries=urllib3.Retry(total=3, backoff_factor=0.2, status_forcelist=[500, 502, 503, 504]),
+        )
         self.client = Minio(
             endpoint,
             access_key=settings.MINIO_ACCESS_KEY,
             secret_key=settings.MINIO_SECRET_KEY,
             secure=False,
+            http_client=http_client,
         )
         self.bucket = settings.MINIO_BUCKET
         self._ensure_bucket()
 
     def _ensure_bucket(self):
+        # Once per process tree: prefork children inherit the flag from the parent.
+        if MinIOStorage._bucket_checked:
+            return
         if not self.client.bucket_exists(self.bucket):
             self.client.make_bucket(self.bucket)
+        MinIOStorage._bucket_checked = True
 
-    def save(self, file_path: str, content: BinaryIO) -> str:
-        data = content.read()
+    def save(self, file_path: str, content: BinaryIO, content_type: str = PDF_CONTENT_TYPE) -> str:
+        # Unknown length: the client uploads in parts, so at most one part is buffered.
         self.client.put_object(
             self.bucket,
             file_path,
-            BytesIO(data),
-            length=len(data),
-            content_type="application/pdf",
+            content,
+            length=-1,
+            part_size=MULTIPART_CHUNK_SIZE,
+            content_type=content_type,
         )
         return file_path
 
-    def get(self, file_path: str) -> bytes:
-        response = self.client.get_object(self.bucket, file_path)
-        data = response.read()
-        response.close()
-        response.release_conn()
-        return data
+    def save_file(
+        self, file_path: str, source_path: Path, content_type: str = PDF_CONTENT_TYPE
+    ) -> str:
+        self.client.fput_object(
+            self.bucket,
+            file_path,
+            str(source_path),
+            content_type=content_type,
+            part_size=MULTIPART_CHUNK_SIZE,
+        )
+        return file_path
+
+    def get_file(self, file_path: str, destination_path: Path) -> Path:
+        self.client.fget_object(self.bucket, file_path, str(destination_path))
+        return Path(destination_path)
 
     def get_path(self, file_path: str) -> str:
         return self.client.presigned_get_object(self.bucket, file_path)
@@ -95,8 +218,66 @@ class MinIOStorage(StorageBackend):
     def delete(self, file_path: str) -> None:
         self.client.remove_object(self.bucket, file_path)
 
+    def stat(self, file_path: str) -> ObjectInfo:
+        result = self.client.stat_object(self.bucket, file_path)
+        etag = result.etag or ""
+        if not etag.startswith('"'):
+            etag = f'"{etag}"'
+        return ObjectInfo(size_bytes=result.size, etag=etag, last_modified=result.last_modified)
+
+    def iter_range(
+        self, file_path: str, start: int = 0, end: Optional[int] = None
+    ) -> Iterator[bytes]:
+        length = 0 if end is None else end - start + 1
+        response = self.client.get_object(self.bucket, file_path, offset=start, length=length)
+        try:
+            yield from response.stream(STREAM_CHUNK_SIZE)
+        finally:
+            response.close()
+            response.release_conn()
+
+
+def object_key(reference: str) -> str:
+    """Storage key for a stored file reference, which may be a presigned MinIO URL."""
+    key = reference
+    if reference.startswith("http"):
+        parsed = urlparse(reference)
+        path = parsed.path.lstrip("/")
+        if path:
+            parts = path.split("/", 1)
+            if len(parts) == 2:
+                key = parts[1]
+            else:
+                key = parts[0]
+    return key
+
+
+_storage: Optional[StorageBackend] = None
+_storage_lock = threading.Lock()
+
 
 def get_storage() -> StorageBackend:
-    if settings.STORAGE_BACKEND == "minio":
-        return MinIOStorage()
-    return LocalStorage()
+    """Return the process-wide storage backend, creating it on first use.
+
+    The backend is shared by every request thread and task in the process. Its pooled
+    HTTP connections must not cross a fork, so the registry resets in forked children
+    (Celery prefork workers) and each child builds its own client on first use.
+    """
+    global _storage
+    storage = _storage
+    if storage is None:
+        with _storage_lock:
+            if _storage is None:
+                _storage = MinIOStorage() if settings.STORAGE_BACKEND == "minio" else LocalStorage()
+            storage = _storage
+    return storage
+
+
+def _reset_storage_after_fork() -> None:
+    global _storage, _storage_lock
+    _storage = None
+    _storage_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_storage_after_fork)
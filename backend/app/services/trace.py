@@ -0,0 +1,96 @@
+from __future__ import annotations
+
+import contextvars
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Iterator, Optional
+
+PHASES = ("open", "optimize", "layout", "decode", "sample", "resize", "encode", "replace", "save", "transfer")
+
+_current: contextvars.ContextVar[Optional["CompressionTrace"]] = contextvars.ContextVar(
+    "compression_trace", default=None
+)
+
+
+class CompressionTrace:
+    """Where one compression job spent its time, and what each trial produced.
+
+    Phase times are summed across threads, so with parallel image workers the decode,
+    resize and encode totals can exceed the job's wall time.
+    """
+
+    def __init__(self):
+        self.phase_seconds: dict[str, float] = dict.fromkeys(PHASES, 0.0)
+        self.saves: Counter[str] = Counter()
+        self.iterations: list[dict[str, Any]] = []
+        self.image_count = 0
+        self.images_skipped: Counter[str] = Counter()  # kept as they are, by reason
+        self.image_bytes_in = 0
+        self.image_bytes_out = 0
+        self.started_at = time.perf_counter()
+        self.wall_seconds: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def add(self, phase: str, seconds: float) -> None:
+        with self._lock:
+            self.phase_seconds[phase] = self.phase_seconds.get(phase, 0.0) + seconds
+
+    def record_save(self, profile: str) -> None:
+        with self._lock:
+            self.saves[profile] += 1
+
+    def record_iteration(
+        self, phase: str, quality: Optional[int], downscale_factor: float, size_bytes: int
+    ) -> None:
+        self.iterations.append(
+            {
+                "phase": phase,
+                "quality": quality,
+                "downscale_factor": round(downscale_factor, 4),
+                "size_bytes": size_bytes,
+            }
+        )
+
+    def finish(self) -> None:
+        self.wall_seconds = time.perf_counter() - self.started_at
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "wall_seconds": round(self.wall_seconds, 4) if self.wall_seconds is not None else None,
+            "phase_seconds": {phase: round(seconds, 4) for phase, seconds in self.phase_seconds.items()},
+            "saves": dict(self.saves),
+            "iterations": self.iterations,
+            "image_count": self.image_count,
+            "images_skipped": dict(self.images_skipped),
+            "image_bytes_in": self.image_bytes_in,
+            "image_bytes_out": self.image_bytes_out,
+        }
+
+
+def current_trace() -> Optional[CompressionTrace]:
+    return _current.get()
+
+
+@contextmanager
+def tracing(trace: CompressionTrace) -> Iterator[CompressionTrace]:
+    """Make ``trace`` collect the timings of engine calls made in this context."""
+    token = _current.set(trace)
+    try:
+        yield trace
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def timed(phase: str) -> Iterator[None]:
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(phase, time.perf_counter() - started)
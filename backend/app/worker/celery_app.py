@@ -1,8 +1,14 @@
 import platform
 
 from celery import Celery
+from celery.signals import worker_init, worker_process_init, worker_process_shutdown
+from kombu import Queue
 
+from app.core import metrics
 from app.core.config import settings
+from app.models import CostClass
+from app.services.storage import get_storage
+from app.worker.routing import QUEUES, WORKER_PROFILES, soft_time_limit
 
 celery_app = Celery(
     "smartpdf",
@@ -17,11 +23,49 @@ celery_app.conf.update(
     result_serializer="json",
     timezone="UTC",
     enable_utc=True,
+    task_default_queue=QUEUES[CostClass.STANDARD],
+    task_queues=[Queue(queue) for queue in QUEUES.values()],
+    # Unacknowledged jobs are redelivered after this; it must outlast the longest hard limit.
+    broker_transport_options={
+        "visibility_timeout": max(
+            3600, 2 * (soft_time_limit(CostClass.HEAVY) + settings.TASK_TIME_LIMIT_GRACE)
+        )
+    },
 )
 
+if settings.WORKER_COST_CLASS:
+    worker_class = CostClass(settings.WORKER_COST_CLASS)
+    profile = WORKER_PROFILES[worker_class]
+    celery_app.conf.update(
+        task_queues=[Queue(QUEUES[worker_class])],
+        worker_prefetch_multiplier=profile.prefetch_multiplier,
+        task_acks_late=profile.acks_late,
+        task_reject_on_worker_lost=profile.acks_late,
+    )
+
+if settings.WORKER_MAX_MEMORY_PER_CHILD_KB:
+    celery_app.conf.worker_max_memory_per_child = settings.WORKER_MAX_MEMORY_PER_CHILD_KB
+
 if platform.system() == "Windows":
     celery_app.conf.update(
         worker_pool="solo",
         worker_concurrency=1,
         worker_prefetch_multiplier=1,
     )
+
+
+@worker_process_init.connect
+def init_worker_process(**_kwargs) -> None:
+    get_storage()
+
+
+@worker_init.connect
+def start_metrics_exporter(**_kwargs) -> None:
+    if settings.WORKER_METRICS_PORT:
+        metrics.start_exporter(settings.WORKER_METRICS_PORT)
+
+
+@worker_process_shutdown.connect
+def release_process_metrics(pid=None, **_kwargs) -> None:
+    if pid is not None:
+        metrics.mark_process_dead(pid)
@@ -0,0 +1,51 @@
+from __future__ import annotations
+
+from typing import Any, Optional
+
+from app.core.config import settings
+from app.models import CostClass
+
+QUEUES = {
+    CostClass.SMALL: "compress.small",
+    CostClass.STANDARD: "compress.standard",
+    CostClass.HEAVY: "compress.heavy",
+}
+
+
+class WorkerProfile:
+    def __init__(self, prefetch_multiplier: int, acks_late: bool):
+        self.prefetch_multiplier = prefetch_multiplier
+        self.acks_late = acks_late
+
+
+# Small jobs are short, so prefetching a few keeps their pool busy. Longer jobs take one
+# message at a time and acknowledge it only when done, so a crashed or recycled child
+# hands its job back instead of losing it.
+WORKER_PROFILES = {
+    CostClass.SMALL: WorkerProfile(prefetch_multiplier=4, acks_late=False),
+    CostClass.STANDARD: WorkerProfile(prefetch_multiplier=1, acks_late=True),
+    CostClass.HEAVY: WorkerProfile(prefetch_multiplier=1, acks_late=True),
+}
+
+
+def soft_time_limit(cost_class: CostClass) -> int:
+    return {
+        CostClass.SMALL: settings.COST_SMALL_SOFT_TIME_LIMIT,
+        CostClass.STANDARD: settings.COST_STANDARD_SOFT_TIME_LIMIT,
+        CostClass.HEAVY: settings.COST_HEAVY_SOFT_TIME_LIMIT,
+    }[cost_class]
+
+
+def time_limit(cost_class: Optional[CostClass]) -> int:
+    """Hard time limit after which a job's worker child is killed."""
+    return soft_time_limit(cost_class or CostClass.STANDARD) + settings.TASK_TIME_LIMIT_GRACE
+
+
+def dispatch_options(cost_class: Optional[CostClass]) -> dict[str, Any]:
+    """apply_async options that send a job to its class's queue under its time limits."""
+    cost_class = cost_class or CostClass.STANDARD
+    return {
+        "queue": QUEUES[cost_class],
+        "soft_time_limit": soft_time_limit(cost_class),
+        "time_limit": time_limit(cost_class),
+    }
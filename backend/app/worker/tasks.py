@@ -1,17 +1,189 @@
 from __future__ import annotations
 
+import json
+import tempfile
+import time
 from datetime import datetime
 from pathlib import Path
-from urllib.parse import urlparse
+from typing import Optional
 
-from celery import shared_task
+from celery import chord, group, shared_task
+from celery.exceptions import SoftTimeLimitExceeded
 from sqlalchemy.orm import Session
 
+from app.core import metrics
 from app.core.config import settings
 from app.core.database import SessionLocal
-from app.models import CompressionTask, TaskStatus
-from app.services.compress import compress_pdf
-from app.services.storage import get_storage
+from app.models import CompressionTask, CostClass, TaskStatus
+from app.services import events, result_cache
+from app.services.compress import (
+    CompressionPlan,
+    CompressionResult,
+    ProgressEvent,
+    compress_pdf,
+    count_pages,
+    dump_encoded_images,
+    encode_page_images,
+    load_encoded_images,
+    plan_compression,
+    save_encoded_images,
+)
+from app.services.storage import StorageBackend, get_storage, object_key
+from app.worker.routing import dispatch_options
+
+
+class SourceUnavailableError(Exception):
+    pass
+
+
+def _publish_status(
+    session: Session, task: CompressionTask, follower_ids: Optional[list[str]] = None
+) -> None:
+    events.publish_status(task)
+    for follower_id in follower_ids or []:
+        follower = session.get(CompressionTask, follower_id)
+        if follower is not None:
+            events.publish_status(follower)
+
+
+def _report_progress(task_id: str, event: ProgressEvent) -> None:
+    events.publish_progress(task_id, event.as_dict())
+
+
+def _mark_failed(session: Session, task: CompressionTask, message: str) -> None:
+    task.status = TaskStatus.FAILED
+    task.error_message = message
+    task.updated_at = datetime.utcnow()
+    session.commit()
+    metrics.TASKS.labels(TaskStatus.FAILED.value).inc()
+    follower_ids = result_cache.fail(session, task)
+    _publish_status(session, task, follower_ids)
+
+
+def _failure_message(exc: Exception) -> str:
+    if isinstance(exc, SoftTimeLimitExceeded):
+        return "Compression timed out"
+    return str(exc)
+
+
+def _fetch_source(
+    task: CompressionTask, storage: StorageBackend, temp_name: str
+) -> tuple[Path, Optional[Path]]:
+    """Return a local path to the task's original PDF, plus the temp copy to clean up."""
+    if settings.STORAGE_BACKEND == "local":
+        source_path = Path(task.original_file_path)
+        if not source_path.exists():
+            source_path = Path(storage.get_path(task.original_file_path))
+        if not source_path.exists():
+            raise SourceUnavailableError("Original file not found")
+        return source_path, None
+
+    temp_dir = Path(settings.STORAGE_PATH) / "temp"
+    temp_dir.mkdir(parents=True, exist_ok=True)
+    temp_source_path = temp_dir / temp_name
+    try:
+        storage.get_file(object_key(task.original_file_path), temp_source_path)
+    except Exception as exc:
+        temp_source_path.unlink(missing_ok=True)
+        raise SourceUnavailableError(f"Failed to retrieve original file: {exc}") from exc
+    return temp_source_path, temp_source_path
+
+
+def _output_path(task: CompressionTask) -> Path:
+    compressed_dir = Path(settings.STORAGE_PATH) / "compressed"
+    compressed_dir.mkdir(parents=True, exist_ok=True)
+    return compressed_dir / f"{task.id}.pdf"
+
+
+def _run_compression(task: CompressionTask, source_path: Path) -> CompressionResult:
+    return compress_pdf(
+        source_path,
+        _output_path(task),
+        task.target_size_mb,
+        min_quality=task.min_quality,
+        max_iterations=task.max_iterations,
+        preserve_metadata=task.preserve_metadata,
+        progress=lambda event: _report_progress(task.id, event),
+    )
+
+
+def _store_result(
+    session: Session, task: CompressionTask, storage: StorageBackend, result: CompressionResult
+) -> None:
+    output_path = result.output_path
+    compressed_file_key = f"compressed/{task.id}.pdf"
+    if settings.STORAGE_BACKEND != "local":
+        started = time.perf_counter()
+        storage.save_file(compressed_file_key, output_path)
+        if result.trace is not None:
+            result.trace.add("transfer", time.perf_counter() - started)
+        output_path.unlink(missing_ok=True)
+
+    stored_reference = (
+        str(output_path) if settings.STORAGE_BACKEND == "local" else compressed_file_key
+    )
+
+    task.status = TaskStatus.COMPLETED
+    task.compressed_file_path = stored_reference
+    task.compressed_size_bytes = result.size_bytes
+    task.updated_at = datetime.utcnow()
+    task.completed_at = datetime.utcnow()
+    if result.trace is not None:
+        task.trace_summary = json.dumps(result.trace.as_dict())
+    session.commit()
+
+    metrics.TASKS.labels(TaskStatus.COMPLETED.value).inc()
+    if result.trace is not None:
+        metrics.observe_compression(
+            result.trace,
+            size_bytes=result.size_bytes,
+            target_bytes=int(task.target_size_mb * 1024 * 1024),
+        )
+
+    follower_ids = result_cache.complete(session, task)
+    _publish_status(session, task, follower_ids)
+
+
+def _shard_ranges(task: CompressionTask, source_path: Path) -> list[tuple[int, int]]:
+    target_bytes = int(task.target_size_mb * 1024 * 1024)
+    source_size = source_path.stat().st_size
+    if source_size <= target_bytes:
+        return []
+
+    page_count = count_pages(source_path)
+    over_pages = settings.SHARD_PAGE_THRESHOLD > 0 and page_count > settings.SHARD_PAGE_THRESHOLD
+    over_size = settings.SHARD_SIZE_THRESHOLD > 0 and source_size > settings.SHARD_SIZE_THRESHOLD
+    if not (over_pages or over_size):
+        return []
+
+    chunk = max(1, settings.SHARD_PAGES_PER_CHUNK)
+    ranges = [(start, min(start + chunk, page_count)) for start in range(0, page_count, chunk)]
+    return ranges if len(ranges) > 1 else []
+
+
+def _dispatch_shards(task: CompressionTask, source_path: Path, ranges: list[tuple[int, int]]) -> bool:
+    plan = plan_compression(
+        source_path,
+        task.target_size_mb,
+        min_quality=task.min_quality,
+        max_iterations=task.max_iterations,
+        preserve_metadata=task.preserve_metadata,
+        sample_size=settings.SHARD_PLAN_SAMPLE_IMAGES,
+    )
+    if plan is None or plan.predicted_size_bytes > plan.target_bytes > 0:
+        # A plan predicted to miss the target would only reach the merge's fallback to the
+        # single-worker search; run that search straight away instead.
+        return False
+
+    # Each shard is a bounded slice of pages; the merge saves the whole document.
+    header = group(
+        compress_shard_task.s(
+            task.id, index, first_page, last_page, plan.quality, plan.downscale_factor, plan.slope
+        ).set(**dispatch_options(CostClass.STANDARD))
+        for index, (first_page, last_page) in enumerate(ranges)
+    )
+    chord(header)(merge_shards_task.s(task.id).set(**dispatch_options(CostClass.HEAVY)))
+    return True
 
 
 @shared_task(name="app.worker.tasks.compress_pdf_task")
@@ -21,100 +193,149 @@ def compress_pdf_task(task_id: str) -> None:
     temp_source_path: Path | None = None
     try:
         task: CompressionTask | None = session.get(CompressionTask, task_id)
-        if task is None:
-            return
+        if task is None or task.status in (TaskStatus.COMPLETED, TaskStatus.FAILED):
+            return  # e.g. finished by the upload that took over its result cache entry
 
         if not task.original_file_path:
-            task.status = TaskStatus.FAILED
-            task.error_message = "Original file path missing"
-            task.updated_at = datetime.utcnow()
-            session.commit()
+            _mark_failed(session, task, "Original file path missing")
             return
 
         task.status = TaskStatus.RUNNING
         task.updated_at = datetime.utcnow()
         session.commit()
         session.refresh(task)
+        events.publish_status(task)
 
-        storage_root = Path(settings.STORAGE_PATH)
-        storage_root.mkdir(parents=True, exist_ok=True)
-
-        if settings.STORAGE_BACKEND == "local":
-            source_path = Path(task.original_file_path)
-            if not source_path.exists():
-                source_path = Path(storage.get_path(task.original_file_path))
-            if not source_path.exists():
-                task.status = TaskStatus.FAILED
-                task.error_message = "Original file not found"
-                task.updated_at = datetime.utcnow()
-                session.commit()
-                return
-        else:
-            reference = task.original_file_path
-            key = reference
-            if reference.startswith("http"):
-                parsed = urlparse(reference)
-                path = parsed.path.lstrip("/")
-                if path:
-                    parts = path.split("/", 1)
-                    if len(parts) == 2:
-                        key = parts[1]
-                    else:
-                        key = parts[0]
-            try:
-                file_data = storage.get(key)
-            except Exception as exc:
-                task.status = TaskStatus.FAILED
-                task.error_message = f"Failed to retrieve original file: {exc}"
-                task.updated_at = datetime.utcnow()
-                session.commit()
-                return
-
-            temp_dir = storage_root / "temp"
-            temp_dir.mkdir(parents=True, exist_ok=True)
-            temp_source_path = temp_dir / f"{task.id}_input.pdf"
-            with open(temp_source_path, "wb") as tmp_file:
-                tmp_file.write(file_data)
-            source_path = temp_source_path
-
-        compressed_dir = storage_root / "compressed"
-        compressed_dir.mkdir(parents=True, exist_ok=True)
-        output_path = compressed_dir / f"{task.id}.pdf"
-
-        result = compress_pdf(
+        fetch_started = time.perf_counter()
+        try:
+            source_path, temp_source_path = _fetch_source(task, storage, f"{task.id}_input.pdf")
+        except SourceUnavailableError as exc:
+            _mark_failed(session, task, str(exc))
+            return
+        fetch_seconds = time.perf_counter() - fetch_started
+
+        # Large documents fan out across workers; the merge task completes the job.
+        ranges = _shard_ranges(task, source_path)
+        if ranges and _dispatch_shards(task, source_path, ranges):
+            return
+
+        result = _run_compression(task, source_path)
+        if result.trace is not None and temp_source_path is not None:
+            result.trace.add("transfer", fetch_seconds)
+        _store_result(session, task, storage, result)
+    except Exception as exc:  # pragma: no cover - defensive path
+        task = session.get(CompressionTask, task_id)
+        if task:
+            _mark_failed(session, task, _failure_message(exc))
+        raise
+    finally:
+        if temp_source_path and temp_source_path.exists():
+            temp_source_path.unlink(missing_ok=True)
+        session.close()
+
+
+@shared_task(name="app.worker.tasks.compress_shard_task")
+def compress_shard_task(
+    task_id: str,
+    shard_index: int,
+    first_page: int,
+    last_page: int,
+    quality: Optional[int],
+    downscale_factor: float,
+    slope: Optional[float] = None,
+) -> str:
+    session: Session = SessionLocal()
+    storage = get_storage()
+    temp_source_path: Path | None = None
+    try:
+        task: CompressionTask | None = session.get(CompressionTask, task_id)
+        if task is None:
+            raise SourceUnavailableError(f"Task {task_id} not found")
+
+        source_path, temp_source_path = _fetch_source(
+            task, storage, f"{task.id}_shard{shard_index}_input.pdf"
+        )
+        encoded_images = encode_page_images(
             source_path,
-            output_path,
-            task.target_size_mb,
-            min_quality=task.min_quality,
-            max_iterations=task.max_iterations,
-            preserve_metadata=task.preserve_metadata,
+            first_page,
+            last_page,
+            CompressionPlan(
+                quality,
+                downscale_factor,
+                0,
+                slope=slope,
+                min_quality=task.min_quality,
+                target_bytes=int(task.target_size_mb * 1024 * 1024),
+            ),
+        )
+        _report_progress(
+            task.id,
+            ProgressEvent("encoding", iteration=shard_index + 1, quality=quality, downscale_factor=downscale_factor),
         )
 
-        compressed_file_key = f"compressed/{task.id}.pdf"
-        if settings.STORAGE_BACKEND != "local":
-            with open(output_path, "rb") as tmp_output:
-                storage.save(compressed_file_key, tmp_output)
-            output_path.unlink(missing_ok=True)
+        shard_key = f"temp/{task.id}/shard-{shard_index}.zip"
+        with tempfile.SpooledTemporaryFile(max_size=settings.COMPRESS_SPOOL_MAX_BYTES) as buffer:
+            dump_encoded_images(encoded_images, buffer)
+            buffer.seek(0)
+            storage.save(shard_key, buffer, content_type="application/zip")
+        return shard_key
+    except Exception as exc:  # pragma: no cover - defensive path
+        task = session.get(CompressionTask, task_id)
+        if task and task.status != TaskStatus.FAILED:
+            _mark_failed(session, task, f"Shard {shard_index} failed: {_failure_message(exc)}")
+        raise
+    finally:
+        if temp_source_path and temp_source_path.exists():
+            temp_source_path.unlink(missing_ok=True)
+        session.close()
+
+
+@shared_task(name="app.worker.tasks.merge_shards_task")
+def merge_shards_task(shard_keys: list[str], task_id: str) -> None:
+    session: Session = SessionLocal()
+    storage = get_storage()
+    temp_source_path: Path | None = None
+    try:
+        task: CompressionTask | None = session.get(CompressionTask, task_id)
+        if task is None:
+            return
+
+        try:
+            source_path, temp_source_path = _fetch_source(task, storage, f"{task.id}_merge_input.pdf")
+        except SourceUnavailableError as exc:
+            _mark_failed(session, task, str(exc))
+            return
+
+        _report_progress(task.id, ProgressEvent("merging", iteration=len(shard_keys)))
+        encoded_images = {}
+        for shard_key in shard_keys:
+            with tempfile.TemporaryDirectory() as shard_dir:
+                shard_path = storage.get_file(shard_key, Path(shard_dir) / "shard.zip")
+                with open(shard_path, "rb") as shard_file:
+                    encoded_images.update(load_encoded_images(shard_file))
 
-        stored_reference = (
-            str(output_path) if settings.STORAGE_BACKEND == "local" else compressed_file_key
+        result = save_encoded_images(
+            source_path,
+            _output_path(task),
+            encoded_images,
+            preserve_metadata=task.preserve_metadata,
         )
+        if result.size_bytes > int(task.target_size_mb * 1024 * 1024):
+            # The sampled plan missed the target; finish with the single-worker search.
+            result = _run_compression(task, source_path)
 
-        task.status = TaskStatus.COMPLETED
-        task.compressed_file_path = stored_reference
-        task.compressed_size_bytes = result.size_bytes
-        task.updated_at = datetime.utcnow()
-        task.completed_at = datetime.utcnow()
-        session.commit()
+        _store_result(session, task, storage, result)
     except Exception as exc:  # pragma: no cover - defensive path
         task = session.get(CompressionTask, task_id)
         if task:
-            task.status = TaskStatus.FAILED
-            task.error_message = str(exc)
-            task.updated_at = datetime.utcnow()
-            session.commit()
+            _mark_failed(session, task, _failure_message(exc))
         raise
     finally:
+        for shard_key in shard_keys:
+            try:
+                storage.delete(shard_key)
+            except Exception:
+                pass
         if temp_source_path and temp_source_path.exists():
             temp_source_path.unlink(missing_ok=True)
         session.close()
@@ -0,0 +1,4 @@
+"""Compression benchmarks over a deterministic synthetic corpus.
+
+Run from the backend directory with ``python -m benchmarks``; see ``--help``.
+"""
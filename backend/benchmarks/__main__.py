@@ -0,0 +1,49 @@
+from __future__ import annotations
+
+import argparse
+import json
+import tempfile
+from pathlib import Path
+
+from benchmarks.corpus import DOCUMENTS, build_corpus
+from benchmarks.runner import DEFAULT_TARGET_FRACTIONS, print_comparison, run_benchmarks, write_report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks",
+        description="Run compress_pdf over the synthetic corpus and report the results as JSON.",
+    )
+    parser.add_argument(
+        "--corpus-dir",
+        type=Path,
+        default=Path(tempfile.gettempdir()) / "smartpdf-benchmark-corpus",
+        help="where the generated corpus is cached (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--documents",
+        nargs="+",
+        choices=sorted(DOCUMENTS),
+        help="documents to run (default: all)",
+    )
+    parser.add_argument(
+        "--targets",
+        nargs="+",
+        type=float,
+        default=list(DEFAULT_TARGET_FRACTIONS),
+        help="targets as fractions of each document's size (default: %(default)s)",
+    )
+    parser.add_argument("--repeat", type=int, default=1, help="runs per document and target")
+    parser.add_argument("--output", type=Path, help="write the JSON report here instead of stdout")
+    parser.add_argument("--baseline", type=Path, help="earlier JSON report to compare against")
+    args = parser.parse_args()
+
+    corpus = build_corpus(args.corpus_dir, args.documents)
+    report = run_benchmarks(corpus, target_fractions=tuple(args.targets), repeat=args.repeat)
+    write_report(report, args.output)
+    if args.baseline:
+        print_comparison(json.loads(args.baseline.read_text()), report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+"""Deterministic synthetic PDF corpus for the compression benchmarks.
+
+Every document is generated from a fixed seed with Pillow and pikepdf, so two runs on
+any machine compress byte-identical inputs.
+"""
+
+from __future__ import annotations
+
+import io
+import random
+import zlib
+from pathlib import Path
+from typing import Callable, Optional
+
+import pikepdf
+from PIL import Image, ImageDraw, ImageFilter
+
+CORPUS_VERSION = 1
+PAGE_SIZE = (612, 792)
+
+
+def _noise(rnd: random.Random, size: tuple[int, int], mode: str = "L") -> Image.Image:
+    bands = len(mode)
+    return Image.frombytes(mode, size, rnd.randbytes(size[0] * size[1] * bands))
+
+
+def _photo(size: tuple[int, int], seed: int) -> Image.Image:
+    rnd = random.Random(seed)
+    width, height = size
+    image = Image.merge(
+        "RGB",
+        [
+            Image.linear_gradient("L").resize(size),
+            Image.radial_gradient("L").resize(size),
+            Image.linear_gradient("L").rotate(90).resize(size),
+        ],
+    )
+    draw = ImageDraw.Draw(image)
+    for _ in range(40):
+        x0, y0 = rnd.randrange(width), rnd.randrange(height)
+        x1, y1 = x0 + rnd.randrange(width // 2 + 1), y0 + rnd.randrange(height // 2 + 1)
+        draw.ellipse([x0, y0, x1, y1], fill=tuple(rnd.randrange(256) for _ in range(3)))
+    image = image.filter(ImageFilter.GaussianBlur(2))
+    return Image.blend(image, _noise(rnd, size, "RGB"), 0.12)
+
+
+def _scan(size: tuple[int, int], seed: int) -> Image.Image:
+    rnd = random.Random(seed)
+    width, height = size
+    image = Image.new("L", size, 242)
+    draw = ImageDraw.Draw(image)
+    for line in range(44):
+        y = 90 + line * (height - 180) // 44
+        x = 90
+        while x < width - 140:
+            word = rnd.randrange(18, 110)
+            draw.rectangle([x, y, x + word, y + 16], fill=rnd.randrange(10, 50))
+            x += word + rnd.randrange(16, 30)
+    return Image.blend(image, _noise(rnd, size), 0.08)
+
+
+def _image_stream(
+    pdf: pikepdf.Pdf, image: Image.Image, *, quality: int = 92, flate: bool = False
+) -> pikepdf.Stream:
+    alpha = None
+    if image.mode == "RGBA":
+        alpha = image.getchannel("A")
+        image = image.convert("RGB")
+
+    if flate:
+        stream = pikepdf.Stream(pdf, zlib.compress(image.tobytes()))
+        stream.Filter = pikepdf.Name.FlateDecode
+    else:
+        buffer = io.BytesIO()
+        image.save(buffer, "JPEG", quality=quality)
+        stream = pikepdf.Stream(pdf, buffer.getvalue())
+        stream.Filter = pikepdf.Name.DCTDecode
+
+    stream.Type = pikepdf.Name.XObject
+    stream.Subtype = pikepdf.Name.Image
+    stream.Width, stream.Height = image.size
+    stream.ColorSpace = pikepdf.Name.DeviceGray if image.mode == "L" else pikepdf.Name.DeviceRGB
+    stream.BitsPerComponent = 8
+
+    if alpha is not None:
+        stream.SMask = _image_stream(pdf, alpha, flate=True)
+    return stream
+
+
+def _add_page(
+    pdf: pikepdf.Pdf,
+    images: list[tuple[pikepdf.Stream, tuple[float, float, float, float]]],
+    text: Optional[list[str]] = None,
+) -> None:
+    page = pdf.add_blank_page(page_size=PAGE_SIZE)
+    xobjects = pikepdf.Dictionary()
+    operators = []
+    for index, (stream, (x, y, width, height)) in enumerate(images):
+        xobjects[f"/Im{index}"] = stream
+        operators.append(f"q {width} 0 0 {height} {x} {y} cm /Im{index} Do Q")
+
+    resources = pikepdf.Dictionary(XObject=xobjects)
+    if text:
+        font = pikepdf.Dictionary(
+            Type=pikepdf.Name.Font, Subtype=pikepdf.Name.Type1, BaseFont=pikepdf.Name.Helvetica
+        )
+        resources.Font = pikepdf.Dictionary(F1=font)
+        operators.append("BT /F1 10 Tf 12 TL 60 740 Td")
+        for line in text:
+            escaped = line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+            operators.append(f"({escaped}) '")
+        operators.append("ET")
+
+    page.Resources = resources
+    page.Contents = pdf.make_stream("\n".join(operators).encode("latin-1"))
+
+
+def _paragraph(rnd: random.Random, lines: int) -> list[str]:
+    words = ["target", "size", "image", "quality", "scale", "page", "report", "invoice", "total", "stream"]
+    return [" ".join(rnd.choice(words) for _ in range(14)) for _ in range(lines)]
+
+
+def scanned_pages(pdf: pikepdf.Pdf) -> None:
+    for page in range(6):
+        _add_page(pdf, [(_image_stream(pdf, _scan((1700, 2200), page), quality=90), (0, 0, *PAGE_SIZE))])
+
+
+def photo_brochure(pdf: pikepdf.Pdf) -> None:
+    for page in range(5):
+        _add_page(
+            pdf,
+            [
+                (_image_stream(pdf, _photo((1800, 1200), 100 + page)), (40, 420, 532, 355)),
+                (_image_stream(pdf, _photo((1200, 1200), 200 + page)), (40, 40, 260, 260)),
+                (_image_stream(pdf, _photo((1200, 900), 300 + page), flate=page % 2 == 1), (312, 40, 260, 195)),
+            ],
+        )
+
+
+def shared_logo_report(pdf: pikepdf.Pdf) -> None:
+    rnd = random.Random(7)
+    logo = _image_stream(pdf, _photo((900, 300), 7))
+    for page in range(12):
+        # Every fourth page embeds its own byte-identical copy of the logo.
+        page_logo = _image_stream(pdf, _photo((900, 300), 7)) if page % 4 == 3 else logo
+        photo = _image_stream(pdf, _photo((1000, 700), 400 + page))
+        _add_page(pdf, [(page_logo, (40, 720, 180, 60)), (photo, (40, 120, 532, 372))], _paragraph(rnd, 8))
+
+
+def text_only(pdf: pikepdf.Pdf) -> None:
+    rnd = random.Random(11)
+    for _ in range(30):
+        _add_page(pdf, [], _paragraph(rnd, 55))
+
+
+def alpha_images(pdf: pikepdf.Pdf) -> None:
+    for page in range(4):
+        image = _photo((1200, 900), 500 + page).convert("RGBA")
+        image.putalpha(Image.radial_gradient("L").resize(image.size))
+        _add_page(pdf, [(_image_stream(pdf, image), (60, 200, 492, 369))])
+
+
+def huge_image(pdf: pikepdf.Pdf) -> None:
+    _add_page(pdf, [(_image_stream(pdf, _photo((6000, 4000), 600), quality=95), (0, 198, 612, 396))])
+
+
+DOCUMENTS: dict[str, Callable[[pikepdf.Pdf], None]] = {
+    "scanned_pages": scanned_pages,
+    "photo_brochure": photo_brochure,
+    "shared_logo_report": shared_logo_report,
+    "text_only": text_only,
+    "alpha_images": alpha_images,
+    "huge_image": huge_image,
+}
+
+
+def build_corpus(directory: Path, names: Optional[list[str]] = None) -> dict[str, Path]:
+    """Write the corpus into ``directory``, reusing documents that already exist.
+
+    Documents live in a ``v{CORPUS_VERSION}`` subdirectory; bump the version whenever a
+    generator changes so stale files are never compared against new ones.
+    """
+    directory = directory / f"v{CORPUS_VERSION}"
+    directory.mkdir(parents=True, exist_ok=True)
+    paths: dict[str, Path] = {}
+    for name in names or list(DOCUMENTS):
+        path = directory / f"{name}.pdf"
+        if not path.exists():
+            with pikepdf.new() as pdf:
+                DOCUMENTS[name](pdf)
+                # Fixed /ID and no timestamps keep the output byte-identical across runs.
+                pdf.save(path, static_id=True, deterministic_id=False)
+        paths[name] = path
+    return paths
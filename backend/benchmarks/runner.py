@@ -0,0 +1,195 @@
+from __future__ import annotations
+
+import json
+import platform
+import resource
+import sys
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from multiprocessing import get_context
+from pathlib import Path
+from typing import Any, Iterator, Optional
+
+DEFAULT_TARGET_FRACTIONS = (0.5, 0.25, 0.1)
+
+
+class _Counters:
+    def __init__(self):
+        self.saves: Counter[str] = Counter()
+        self.decodes = 0
+        self.events: list[dict[str, Any]] = []
+
+
+@contextmanager
+def _instrumented(counters: _Counters) -> Iterator[None]:
+    """Count document saves and image decodes by wrapping the engine's own entry points."""
+    from app.services import compress, image_cache
+
+    save_document = compress._save_document
+    compress_open_image = compress.open_image
+    cache_open_image = image_cache.open_image
+
+    def counting_save(pdf, destination, *, profile: str = "final") -> None:
+        counters.saves[profile] += 1
+        save_document(pdf, destination, profile=profile)
+
+    def counting_open(open_image):
+        def wrapper(raw_image, **kwargs):
+            counters.decodes += 1
+            return open_image(raw_image, **kwargs)
+
+        return wrapper
+
+    compress._save_document = counting_save
+    compress.open_image = counting_open(compress_open_image)
+    image_cache.open_image = counting_open(cache_open_image)
+    try:
+        yield
+    finally:
+        compress._save_document = save_document
+        compress.open_image = compress_open_image
+        image_cache.open_image = cache_open_image
+
+
+def _peak_rss_mb() -> float:
+    # VmHWM belongs to this process image; ru_maxrss would carry over the peak of the
+    # parent that forked it (which generated the corpus).
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def run_case(document: str, source_path: str, target_fraction: float) -> dict[str, Any]:
+    """Compress one document to one target; runs in a fresh process so peak RSS is its own."""
+    from app.services.compress import compress_pdf
+
+    source = Path(source_path)
+    original_size = source.stat().st_size
+    target_bytes = int(original_size * target_fraction)
+    counters = _Counters()
+    baseline_rss_mb = _peak_rss_mb()
+
+    with tempfile.TemporaryDirectory() as scratch, _instrumented(counters):
+        started = time.perf_counter()
+        result = compress_pdf(
+            source,
+            Path(scratch) / "output.pdf",
+            target_bytes / (1024 * 1024),
+            progress=lambda event: counters.events.append(event.as_dict()),
+        )
+        wall_time = time.perf_counter() - started
+
+    trials = [event for event in counters.events if event["phase"] in ("probing", "saving")]
+    return {
+        "document": document,
+        "target_fraction": target_fraction,
+        "original_bytes": original_size,
+        "target_bytes": target_bytes,
+        "output_bytes": result.size_bytes,
+        "met_target": result.size_bytes <= target_bytes,
+        "size_vs_target": round(result.size_bytes / target_bytes, 4) if target_bytes else None,
+        "wall_time_s": round(wall_time, 3),
+        "baseline_rss_mb": round(baseline_rss_mb, 1),
+        "peak_rss_mb": round(_peak_rss_mb(), 1),
+        "saves": dict(counters.saves),
+        "decodes": counters.decodes,
+        "iterations": len(trials),
+        "trials": [
+            {key: event[key] for key in ("phase", "quality", "downscale_factor", "size_bytes")}
+            for event in trials
+        ],
+    }
+
+
+def run_benchmarks(
+    corpus: dict[str, Path],
+    *,
+    target_fractions: tuple[float, ...] = DEFAULT_TARGET_FRACTIONS,
+    repeat: int = 1,
+) -> dict[str, Any]:
+    from app.core.config import settings
+
+    cases = [
+        (name, str(path), fraction)
+        for name, path in corpus.items()
+        for fraction in target_fractions
+        for _ in range(repeat)
+    ]
+
+    results = []
+    # One process per case: peak RSS is per process, and no case warms caches for the next.
+    context = get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=context, max_tasks_per_child=1) as pool:
+        for case in cases:
+            result = pool.submit(run_case, *case).result()
+            results.append(result)
+            print(
+                f"{result['document']:<20} target={result['target_fraction']:<5} "
+                f"size/target={result['size_vs_target']} time={result['wall_time_s']}s "
+                f"rss={result['peak_rss_mb']}MB saves={sum(result['saves'].values())} "
+                f"decodes={result['decodes']}",
+                file=sys.stderr,
+            )
+
+    return {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": {
+            "COMPRESS_IMAGE_WORKERS": settings.COMPRESS_IMAGE_WORKERS,
+            "COMPRESS_SEARCH_SAVE_PROFILE": settings.COMPRESS_SEARCH_SAVE_PROFILE,
+            "IMAGE_CACHE_MAX_BYTES": settings.IMAGE_CACHE_MAX_BYTES,
+        },
+        "results": results,
+        "summary": _summarize(results),
+    }
+
+
+def _summarize(results: list[dict[str, Any]]) -> dict[str, Any]:
+    if not results:
+        return {}
+    return {
+        "cases": len(results),
+        "targets_met": sum(result["met_target"] for result in results),
+        "total_wall_time_s": round(sum(result["wall_time_s"] for result in results), 3),
+        "max_peak_rss_mb": max(result["peak_rss_mb"] for result in results),
+        "total_saves": sum(sum(result["saves"].values()) for result in results),
+        "total_decodes": sum(result["decodes"] for result in results),
+    }
+
+
+def write_report(report: dict[str, Any], output: Optional[Path]) -> None:
+    text = json.dumps(report, indent=2)
+    if output is None:
+        print(text)
+    else:
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(text + "\n")
+
+
+def print_comparison(baseline: dict[str, Any], report: dict[str, Any]) -> None:
+    """Print per-case changes in time, memory, saves and size against an earlier report."""
+    previous = {(result["document"], result["target_fraction"]): result for result in baseline["results"]}
+    for result in report["results"]:
+        before = previous.get((result["document"], result["target_fraction"]))
+        if before is None:
+            continue
+        print(
+            f"{result['document']:<20} target={result['target_fraction']:<5} "
+            f"time {before['wall_time_s']}s -> {result['wall_time_s']}s  "
+            f"rss {before['peak_rss_mb']}MB -> {result['peak_rss_mb']}MB  "
+            f"saves {sum(before['saves'].values())} -> {sum(result['saves'].values())}  "
+            f"size/target {before['size_vs_target']} -> {result['size_vs_target']}",
+            file=sys.stderr,
+        )
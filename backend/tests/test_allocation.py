@@ -0,0 +1,131 @@
+import itertools
+import random
+
+import pytest
+
+from app.services.allocation import OperatingPoint, RateCurve, allocate, quality_ladder
+
+
+def _random_points(rng, count=6):
+    return [
+        OperatingPoint(rng.randint(20, 95), 1.0, rng.randint(1_000, 100_000), rng.uniform(0, 1e6))
+        for _ in range(count)
+    ]
+
+
+def _random_curves(seed, images=4):
+    rng = random.Random(seed)
+    points = {f"image{index}": _random_points(rng) for index in range(images)}
+    return points, {key: RateCurve(image_points) for key, image_points in points.items()}
+
+
+def _optimum(points, budget):
+    """Least total distortion within ``budget`` over every combination of points."""
+    best = None
+    for choice in itertools.product(*points.values()):
+        if sum(point.size_bytes for point in choice) <= budget:
+            distortion = sum(point.distortion for point in choice)
+            best = distortion if best is None else min(best, distortion)
+    return best
+
+
+def _totals(chosen):
+    return (
+        sum(point.size_bytes for point in chosen.values()),
+        sum(point.distortion for point in chosen.values()),
+    )
+
+
+def test_rate_curve_hull_is_convex_and_frontier_undominated():
+    points = _random_points(random.Random(7), count=12)
+    curve = RateCurve(points)
+
+    sizes = [point.size_bytes for point in curve.points]
+    assert sizes == sorted(sizes, reverse=True)
+    slopes = [curve.slope(index) for index in range(len(curve.points) - 1)]
+    assert slopes == sorted(slopes)
+
+    for point in curve.frontier:
+        assert not any(
+            other.size_bytes <= point.size_bytes and other.distortion < point.distortion for other in points
+        )
+    for point in points:
+        assert any(
+            kept.size_bytes <= point.size_bytes and kept.distortion <= point.distortion
+            for kept in curve.frontier
+        )
+    assert curve.best_within(min(sizes) - 1) is None
+    assert curve.best_within(max(point.size_bytes for point in points)) is curve.frontier[-1]
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_allocate_matches_brute_force_at_hull_breakpoints(seed):
+    points, curves = _random_curves(seed)
+    # Every total the greedy passes through is optimal for that many bytes.
+    for budget in _breakpoints(curves):
+        chosen, _ = allocate(curves, budget)
+        size_bytes, distortion = _totals(chosen)
+        assert size_bytes <= budget
+        assert distortion == pytest.approx(_optimum(points, budget))
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_allocate_is_within_one_step_of_brute_force(seed):
+    points, curves = _random_curves(seed)
+    largest_step = max(
+        curve.points[index + 1].distortion - curve.points[index].distortion
+        for curve in curves.values()
+        for index in range(len(curve.points) - 1)
+    )
+    smallest = sum(curve.points[-1].size_bytes for curve in curves.values())
+    largest = sum(curve.points[0].size_bytes for curve in curves.values())
+    for budget in random.Random(seed).sample(range(smallest, largest), 10):
+        chosen, _ = allocate(curves, budget)
+        size_bytes, distortion = _totals(chosen)
+        assert size_bytes <= budget
+        assert distortion <= _optimum(points, budget) + largest_step + 1e-6
+
+
+def test_allocate_without_pressure_keeps_the_best_points():
+    _, curves = _random_curves(3)
+    chosen, slope = allocate(curves, 10**9)
+    assert slope == 0.0
+    assert all(chosen[key] is curve.points[0] for key, curve in curves.items())
+
+
+def test_allocate_over_budget_returns_the_smallest_points():
+    _, curves = _random_curves(4)
+    chosen, _ = allocate(curves, 0)
+    assert all(chosen[key] is curve.points[-1] for key, curve in curves.items())
+
+
+def test_at_slope_reproduces_the_allocation():
+    _, curves = _random_curves(5)
+    breakpoints = _breakpoints(curves)
+    budget = breakpoints[len(breakpoints) // 2]
+    chosen, slope = allocate(curves, budget)
+    assert all(curve.at_slope(slope) is chosen[key] for key, curve in curves.items())
+
+
+def test_quality_ladder():
+    assert quality_ladder(20, 95) == [95, 76, 58, 39, 20]
+    assert quality_ladder(60, 60) == [60]
+
+
+def _breakpoints(curves):
+    indexes = dict.fromkeys(curves, 0)
+    totals = [sum(curve.points[0].size_bytes for curve in curves.values())]
+    while True:
+        steps = [
+            (curve.slope(indexes[key]), key)
+            for key, curve in curves.items()
+            if indexes[key] + 1 < len(curve.points)
+        ]
+        if not steps:
+            return totals
+        _, key = min(steps)
+        curve = curves[key]
+        totals.append(
+            totals[-1] - curve.points[indexes[key]].size_bytes + curve.points[indexes[key] + 1].size_bytes
+        )
+        indexes[key] += 1
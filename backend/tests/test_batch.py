@@ -0,0 +1,74 @@
+import io
+import zipfile
+
+from app.models import TaskStatus
+from app.services.batch import aggregate_status, iter_zip_pdfs, stream_zip, unique_name
+
+
+def test_stream_zip_round_trips():
+    members = {"a.pdf": [b"%PDF-1.7 ", b"first"], "b.pdf": [], "nested name.pdf": [b"x" * 100_000]}
+    data = b"".join(stream_zip(members.items()))
+
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        assert archive.testzip() is None
+        assert archive.namelist() == list(members)
+        for name, chunks in members.items():
+            info = archive.getinfo(name)
+            assert info.compress_type == zipfile.ZIP_STORED
+            assert archive.read(name) == b"".join(chunks)
+
+
+def test_stream_zip_yields_before_reading_later_members():
+    consumed = []
+
+    def chunks(name):
+        for index in range(3):
+            consumed.append((name, index))
+            yield bytes(1000)
+
+    stream = stream_zip((name, chunks(name)) for name in ("one.pdf", "two.pdf"))
+    first = next(stream)
+    assert first.startswith(b"PK\x03\x04")
+    assert consumed == [("one.pdf", 0)]
+
+    # Nothing is buffered beyond the chunk being written.
+    assert all(len(piece) <= 1000 for piece in stream)
+    assert len(consumed) == 6
+
+
+def test_stream_zip_of_nothing_is_an_empty_archive():
+    with zipfile.ZipFile(io.BytesIO(b"".join(stream_zip([])))) as archive:
+        assert archive.namelist() == []
+
+
+def test_iter_zip_pdfs_skips_other_entries():
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        archive.writestr("docs/report.PDF", b"report")
+        archive.writestr("docs/", b"")
+        archive.writestr("notes.txt", b"notes")
+        archive.writestr("__MACOSX/docs/._report.pdf", b"resource fork")
+    buffer.seek(0)
+
+    assert [(name, entry.read()) for name, entry in iter_zip_pdfs(buffer)] == [("report.PDF", b"report")]
+
+
+def test_unique_name():
+    used: set[str] = set()
+    assert [unique_name(name, used) for name in ("a.pdf", "a.pdf", "a.pdf", "b.pdf")] == [
+        "a.pdf",
+        "a (1).pdf",
+        "a (2).pdf",
+        "b.pdf",
+    ]
+
+
+def test_aggregate_status():
+    queued, running = TaskStatus.QUEUED, TaskStatus.RUNNING
+    completed, failed = TaskStatus.COMPLETED, TaskStatus.FAILED
+    assert aggregate_status([queued, queued]) == "queued"
+    assert aggregate_status([queued, completed]) == "running"
+    assert aggregate_status([running, failed]) == "running"
+    assert aggregate_status([completed, completed]) == "completed"
+    assert aggregate_status([failed, failed]) == "failed"
+    assert aggregate_status([completed, failed]) == "partial"
@@ -0,0 +1,237 @@
+import io
+import os
+import zlib
+
+import pikepdf
+import pytest
+from PIL import Image
+
+from app.core.config import settings
+from app.services import compress
+from app.services.compress import compress_pdf
+
+MB = 1024 * 1024
+
+
+def _photo(width, height, seed=0):
+    # Smooth gradients with a little noise: compressible, but not trivially.
+    gradient = Image.linear_gradient("L").resize((width, height))
+    noise = Image.effect_noise((width, height), 40 + seed)
+    return Image.merge("RGB", (gradient, noise, gradient.rotate(90 + seed).resize((width, height))))
+
+
+def _add_image(pdf, page, name, image):
+    page.Resources.XObject[f"/{name}"] = image
+    width, height = int(image.Width), int(image.Height)
+    page.Contents = pdf.make_stream(
+        page.Contents.read_bytes() + f"q {width} 0 0 {height} 0 0 cm /{name} Do Q\n".encode()
+    )
+
+
+def _jpeg_image(pdf, pil_image, quality=95):
+    buffer = io.BytesIO()
+    pil_image.save(buffer, format="JPEG", quality=quality)
+    return pdf.make_stream(
+        buffer.getvalue(),
+        Type=pikepdf.Name.XObject,
+        Subtype=pikepdf.Name.Image,
+        Width=pil_image.width,
+        Height=pil_image.height,
+        ColorSpace=pikepdf.Name.DeviceRGB,
+        BitsPerComponent=8,
+        Filter=pikepdf.Name.DCTDecode,
+    )
+
+
+def _flate_image(pdf, data, width, height, color_space, bits):
+    return pdf.make_stream(
+        zlib.compress(data),
+        Type=pikepdf.Name.XObject,
+        Subtype=pikepdf.Name.Image,
+        Width=width,
+        Height=height,
+        ColorSpace=color_space,
+        BitsPerComponent=bits,
+        Filter=pikepdf.Name.FlateDecode,
+    )
+
+
+def _new_page(pdf, width=600, height=400):
+    pdf.add_blank_page(page_size=(width, height))
+    page = pdf.pages[-1]
+    page.Resources = pikepdf.Dictionary(XObject=pikepdf.Dictionary())
+    page.Contents = pdf.make_stream(b"")
+    return page
+
+
+def _photo_pdf(path, pages=3):
+    pdf = pikepdf.new()
+    for index in range(pages):
+        page = _new_page(pdf, 1200, 900)
+        _add_image(pdf, page, "Im0", _jpeg_image(pdf, _photo(1200, 900, seed=index)))
+    pdf.save(path)
+    return path
+
+
+def _raw_images(path):
+    with pikepdf.open(path) as pdf:
+        return {
+            str(name): image.read_raw_bytes()
+            for page in pdf.pages
+            for name, image in page.images.items()
+        }
+
+
+def test_undecodable_images_keep_their_bytes(tmp_path):
+    pdf = pikepdf.new()
+    page = _new_page(pdf, 1200, 900)
+    _add_image(pdf, page, "Photo", _jpeg_image(pdf, _photo(1200, 900)))
+    gray16 = _flate_image(pdf, os.urandom(300 * 200 * 2), 300, 200, pikepdf.Name.DeviceGray, 16)
+    tint = pdf.make_stream(b"{dup dup dup}", FunctionType=4, Domain=[0, 1], Range=[0, 1] * 4)
+    separation = pikepdf.Array([pikepdf.Name.Separation, pikepdf.Name("/Spot"), pikepdf.Name.DeviceCMYK, tint])
+    spot = _flate_image(pdf, os.urandom(300 * 200), 300, 200, separation, 8)
+    _add_image(pdf, page, "Gray16", gray16)
+    _add_image(pdf, page, "Spot", spot)
+    source = tmp_path / "in.pdf"
+    pdf.save(source)
+
+    target = source.stat().st_size * 0.6 / MB
+    result = compress_pdf(source, tmp_path / "out.pdf", target)
+
+    assert result.size_bytes <= target * MB
+    before, after = _raw_images(source), _raw_images(result.output_path)
+    assert after["/Gray16"] == before["/Gray16"]
+    assert after["/Spot"] == before["/Spot"]
+    assert len(after["/Photo"]) < len(before["/Photo"])
+
+
+def _text_pdf(path, pages=5, *, thumbnails=True):
+    # Uncompressed content, a font embedded once per page and page thumbnails: all
+    # things the lossless pass removes or shrinks.
+    pdf = pikepdf.new()
+    font_data = bytes(range(256)) * 40
+    for index in range(pages):
+        page = _new_page(pdf)
+        font_file = pdf.make_stream(font_data)
+        page.Resources.Font = pikepdf.Dictionary(
+            F1=pikepdf.Dictionary(
+                Type=pikepdf.Name.Font,
+                Subtype=pikepdf.Name.Type1,
+                BaseFont=pikepdf.Name("/Custom"),
+                FontDescriptor=pikepdf.Dictionary(Type=pikepdf.Name.FontDescriptor, FontFile=font_file),
+            )
+        )
+        page.Contents = pdf.make_stream(b"BT /F1 12 Tf 72 700 Td (Page %d) Tj ET\n" % index * 200)
+        if thumbnails:
+            page.obj.Thumb = pdf.make_stream(os.urandom(4000))
+    pdf.save(path, compress_streams=False)
+    return path
+
+
+@pytest.fixture(params=["memory", "temp file"])
+def spool_mode(request, monkeypatch):
+    if request.param == "temp file":
+        monkeypatch.setattr(settings, "COMPRESS_SPOOL_MAX_BYTES", 1)
+    return request.param
+
+
+def test_text_only_pdf_gets_the_optimized_copy(tmp_path, spool_mode):
+    source = _text_pdf(tmp_path / "in.pdf")
+    target_path = tmp_path / "out" / "out.pdf"
+    target_path.parent.mkdir()
+
+    result = compress_pdf(source, target_path, 1 / MB)  # far below anything reachable
+
+    assert result.output_path == target_path
+    assert result.size_bytes == target_path.stat().st_size < source.stat().st_size
+    assert os.listdir(target_path.parent) == ["out.pdf"]  # no temp file left behind
+    with pikepdf.open(target_path) as pdf:
+        assert len(pdf.pages) == 5
+        assert "/Thumb" not in pdf.pages[0].obj
+
+
+def test_original_is_kept_when_the_lossless_pass_saves_nothing(tmp_path, spool_mode):
+    # A document the pass already optimized has nothing left to drop.
+    optimized = compress_pdf(_text_pdf(tmp_path / "in.pdf"), tmp_path / "once.pdf", 1 / MB)
+    target_path = tmp_path / "out" / "out.pdf"
+    target_path.parent.mkdir()
+
+    result = compress_pdf(optimized.output_path, target_path, 1 / MB)
+
+    assert target_path.read_bytes() == optimized.output_path.read_bytes()
+    assert result.size_bytes == optimized.size_bytes
+    assert os.listdir(target_path.parent) == ["out.pdf"]
+
+
+def test_document_under_target_is_copied(tmp_path):
+    source = _text_pdf(tmp_path / "in.pdf")
+    result = compress_pdf(source, tmp_path / "out.pdf", 10)
+    assert result.output_path.read_bytes() == source.read_bytes()
+
+
+def test_target_is_written_once(tmp_path, monkeypatch, spool_mode):
+    source = _photo_pdf(tmp_path / "in.pdf")
+    target_path = tmp_path / "out.pdf"
+    save_candidate = compress._save_candidate
+    writes = []
+
+    def checked_save_candidate(*args, **kwargs):
+        assert not target_path.exists(), "the target was written before the search ended"
+        return save_candidate(*args, **kwargs)
+
+    def recording(write_to):
+        def wrapper(self, path):
+            writes.append(path)
+            return write_to(self, path)
+
+        return wrapper
+
+    monkeypatch.setattr(compress, "_save_candidate", checked_save_candidate)
+    monkeypatch.setattr(compress._Candidate, "write_to", recording(compress._Candidate.write_to))
+    monkeypatch.setattr(compress._OptimizedSource, "write_to", recording(compress._OptimizedSource.write_to))
+
+    result = compress_pdf(source, target_path, source.stat().st_size * 0.5 / MB)
+
+    assert writes == [target_path]
+    assert result.size_bytes == target_path.stat().st_size <= source.stat().st_size * 0.5
+
+
+def test_larger_candidates_never_replace_the_optimized_copy(tmp_path, monkeypatch):
+    source = _photo_pdf(tmp_path / "in.pdf")
+    optimized = compress._save_optimized(source, tmp_path / "unused.pdf", preserve_metadata=False)
+    save_candidate = compress._save_candidate
+
+    def padded_save_candidate(*args, **kwargs):
+        # Every candidate comes out bigger than the optimized copy.
+        candidate = save_candidate(*args, **kwargs)
+        candidate.buffer.seek(0, io.SEEK_END)
+        candidate.buffer.write(b"%" * (optimized.size_bytes + 1))
+        candidate.size_bytes = candidate.buffer.tell()
+        return candidate
+
+    monkeypatch.setattr(compress, "_save_candidate", padded_save_candidate)
+    result = compress_pdf(source, tmp_path / "out.pdf", source.stat().st_size * 0.5 / MB)
+
+    assert result.size_bytes == optimized.size_bytes
+    assert result.output_path.stat().st_size == optimized.size_bytes
+    optimized.close()
+
+
+@pytest.mark.parametrize("share", [0.6, 0.35, 0.2])
+def test_search_lands_in_the_target_band(tmp_path, monkeypatch, share):
+    source = _photo_pdf(tmp_path / "in.pdf", pages=4)
+    target_bytes = int(source.stat().st_size * share)
+    search_trials = compress._search_trials
+    new_budgets = []
+
+    def counting_search_trials(estimator, target, *, max_iterations):
+        tried = len(estimator.budgets)
+        trials = search_trials(estimator, target, max_iterations=max_iterations)
+        new_budgets.append(len(estimator.budgets) - tried)
+        return trials
+
+    monkeypatch.setattr(compress, "_search_trials", counting_search_trials)
+    result = compress_pdf(source, tmp_path / "out.pdf", target_bytes / MB, max_iterations=4)
+
+    assert target_bytes * (1 - compress._TOLERANCE) <= result.size_bytes <= target_bytes
+    assert new_budgets and all(count <= 4 for count in new_budgets)
@@ -0,0 +1,58 @@
+import pytest
+from fastapi import HTTPException
+
+from app.api.routes import _etag_matches, _parse_range
+
+ETAG = '"abc123"'
+
+
+@pytest.mark.parametrize(
+    "header, expected",
+    [
+        ("bytes=0-99", (0, 99)),
+        ("bytes=100-199", (100, 199)),
+        ("bytes=900-", (900, 999)),  # open-ended
+        ("bytes=-100", (900, 999)),  # suffix
+        ("bytes=-5000", (0, 999)),  # suffix longer than the file
+        ("bytes=990-5000", (990, 999)),  # end past the file is clamped
+        ("BYTES = 0-0", (0, 0)),
+    ],
+)
+def test_parse_range(header, expected):
+    assert _parse_range(header, 1000) == expected
+
+
+@pytest.mark.parametrize(
+    "header",
+    [
+        "items=0-99",  # unknown unit
+        "bytes=0-9,20-29",  # multiple ranges
+        "bytes=abc-",
+        "bytes=-0",
+        "bytes=-",
+        "bytes=50-10",  # last before first
+    ],
+)
+def test_parse_range_ignores_unusable_headers(header):
+    assert _parse_range(header, 1000) is None
+
+
+@pytest.mark.parametrize("header, size", [("bytes=1000-", 1000), ("bytes=2000-3000", 1000), ("bytes=-10", 0)])
+def test_parse_range_unsatisfiable(header, size):
+    with pytest.raises(HTTPException) as raised:
+        _parse_range(header, size)
+    assert raised.value.status_code == 416
+    assert raised.value.headers == {"Content-Range": f"bytes */{size}"}
+
+
+@pytest.mark.parametrize(
+    "header",
+    [ETAG, f"W/{ETAG}", "*", f'"other", {ETAG}', f' "other" ,W/{ETAG} '],
+)
+def test_etag_matches(header):
+    assert _etag_matches(header, ETAG)
+
+
+@pytest.mark.parametrize("header", ['"other"', "abc123", '"abc"', ""])
+def test_etag_does_not_match(header):
+    assert not _etag_matches(header, ETAG)
@@ -0,0 +1,49 @@
+import io
+import zlib
+
+import pikepdf
+from PIL import Image
+
+from app.services.compress import _map_images
+from app.services.image_cache import ImageCache
+
+
+def _image(pdf, data, filter_name, size=(800, 600)):
+    width, height = size
+    return pdf.make_indirect(
+        pikepdf.Stream(
+            pdf,
+            data,
+            Type=pikepdf.Name.XObject,
+            Subtype=pikepdf.Name.Image,
+            Width=width,
+            Height=height,
+            ColorSpace=pikepdf.Name.DeviceRGB,
+            BitsPerComponent=8,
+            Filter=filter_name,
+        )
+    )
+
+
+def test_draft_sizes_bypass_the_cache_only_for_reduced_decodes():
+    pdf = pikepdf.new()
+    pixels = Image.new("RGB", (800, 600), (10, 200, 30))
+    jpeg = io.BytesIO()
+    pixels.save(jpeg, format="JPEG")
+    dct = _image(pdf, jpeg.getvalue(), pikepdf.Name.DCTDecode)
+    flate = _image(pdf, zlib.compress(pixels.tobytes()), pikepdf.Name.FlateDecode)
+    image_cache = ImageCache()
+
+    sizes = _map_images(
+        [dct, flate],
+        lambda key, pil_image: pil_image.size,
+        image_cache=image_cache,
+        workers=1,
+        draft_sizes={dct.objgen: (200, 150), flate.objgen: (200, 150)},
+    )
+
+    # libjpeg decoded the JPEG at 1/4 scale; Flate data has no draft mode.
+    assert sizes == {dct.objgen: (200, 150), flate.objgen: (800, 600)}
+    assert image_cache.lookup(dct.objgen)[0] is False
+    assert image_cache.lookup(flate.objgen)[0] is True
+    image_cache.close()
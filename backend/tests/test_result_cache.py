@@ -0,0 +1,182 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.core.config import settings
+from app.core.database import Base
+from app.models import CacheStatus, CompressionTask, CostClass, ResultCacheEntry, TaskStatus
+from app.services import result_cache
+from app.services.result_cache import CacheAttachment
+
+
+@pytest.fixture
+def sessions(tmp_path):
+    # A file database, so separate sessions see only what the others committed.
+    engine = create_engine(f"sqlite:///{tmp_path / 'db.sqlite3'}")
+    Base.metadata.create_all(engine)
+    factory = sessionmaker(bind=engine)
+    opened = []
+
+    def open_session():
+        session = factory()
+        opened.append(session)
+        return session
+
+    yield open_session
+    for session in opened:
+        session.close()
+    engine.dispose()
+
+
+def _task(task_id, sha256="a" * 64, **fields):
+    now = datetime.utcnow()
+    values = dict(
+        id=task_id,
+        status=TaskStatus.QUEUED,
+        original_filename=f"{task_id}.pdf",
+        original_file_path=f"original/{task_id}.pdf",
+        original_size_bytes=1000,
+        original_sha256=sha256,
+        target_size_mb=1.0,
+        min_quality=20,
+        max_iterations=6,
+        preserve_metadata=False,
+        cost_class=CostClass.SMALL,
+        created_at=now,
+        updated_at=now,
+    )
+    values.update(fields)
+    return CompressionTask(**values)
+
+
+def _finish(db, task, size_bytes=500):
+    task.status = TaskStatus.COMPLETED
+    task.compressed_file_path = f"compressed/{task.id}.pdf"
+    task.compressed_size_bytes = size_bytes
+    db.commit()
+    return result_cache.complete(db, task)
+
+
+def test_leader_follower_and_hit(sessions):
+    db = sessions()
+    leader, follower = _task("leader"), _task("follower")
+    assert result_cache.add_tasks(db, [leader, follower]) == [CacheAttachment.LEADER, CacheAttachment.FOLLOWER]
+
+    assert _finish(db, leader) == ["follower"]
+    db.refresh(follower)
+    assert follower.status == TaskStatus.COMPLETED
+    assert follower.compressed_file_path == "compressed/leader.pdf"
+
+    hit = _task("hit")
+    assert result_cache.add_tasks(db, [hit]) == [CacheAttachment.HIT]
+    assert hit.status == TaskStatus.COMPLETED
+    assert hit.compressed_size_bytes == 500
+
+
+def test_different_parameters_do_not_share(sessions):
+    db = sessions()
+    attachments = result_cache.add_tasks(db, [_task("one"), _task("two", target_size_mb=2.0)])
+    assert attachments == [CacheAttachment.LEADER, CacheAttachment.LEADER]
+
+
+def test_entry_is_invisible_until_its_task_commits(sessions):
+    db, other = sessions(), sessions()
+    task = _task("leader")
+    db.add(task)
+    assert result_cache.attach(db, task) == CacheAttachment.LEADER
+    assert other.get(ResultCacheEntry, task.cache_key) is None
+
+    db.rollback()
+    assert other.get(ResultCacheEntry, task.cache_key) is None
+
+
+def test_losing_the_insert_race_follows_the_winner(sessions, monkeypatch):
+    db, other = sessions(), sessions()
+    original_get = db.get
+    raced = []
+
+    def get(entity, key):
+        if entity is ResultCacheEntry and not raced:
+            # An identical upload commits its entry between our lookup and our insert.
+            raced.append(result_cache.add_tasks(other, [_task("winner")]))
+            return None
+        return original_get(entity, key)
+
+    monkeypatch.setattr(db, "get", get)
+    loser = _task("loser")
+    assert result_cache.add_tasks(db, [loser]) == [CacheAttachment.FOLLOWER]
+    assert raced == [[CacheAttachment.LEADER]]
+    assert db.get(CompressionTask, "loser").cache_key == loser.cache_key
+
+
+def test_stale_leader_is_taken_over(sessions):
+    db = sessions()
+    stale = datetime.utcnow() - timedelta(seconds=settings.COST_SMALL_SOFT_TIME_LIMIT + settings.TASK_TIME_LIMIT_GRACE + 1)
+    lost = _task("lost", updated_at=stale)
+    assert result_cache.add_tasks(db, [lost]) == [CacheAttachment.LEADER]
+
+    retry = _task("retry")
+    assert result_cache.add_tasks(db, [retry]) == [CacheAttachment.LEADER]
+    assert db.get(ResultCacheEntry, retry.cache_key).leader_task_id == "retry"
+
+    # The lost leader now waits on the new one like any follower.
+    assert _finish(db, retry) == ["lost"]
+
+
+def test_live_leader_is_followed(sessions):
+    db = sessions()
+    result_cache.add_tasks(db, [_task("leader", status=TaskStatus.RUNNING)])
+    assert result_cache.add_tasks(db, [_task("follower")]) == [CacheAttachment.FOLLOWER]
+
+
+def test_fail_fails_followers_and_drops_entry(sessions):
+    db = sessions()
+    leader, follower = _task("leader"), _task("follower")
+    result_cache.add_tasks(db, [leader, follower])
+
+    leader.status = TaskStatus.FAILED
+    leader.error_message = "broken"
+    db.commit()
+    assert result_cache.fail(db, leader) == ["follower"]
+
+    db.refresh(follower)
+    assert follower.status == TaskStatus.FAILED
+    assert follower.error_message == "broken"
+    assert db.get(ResultCacheEntry, leader.cache_key) is None
+    assert result_cache.add_tasks(db, [_task("retry")]) == [CacheAttachment.LEADER]
+
+
+def test_evict_drops_expired_then_least_recently_used(sessions, monkeypatch):
+    db = sessions()
+    monkeypatch.setattr(settings, "RESULT_CACHE_INDEX_MAX_BYTES", 1000)
+    now = datetime.utcnow()
+    ages = {"expired": settings.RESULT_CACHE_TTL_SECONDS + 60, "old": 120, "recent": 60, "new": 0}
+    tasks = {name: _task(name, sha256=name * 2) for name in ages}
+    for name, task in tasks.items():
+        result_cache.add_tasks(db, [task])
+        _finish(db, task, size_bytes=400)
+        db.get(ResultCacheEntry, task.cache_key).last_used_at = now - timedelta(seconds=ages[name])
+    db.commit()
+
+    result_cache.evict(db)
+
+    remaining = {entry.leader_task_id for entry in db.query(ResultCacheEntry)}
+    assert remaining == {"recent", "new"}
+    # Evicting an entry never takes a task's download away.
+    for task in tasks.values():
+        db.refresh(task)
+        assert task.compressed_file_path == f"compressed/{task.id}.pdf"
+
+
+def test_evict_keeps_pending_entries(sessions, monkeypatch):
+    db = sessions()
+    monkeypatch.setattr(settings, "RESULT_CACHE_INDEX_MAX_BYTES", 0)
+    task = _task("pending")
+    result_cache.add_tasks(db, [task])
+    db.get(ResultCacheEntry, task.cache_key).last_used_at = datetime(2000, 1, 1)
+    db.commit()
+
+    result_cache.evict(db)
+    assert db.get(ResultCacheEntry, task.cache_key).status == CacheStatus.PENDING
@@ -0,0 +1,108 @@
+import math
+
+import pytest
+
+from app.services.compress import _MIN_BRACKET, _TOLERANCE, _interpolate_budget, _search_trials, _Trial
+
+
+def _trial(image_bytes, *, model_bytes=None, slope=1.0):
+    return _Trial({}, image_bytes, image_bytes if model_bytes is None else model_bytes, slope)
+
+
+class _ModelEstimator:
+    """Stands in for _SizeEstimator: image bytes follow ``rate(budget)``, and no allocation
+    goes below ``floor`` bytes (every image at min_quality and the smallest scale)."""
+
+    overhead = 10_000
+    correction = 0
+
+    def __init__(self, rate, *, floor=0, full=10**9):
+        self.rate = rate
+        self.floor = floor
+        self.full = full
+        self.budgets = {}
+
+    def image_budget(self, target_bytes):
+        return target_bytes - self.overhead
+
+    def trial(self, budget):
+        model_bytes = min(max(budget, self.floor), self.full)
+        slope = 0.0 if budget >= self.full else 1.0
+        trial = _trial(max(self.floor, min(self.rate(budget), self.full)), model_bytes=model_bytes, slope=slope)
+        self.budgets[budget] = trial
+        return trial
+
+    def predict(self, trial):
+        return self.overhead + trial.image_bytes + self.correction
+
+
+def test_interpolation_is_exact_on_a_power_law():
+    # log(bytes) linear in log(budget): one interpolation lands on the needed bytes.
+    def rate(budget):
+        return 3 * budget**0.7
+
+    below, above = 10_000, 1_000_000
+    budgets = {below: _trial(rate(below)), above: _trial(rate(above))}
+    needed = rate(150_000)
+    assert _interpolate_budget(budgets, round(needed), below, above, bisect=False) == pytest.approx(150_000, rel=1e-3)
+
+
+@pytest.mark.parametrize("needed", [1, 5_000, 20_000, 50_000, 10**9])
+def test_interpolation_stays_inside_the_bracket(needed):
+    below, above = 10_000, 100_000
+    budgets = {below: _trial(8_000), above: _trial(60_000)}
+    budget = _interpolate_budget(budgets, needed, below, above, bisect=False)
+    assert below * _MIN_BRACKET <= budget <= above / _MIN_BRACKET
+
+
+@pytest.mark.parametrize("needed", [1, 8_001, 59_999, 10**9])
+def test_interpolation_falls_back_to_the_midpoint_near_the_ends(needed):
+    # Points that would barely move the bracket are replaced by its geometric middle.
+    below, above = 10_000, 100_000
+    budgets = {below: _trial(8_000), above: _trial(60_000)}
+    assert _interpolate_budget(budgets, needed, below, above, bisect=False) == round(math.sqrt(below * above))
+
+
+def test_interpolation_bisects_on_request_and_on_flat_sizes():
+    below, above = 10_000, 40_000
+    midpoint = round(math.sqrt(below * above))
+    assert _interpolate_budget({below: _trial(8_000), above: _trial(30_000)}, 20_000, below, above, bisect=True) == midpoint
+    # Sizes that did not grow with the budget give no slope to follow.
+    assert _interpolate_budget({below: _trial(9_000), above: _trial(9_000)}, 20_000, below, above, bisect=False) == midpoint
+
+
+@pytest.mark.parametrize("scale", [0.7, 1.0, 1.4])
+@pytest.mark.parametrize("bend", [-0.2, 0.0, 0.2])
+@pytest.mark.parametrize("target_bytes", [60_000, 300_000, 2_000_000])
+def test_search_lands_in_the_band(scale, bend, target_bytes):
+    # The encoder misses the curves' predictions by a constant factor and a size-dependent bend.
+    estimator = _ModelEstimator(lambda budget: scale * budget * (max(budget, 1) / 100_000) ** bend)
+    trials = _search_trials(estimator, target_bytes, max_iterations=6)
+
+    assert len(estimator.budgets) <= 6
+    predicted = [estimator.predict(trial) for trial in trials]
+    assert any(target_bytes * (1 - _TOLERANCE) <= size <= target_bytes for size in predicted)
+
+
+def test_search_stops_at_min_quality():
+    # Every image at its smallest point still misses: one trial shows it and the search stops.
+    estimator = _ModelEstimator(lambda budget: budget, floor=500_000)
+    trials = _search_trials(estimator, 200_000, max_iterations=6)
+
+    assert len(trials) <= 2
+    assert all(trial.image_bytes == 500_000 for trial in trials)
+    assert all(budget >= 0 for budget in estimator.budgets)
+
+
+def test_search_stops_when_nothing_has_to_give():
+    estimator = _ModelEstimator(lambda budget: budget, full=50_000)
+    trials = _search_trials(estimator, 1_000_000, max_iterations=6)
+    assert len(trials) == 1
+    assert trials[0].slope == 0
+
+
+def test_search_respects_max_iterations():
+    # A noisy rate the interpolation cannot model still ends within the iteration budget.
+    estimator = _ModelEstimator(lambda budget: budget * (1.5 if (budget // 997) % 2 else 0.6))
+    _search_trials(estimator, 500_000, max_iterations=3)
+    assert len(estimator.budgets) <= 3
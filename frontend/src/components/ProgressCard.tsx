@@ -1,9 +1,9 @@
 'use client'
 
-import { useEffect } from 'react'
+import { useEffect, useState } from 'react'
 import { useRouter } from 'next/navigation'
 import useSWR from 'swr'
-import { getTaskStatus } from '@/lib/api'
+import { TaskProgress, getTaskStatus, subscribeToTask } from '@/lib/api'
 
 interface ProgressCardProps {
   taskId: string
@@ -11,12 +11,16 @@ interface ProgressCardProps {
 
 export default function ProgressCard({ taskId }: ProgressCardProps) {
   const router = useRouter()
-  const { data, error, isLoading } = useSWR(
+  const [progress, setProgress] = useState<TaskProgress | null>(null)
+  // Live events replace polling; polling only resumes if the event stream is unavailable.
+  const [streamFailed, setStreamFailed] = useState(false)
+  const { data, error, isLoading, mutate } = useSWR(
     taskId,
     () => getTaskStatus(taskId),
     {
+      revalidateOnFocus: false,
       refreshInterval: (data) => {
-        if (data?.status === 'completed' || data?.status === 'failed') {
+        if (!streamFailed || data?.status === 'completed' || data?.status === 'failed') {
           return 0
         }
         return 2000
@@ -24,6 +28,14 @@ export default function ProgressCard({ taskId }: ProgressCardProps) {
     }
   )
 
+  useEffect(() => {
+    return subscribeToTask(taskId, {
+      onStatus: (status) => mutate(status, { revalidate: false }),
+      onProgress: setProgress,
+      onError: () => setStreamFailed(true),
+    })
+  }, [taskId, mutate])
+
   useEffect(() => {
     if (data?.status === 'completed') {
       setTimeout(() => {
@@ -67,13 +79,21 @@ export default function ProgressCard({ taskId }: ProgressCardProps) {
             <div
               className="h-2 rounded-full bg-gradient-to-r from-blue-500 to-blue-400 transition-all duration-300"
               style={{
-                width: data.status === 'running' ? '60%' : '20%',
+                width: data.status === 'running' ? progressWidth(progress) : '20%',
                 animation: 'pulse 2s cubic-bezier(0.4, 0, 0.6, 1) infinite',
               }}
             />
           </div>
         )}
 
+        {data.status === 'running' && progress && (
+          <p className="text-sm text-slate-400">
+            {phaseLabel(progress.phase)}
+            {progress.quality != null && ` · 质量 ${progress.quality}`}
+            {progress.size_bytes != null && ` · 当前 ${(progress.size_bytes / (1024 * 1024)).toFixed(2)} MB`}
+          </p>
+        )}
+
         <div className="grid grid-cols-2 gap-4 rounded-2xl border border-slate-800 bg-slate-950 p-4">
           <div>
             <div className="text-xs font-medium uppercase text-slate-500">原始大小</div>
@@ -98,3 +118,29 @@ export default function ProgressCard({ taskId }: ProgressCardProps) {
     </div>
   )
 }
+
+function phaseLabel(phase: TaskProgress['phase']): string {
+  switch (phase) {
+    case 'analyzing':
+      return '分析文档'
+    case 'probing':
+    case 'saving':
+      return '尝试压缩参数'
+    case 'encoding':
+      return '分片压缩图像'
+    case 'merging':
+      return '合并结果'
+    case 'finished':
+      return '保存结果'
+  }
+}
+
+function progressWidth(progress: TaskProgress | null): string {
+  if (!progress) {
+    return '30%'
+  }
+  if (progress.phase === 'finished' || progress.phase === 'merging') {
+    return '95%'
+  }
+  return `${Math.min(40 + progress.iteration * 10, 90)}%`
+}
@@ -40,3 +40,40 @@ export async function getTaskStatus(taskId: string): Promise<TaskStatus> {
   const response = await api.get(`/v1/tasks/${taskId}`)
   return response.data
 }
+
+export interface TaskProgress {
+  task_id: string
+  phase: 'analyzing' | 'probing' | 'saving' | 'encoding' | 'merging' | 'finished'
+  iteration: number
+  quality?: number | null
+  downscale_factor?: number | null
+  size_bytes?: number | null
+  target_bytes?: number | null
+}
+
+export interface TaskEventHandlers {
+  onStatus: (status: TaskStatus) => void
+  onProgress: (progress: TaskProgress) => void
+  onError: () => void
+}
+
+export function subscribeToTask(taskId: string, handlers: TaskEventHandlers): () => void {
+  const source = new EventSource(`${API_BASE}/v1/tasks/${taskId}/events`)
+
+  source.addEventListener('status', (event) => {
+    const status = JSON.parse((event as MessageEvent).data) as TaskStatus
+    handlers.onStatus(status)
+    if (status.status === 'completed' || status.status === 'failed') {
+      source.close()
+    }
+  })
+  source.addEventListener('progress', (event) => {
+    handlers.onProgress(JSON.parse((event as MessageEvent).data) as TaskProgress)
+  })
+  source.onerror = () => {
+    source.close()
+    handlers.onError()
+  }
+
+  return () => source.close()
+}